@@ -1,18 +1,38 @@
+import importlib
+import logging
+
 import streamlit as st
-from pages import home, medpali, contact, chatbot, medreco, dashboard, segmentation
+from core import startup
+
+# Models named in ANIMA_PRELOAD load in the background while the first page renders
+startup.start_preload()
 
+# Page label -> module in pages/. A page's module, and with it torch, transformers or plotly, is only imported
+# the first time the page is opened, so light pages come up at once and a page that fails to import does not
+# take the others down. python -m benchmarks.startup_profile measures the difference.
 pages = {
-    "Home": home,
-    "Discussion": chatbot,
-    "MedPali": medpali,
-    "Recommendation": medreco,
-    "Detection": segmentation,
-    "Dashboard": dashboard,
-    "Contact": contact
+    "Home": "home",
+    "Discussion": "chatbot",
+    "MedPali": "medpali",
+    "Recommendation": "medreco",
+    "Detection": "segmentation",
+    "Dashboard": "dashboard",
+    "Contact": "contact"
 }
 
+def load_page(name):
+    try:
+        return importlib.import_module(f"pages.{name}")
+    except Exception as e:
+        # Not cached in sys.modules: the import is retried on the next rerun
+        logging.exception(f"Page '{name}' failed to import")
+        st.error(f"This page is unavailable right now: {e}")
+        return None
+
 st.sidebar.title("Navigation")
 page = st.sidebar.radio("Go to", options=list(pages.keys()))
 
 if page in pages:
-    pages[page].show()
+    module = load_page(pages[page])
+    if module is not None:
+        module.show()
@@ -0,0 +1,83 @@
+"""Measures shared-base mode against tiny random models: the memory of one base with two LoRA adapters against
+two full models, the cost of switching adapters, unmerged and merged, and generation latency in each mode.
+
+Run from the webapp directory:
+
+    python -m benchmarks.adapters --rank 16 --requests 40
+"""
+import argparse
+import copy
+import os
+import statistics
+import tempfile
+import time
+
+import torch
+from peft import LoraConfig, get_peft_model
+
+from benchmarks.tiny_models import tiny_gemma
+from core.adapters import TARGET_MODULES, AdapterModel, SharedBase
+
+PAGES = ("chatbot", "medreco")
+# Request sequences: both pages taking turns, and one page serving nine requests in ten
+PATTERNS = {
+    "alternating": lambda i: PAGES[i % 2],
+    "hot": lambda i: PAGES[1] if i % 10 == 9 else PAGES[0],
+}
+MODES = {"unmerged": "0", "merged": PAGES[0], "auto": "auto"}
+
+
+def save_random_adapter(base, path, rank, seed):
+    # Random rather than zero-initialized B matrices, so an adapter actually changes the base's outputs
+    torch.manual_seed(seed)
+    config = LoraConfig(r=rank, lora_alpha=rank, target_modules=list(TARGET_MODULES), init_lora_weights=False,
+                        task_type="CAUSAL_LM")
+    get_peft_model(copy.deepcopy(base), config).save_pretrained(path)
+
+
+@torch.inference_mode()
+def generate_seconds(model, input_ids, new_tokens):
+    start_time = time.perf_counter()
+    model.generate(input_ids, max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False)
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rank", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=40, help="requests per mode and pattern")
+    parser.add_argument("--new-tokens", type=int, default=16)
+    args = parser.parse_args()
+
+    tokenizer, base = tiny_gemma("tiny/gemma")
+    input_ids = tokenizer.encode("What are the early symptoms of type 2 diabetes?", return_tensors="pt")
+    with tempfile.TemporaryDirectory(prefix="adapters-") as adapter_dir:
+        sources = {}
+        for seed, name in enumerate(PAGES, start=1):
+            sources[name] = os.path.join(adapter_dir, name)
+            save_random_adapter(base, sources[name], args.rank, seed)
+
+        full_seconds = [generate_seconds(base, input_ids, args.new_tokens) for _ in range(args.requests)]
+        print(f"{'mode':<10}{'pattern':<13}{'p50 ms':>9}{'switches':>10}{'merges':>8}{'switch ms':>11}")
+        print(f"{'full':<10}{'-':<13}{1000 * statistics.median(full_seconds):>9.1f}")
+        for mode, merge in MODES.items():
+            for pattern, page_for in PATTERNS.items():
+                shared = SharedBase(copy.deepcopy(base), "tiny/gemma", merge=merge)
+                views = {}
+                for name, source in sources.items():
+                    shared.add(name, source)
+                    views[name] = AdapterModel(shared, name)
+                seconds = [generate_seconds(views[page_for(i)], input_ids, args.new_tokens)
+                           for i in range(args.requests)]
+                stats = shared.stats()
+                print(f"{mode:<10}{pattern:<13}{1000 * statistics.median(seconds):>9.1f}{stats['switches']:>10}"
+                      f"{stats['merges']:>8}{stats['mean_switch_ms']:>11.2f}")
+
+    full_mb = stats["base_mb"] * len(PAGES)
+    shared_mb = stats["base_mb"] + stats["adapter_mb"]
+    print(f"\nWeights: {full_mb:.2f} MB as {len(PAGES)} full models, {shared_mb:.2f} MB shared "
+          f"(base {stats['base_mb']:.2f} MB + adapters {stats['adapter_mb']:.2f} MB), {stats['saved_mb']:.2f} MB saved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Measures replica cold start: each configuration runs in a fresh process that imports a page, loads its
+model and serves one request, with the model read from the hub cache or from the local snapshot, and with
+warmup off or on.
+
+Real models are used, so snapshot them first (python -m core.model_store). Run from the webapp directory:
+
+    python -m benchmarks.cold_start --model medreco
+    python -m benchmarks.cold_start --model segmentation --repeats 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Runs in the child process; prints one JSON line of timings
+CHILD = r'''
+import importlib, json, sys, time
+import psutil
+process_start = psutil.Process().create_time()
+name = sys.argv[1]
+
+start_time = time.perf_counter()
+page = importlib.import_module(f"pages.{name}")
+from core.model_registry import registry
+import_seconds = time.perf_counter() - start_time
+
+loaded = registry.get(name)
+ready_seconds = time.time() - process_start
+
+start_time = time.perf_counter()
+if name == "chatbot":
+    page.generate_replies([("What are the early symptoms of type 2 diabetes?", [])])
+elif name == "medreco":
+    model, tokenizer = loaded
+    list(page.model_predict_batch(model, tokenizer, ["Patient: 54 years old, hypertension, smoker."]))
+elif name == "medpali":
+    from PIL import Image
+    page.generate_answers([Image.new("RGB", (448, 448), "gray")], ["caption en"])
+else:
+    import torch
+    tensor = torch.rand(3, *page.Configs.IMAGE_SIZE[::-1])
+    page.predict_batch([tensor], [(512, 512)])
+first_request_seconds = time.perf_counter() - start_time
+
+stats = {entry["model"]: entry for entry in registry.snapshot()}[name]
+print(json.dumps({
+    "import_seconds": import_seconds,
+    "load_seconds": stats["last_load_seconds"],
+    "warmup_seconds": stats["last_warmup_seconds"],
+    "ready_seconds": ready_seconds,
+    "first_request_seconds": first_request_seconds,
+}))
+'''
+
+
+def run_child(name, snapshot, warmup):
+    env = dict(os.environ, ANIMA_WARMUP="1" if warmup else "0", ANIMA_INFERENCE_LOG="0", ANIMA_RESPONSE_CACHE="0",
+               ANIMA_INFERENCE_URL="")
+    with tempfile.TemporaryDirectory() as empty_dir:
+        if not snapshot:
+            env["ANIMA_MODEL_DIR"] = empty_dir
+        result = subprocess.run([sys.executable, "-c", CHILD, name], env=env, capture_output=True, text=True,
+                                check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="medreco", choices=["chatbot", "medreco", "medpali", "segmentation"])
+    parser.add_argument("--repeats", type=int, default=1)
+    args = parser.parse_args()
+
+    columns = ("import_seconds", "load_seconds", "warmup_seconds", "ready_seconds", "first_request_seconds")
+    print(f"{'source':<10}{'warmup':<8}" + "".join(f"{column.replace('_seconds', ''):>15}" for column in columns))
+    for snapshot in (False, True):
+        for warmup in (False, True):
+            runs = [run_child(args.model, snapshot, warmup) for _ in range(args.repeats)]
+            means = {column: sum(run[column] for run in runs) / len(runs) for column in columns}
+            print(f"{'snapshot' if snapshot else 'hub':<10}{'on' if warmup else 'off':<8}"
+                  + "".join(f"{means[column]:>15.2f}" for column in columns))
+
+
+if __name__ == "__main__":
+    main()
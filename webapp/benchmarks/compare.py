@@ -0,0 +1,63 @@
+"""Compares two benchmark result files and flags regressions.
+
+    python -m benchmarks.compare benchmarks/results/OLD.json benchmarks/results/NEW.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+# Metric path inside a result -> whether a higher value is better
+METRICS = {
+    ("latency_ms", "p50"): False,
+    ("latency_ms", "p99"): False,
+    ("throughput_items_per_s",): True,
+    ("tokens_per_s",): True,
+    ("time_to_first_token_ms", "p50"): False,
+    ("peak_rss_mb",): False,
+}
+
+
+def lookup(result, keys):
+    for key in keys:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"{baseline['commit']} -> {candidate['commit']}")
+    print(f"{'path':<34}{'metric':<26}{'baseline':>12}{'candidate':>12}{'change':>9}")
+    regressions = 0
+    for path in baseline["results"]:
+        if path not in candidate["results"]:
+            continue
+        for keys, higher_is_better in METRICS.items():
+            old = lookup(baseline["results"][path], keys)
+            new = lookup(candidate["results"][path], keys)
+            if old is None or new is None or old == 0:
+                continue
+            change = 100 * (new - old) / old
+            regressed = (change < -args.threshold) if higher_is_better else (change > args.threshold)
+            regressions += regressed
+            print(f"{path:<34}{'.'.join(keys):<26}{old:>12.2f}{new:>12.2f}{change:>+8.1f}%{'  !' if regressed else ''}")
+
+    print(f"{regressions} regression(s) beyond {args.threshold:.0f}%")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Aggregate throughput and latency when several sessions call the models at once, with and without the
+bounded inference executor.
+
+Every configuration runs in a fresh process, because torch's thread pools are process-wide:
+
+    unbounded   as many slots as sessions, each inference with every core: the previous behaviour
+    bounded     ANIMA_INFERENCE_SLOTS per model, cores divided between the slots
+
+Sessions are threads issuing back-to-back requests for --duration seconds against tiny random models, the
+same way Streamlit runs one thread per browser session. Run from the webapp directory:
+
+    python -m benchmarks.contention --sessions 8 --duration 20
+    python -m benchmarks.contention --sessions 8 --workload segmentation --slots 1 2
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import numpy as np
+
+WORKLOADS = ("mixed", "chatbot", "medreco", "segmentation")
+
+
+def session(workload, deadline, latencies, errors, seed):
+    from PIL import Image
+
+    from core.model_registry import registry
+    from pages import chatbot, medreco, segmentation
+
+    rng = np.random.default_rng(seed)
+    medreco_model, medreco_tokenizer = registry.get("medreco")
+    kinds = ("chatbot", "medreco", "segmentation") if workload == "mixed" else (workload,)
+    request = 0
+    while time.perf_counter() < deadline:
+        kind = kinds[request % len(kinds)]
+        request += 1
+        start_time = time.perf_counter()
+        try:
+            if kind == "chatbot":
+                chatbot.generate_reply(f"Question {rng.integers(1 << 30)} about blood pressure?", [], uuid.uuid4().hex)
+            elif kind == "medreco":
+                medreco.model_predict(medreco_model, medreco_tokenizer, f"Age: {rng.integers(1 << 30)}\nSymptom: cough")
+            else:
+                image = Image.fromarray(rng.integers(0, 255, (512, 512), dtype=np.uint8))
+                segmentation.predict_mask(image)
+        except Exception:
+            errors.append(kind)
+            continue
+        latencies.append((kind, time.perf_counter() - start_time))
+
+
+def child(sessions, duration, workload):
+    from benchmarks.tiny_models import register_tiny_models
+    from core.executor import executor
+    from core.model_registry import registry
+
+    register_tiny_models()
+    for name in ("chatbot", "medreco", "segmentation"):
+        registry.get(name)
+
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=session, args=(workload, deadline, latencies, errors, seed))
+               for seed in range(sessions)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+
+    seconds = np.array([latency for _, latency in latencies]) if latencies else np.zeros(1)
+    print(json.dumps({
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_per_s": len(latencies) / elapsed,
+        "p50_ms": 1000 * float(np.percentile(seconds, 50)),
+        "p95_ms": 1000 * float(np.percentile(seconds, 95)),
+        "mean_wait_ms": 1000 * float(np.mean([row["mean_wait_seconds"] for row in executor.snapshot()] or [0.0])),
+        "threads_per_inference": executor.threads,
+    }))
+
+
+def run_configuration(args, slots, threads):
+    env = dict(os.environ, ANIMA_INFERENCE_SLOTS=str(slots), ANIMA_INFERENCE_LOG="0", ANIMA_RESPONSE_CACHE="0",
+               ANIMA_INFERENCE_URL="")
+    if threads:
+        env["ANIMA_INFERENCE_THREADS"] = str(threads)
+    else:
+        env.pop("ANIMA_INFERENCE_THREADS", None)
+    command = [sys.executable, "-m", "benchmarks.contention", "--child", "--sessions", str(args.sessions),
+               "--duration", str(args.duration), "--workload", args.workload]
+    result = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--workload", default="mixed", choices=WORKLOADS)
+    parser.add_argument("--slots", type=int, nargs="*", default=[1, 2], help="bounded configurations to measure")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.sessions, args.duration, args.workload)
+        return
+
+    configurations = [("unbounded", args.sessions, os.cpu_count() or 1)]
+    configurations += [(f"bounded, {slots} slot(s)", slots, None) for slots in args.slots]
+    print(f"{args.sessions} sessions, {args.workload} workload, {args.duration:.0f}s each, {os.cpu_count()} cores")
+    print(f"{'configuration':<22}{'threads':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'wait ms':>9}{'errors':>8}")
+    for label, slots, threads in configurations:
+        result = run_configuration(args, slots, threads)
+        print(f"{label:<22}{result['threads_per_inference']:>8}{result['throughput_per_s']:>9.2f}"
+              f"{result['p50_ms']:>9.0f}{result['p95_ms']:>9.0f}{result['mean_wait_ms']:>9.0f}{result['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
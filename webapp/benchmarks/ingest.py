@@ -0,0 +1,71 @@
+"""Times image ingestion for a multi-megapixel JPEG scan: the previous torchvision pipeline (full decode, Resize,
+convert, ToTensor, Normalize) against core.ingest at full decode, with JPEG draft mode, and from its cache.
+Also reports how far each tensor is from the previous pipeline's. Run from the webapp directory:
+
+    python -m benchmarks.ingest --width 4000 --height 3000
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+import torchvision.transforms as TF
+from PIL import Image
+
+from core import ingest
+from pages.segmentation import Configs
+
+
+def synthetic_scan(width, height):
+    # Smooth anatomy-like gradients plus noise, so the JPEG is neither trivial nor pure noise
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = 128 + 60 * np.sin(x / 97.0) * np.cos(y / 61.0) + np.random.default_rng(0).normal(0, 12, (height, width))
+    buffer = io.BytesIO()
+    Image.fromarray(pixels.clip(0, 255).astype(np.uint8)).save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def timed(fn, repeats):
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return result, (time.perf_counter() - start_time) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    data = synthetic_scan(args.width, args.height)
+    previous = TF.Compose([
+        TF.Resize(size=Configs.IMAGE_SIZE[::-1]),
+        TF.Lambda(lambda img: img.convert("RGB")),
+        TF.ToTensor(),
+        TF.Normalize(Configs.MEAN, Configs.STD),
+    ])
+    reference, previous_seconds = timed(lambda: previous(Image.open(io.BytesIO(data))), args.repeats)
+
+    def run(draft, use_cache):
+        ingest.JPEG_DRAFT = draft
+        return ingest.ingest(data, Configs.IMAGE_SIZE, Image.BILINEAR, Configs.MEAN, Configs.STD,
+                             use_cache=use_cache).tensor
+
+    rows = [("torchvision (previous)", previous_seconds, 0.0)]
+    for label, draft, use_cache in (("ingest, full decode", False, False), ("ingest, draft", True, False)):
+        tensor, seconds = timed(lambda: run(draft, use_cache), args.repeats)
+        rows.append((label, seconds, float((tensor - reference).abs().max())))
+    run(True, True)
+    tensor, seconds = timed(lambda: run(True, True), args.repeats)
+    rows.append(("ingest, cached", seconds, float((tensor - reference).abs().max())))
+
+    print(f"{args.width}x{args.height} JPEG, {len(data) / 2**20:.1f} MB -> {Configs.IMAGE_SIZE}")
+    print(f"{'path':<26}{'ms':>10}{'speedup':>10}{'max |diff|':>12}")
+    for label, seconds, diff in rows:
+        print(f"{label:<26}{1000 * seconds:>10.1f}{previous_seconds / seconds:>9.1f}x{diff:>12.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""Concurrent-session load test of the Streamlit app, driven headlessly through Streamlit's app-testing API.
+
+Each simulated user is an AppTest session of app.py running in its own thread, the way the Streamlit server
+runs one script thread per browser session. All sessions share one process and one set of tiny random models
+(benchmarks.tiny_models). A user repeatedly navigates to a page drawn from the page mix and performs its
+action, then pauses for an exponentially distributed think time:
+
+    discussion       asks the chatbot a question through its form
+    medpali          analyzes an image through the prompt box ("caption en")
+    recommendation   submits the patient form
+    detection        segments an image and renders its overlay
+
+AppTest cannot upload files, so MedPali's image is placed in its session state. Detection has no such hook,
+so its page is rendered through AppTest and the work an upload triggers runs directly in the session thread.
+
+Reported per concurrency level: p50/p95/p99 latency of a page visit (navigation plus action), error rate,
+throughput, and process RSS sampled over time. Run from the webapp directory:
+
+    python -m benchmarks.load_test --sessions 5 20 50 --duration 60
+    python -m benchmarks.load_test --sessions 20 --mix discussion=3,recommendation=1 --think 2 --output load.json
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+APP_PATH = Path(__file__).resolve().parent.parent / "app.py"
+DEFAULT_MIX = "discussion=4,medpali=1,recommendation=2,detection=1"
+SYMPTOMS = ("Headache", "Chest pain", "Fever", "Cough", "Back pain", "Fatigue", "Nausea", "Dizziness")
+
+
+@dataclass
+class Sample:
+    page: str
+    start: float  # seconds since the level started
+    seconds: float
+    error: Optional[str] = None
+
+
+def install_shared_runtime():
+    """AppTest installs a mock Streamlit runtime at the start of every run and removes it at the end, which
+    breaks runs overlapping in other threads. One mock runtime is installed for the whole test instead."""
+    from unittest.mock import MagicMock
+
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.testing.v1 import app_test
+
+    class DiscardingStorage(MemoryMediaFileStorage):
+        # Images are still encoded as the page would serve them, but no simulated browser fetches them
+        def load_and_get_id(self, path_or_data, mimetype, kind, filename=None):
+            return super().load_and_get_id(b"", mimetype, kind, filename)
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(DiscardingStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    # AppTest's per-run install and removal now only touch this placeholder
+    app_test.Runtime = type("Runtime", (), {"_instance": None})
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in PAGES:
+            raise argparse.ArgumentTypeError(f"unknown page '{name.strip()}', expected one of {', '.join(PAGES)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def _widget(elements, label):
+    return next(element for element in elements if element.label == label)
+
+
+def _failure(at):
+    # Uncaught exceptions and st.error messages both count as a failed visit
+    problems = [getattr(element, "message", None) or str(element.value) for element in at.exception]
+    problems += [str(element.value) for element in at.error]
+    return "; ".join(problems)[:200] or None
+
+
+def visit_discussion(at, rng, images):
+    from benchmarks.run import CHAT_PROMPTS
+
+    at.text_input(key="input").input(f"{rng.choice(CHAT_PROMPTS)} ({rng.randrange(1 << 30)})")
+    _widget(at.button, "Send").click().run()
+
+
+def visit_medpali(at, rng, images):
+    at.session_state["image"] = rng.choice(images)
+    at.session_state["conversation"] = []
+    at.run()
+    _widget(at.text_input, "Enter your prompt").input("caption en")
+    _widget(at.button, "Analyze").click().run()
+
+
+def visit_recommendation(at, rng, images):
+    _widget(at.number_input, "Age").set_value(rng.randint(1, 95))
+    _widget(at.text_input, "Primary Symptom").input(rng.choice(SYMPTOMS))
+    _widget(at.text_input, "Duration").input(f"{rng.randint(1, 14)} days")
+    _widget(at.button, "Get Recommendations").click().run()
+
+
+def visit_detection(at, rng, images):
+    # What segmentation.show() does for a single upload with the fast overlay renderer
+    from core.mask_cache import mask_cache
+    from pages import segmentation
+
+    image_bytes = rng.choice(images)
+    ingested = segmentation.ingest_image(image_bytes)
+    model_name, version = segmentation.Configs.MODEL_NAME, segmentation.result_version()
+    mask = mask_cache.get(ingested.digest, model_name, version)
+    if mask is None:
+        mask, inference_time, _ = segmentation.predict_mask(ingested)
+        mask_cache.put(ingested.digest, model_name, version, mask)
+        segmentation.save_inference_details(model_name, ingested.preview, mask, inference_time,
+                                            image_bytes=image_bytes, content_hash=ingested.digest,
+                                            model_version=version)
+    mask_cache.overlay(ingested.digest, model_name, version, "overlay",
+                       lambda: segmentation.render_overlay(ingested.preview, mask))
+
+
+# Simulated page -> (navigation label in app.py, action)
+PAGES = {
+    "discussion": ("Discussion", visit_discussion),
+    "medpali": ("MedPali", visit_medpali),
+    "recommendation": ("Recommendation", visit_recommendation),
+    "detection": ("Detection", visit_detection),
+}
+
+
+def session(mix, images, deadline, level_start, think_seconds, timeout, samples, seed):
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed)
+    pages, weights = list(mix), list(mix.values())
+    at = AppTest.from_file(str(APP_PATH), default_timeout=timeout)
+    start_time = time.perf_counter()
+    try:
+        at.run()
+    except Exception as e:
+        samples.append(Sample("home", start_time - level_start, time.perf_counter() - start_time,
+                              f"{type(e).__name__}: {e}"[:200]))
+        return
+    while time.perf_counter() < deadline:
+        page = rng.choices(pages, weights)[0]
+        label, visit = PAGES[page]
+        start_time = time.perf_counter()
+        try:
+            at.sidebar.radio[0].set_value(label).run()
+            visit(at, rng, images)
+            error = _failure(at)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:200]
+        samples.append(Sample(page, start_time - level_start, time.perf_counter() - start_time, error))
+        if think_seconds > 0:
+            time.sleep(rng.expovariate(1 / think_seconds))
+
+
+def sample_rss(stop, interval, level_start, series):
+    import psutil
+
+    process = psutil.Process()
+    while True:
+        series.append((time.perf_counter() - level_start, process.memory_info().rss / 2**20))
+        if stop.wait(interval):
+            return
+
+
+def summarize(samples, elapsed):
+    import numpy as np
+
+    def stats(group):
+        ok = [sample.seconds for sample in group if sample.error is None]
+        seconds = np.array(ok) if ok else np.zeros(1)
+        return {
+            "visits": len(group),
+            "errors": len(group) - len(ok),
+            "error_rate": (len(group) - len(ok)) / len(group) if group else 0.0,
+            "throughput_per_s": len(ok) / elapsed,
+            "p50_ms": 1000 * float(np.percentile(seconds, 50)),
+            "p95_ms": 1000 * float(np.percentile(seconds, 95)),
+            "p99_ms": 1000 * float(np.percentile(seconds, 99)),
+        }
+
+    pages = sorted({sample.page for sample in samples})
+    return stats(samples), {page: stats([sample for sample in samples if sample.page == page]) for page in pages}
+
+
+def run_level(sessions, args, mix, images):
+    samples, rss_series = [], []
+    level_start = time.perf_counter()
+    deadline = level_start + args.duration
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_rss, args=(stop, args.sample_interval, level_start, rss_series),
+                               daemon=True)
+    sampler.start()
+    threads = [threading.Thread(target=session, args=(mix, images, deadline, level_start, args.think, args.timeout,
+                                                      samples, args.seed + index), daemon=True)
+               for index in range(sessions)]
+    for thread in threads:
+        thread.start()
+        # Sessions join over the first second instead of all rendering the home page at the same instant
+        time.sleep(min(1.0 / sessions, 0.05))
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - level_start
+    stop.set()
+    sampler.join()
+
+    overall, per_page = summarize(samples, elapsed)
+    return {
+        "sessions": sessions,
+        "elapsed_seconds": elapsed,
+        "overall": overall,
+        "pages": per_page,
+        "rss_mb": [{"seconds": seconds, "rss_mb": rss} for seconds, rss in rss_series],
+        "errors": sorted({sample.error for sample in samples if sample.error})[:20],
+        "samples": [asdict(sample) for sample in samples] if args.output else [],
+    }
+
+
+def print_level(result):
+    overall = result["overall"]
+    rss = [point["rss_mb"] for point in result["rss_mb"]]
+    print(f"\n{result['sessions']} sessions, {result['elapsed_seconds']:.0f}s: {overall['visits']} visits, "
+          f"{overall['throughput_per_s']:.2f}/s, {100 * overall['error_rate']:.1f}% errors, "
+          f"RSS {rss[0]:.0f} -> {max(rss):.0f} MB peak, {rss[-1]:.0f} MB at the end")
+    print(f"{'page':<16}{'visits':>8}{'errors':>8}{'per s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for page, stats in [("all", overall)] + sorted(result["pages"].items()):
+        print(f"{page:<16}{stats['visits']:>8}{stats['errors']:>8}{stats['throughput_per_s']:>8.2f}"
+              f"{stats['p50_ms']:>9.0f}{stats['p95_ms']:>9.0f}{stats['p99_ms']:>9.0f}")
+    # RSS over time, about ten points per level
+    step = max(1, len(result["rss_mb"]) // 10)
+    print("RSS over time: " + ", ".join(f"{point['seconds']:.0f}s {point['rss_mb']:.0f} MB"
+                                         for point in result["rss_mb"][::step]))
+    for error in result["errors"][:5]:
+        print(f"  error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[5, 20, 50], help="concurrency levels to run")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds per level")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help=f"page weights (default {DEFAULT_MIX})")
+    parser.add_argument("--think", type=float, default=1.0, help="mean think time between visits, seconds")
+    parser.add_argument("--images", type=int, default=32, help="distinct images uploaded, so caches see repeats")
+    parser.add_argument("--image-size", type=int, default=512)
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds before one script run counts as failed")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="seconds between RSS samples")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache", action="store_true", help="keep the response cache on")
+    parser.add_argument("--log", action="store_true", help="write inference records to the inference database")
+    parser.add_argument("--output", default=None, help="write every level's results and samples to this JSON file")
+    args = parser.parse_args()
+
+    # Read at import time by the modules below; the app must run locally, not against an inference service
+    os.environ["ANIMA_INFERENCE_URL"] = ""
+    os.environ.setdefault("ANIMA_RESPONSE_CACHE", "1" if args.cache else "0")
+    os.environ.setdefault("ANIMA_INFERENCE_LOG", "1" if args.log else "0")
+
+    from benchmarks.run import png_bytes, random_image
+    from benchmarks.tiny_models import register_tiny_models
+    from core.model_registry import registry
+
+    register_tiny_models()
+    for name in ("chatbot", "medreco", "medpali", "segmentation"):
+        registry.get(name)
+    install_shared_runtime()
+    images = [png_bytes(random_image(args.image_size, seed)) for seed in range(args.images)]
+
+    mix = args.mix
+    print(f"Page mix {mix}, think time {args.think:.1f}s, {args.duration:.0f}s per level, {os.cpu_count()} cores")
+    results = []
+    for sessions in args.sessions:
+        result = run_level(sessions, args, mix, images)
+        print_level(result)
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"mix": mix, "think_seconds": args.think, "duration_seconds": args.duration,
+                       "levels": results}, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Compares the per-row medreco loop against batched generation on a synthetic CSV.
+
+Run from the webapp directory:
+
+    python -m benchmarks.medreco_batching --rows 32 --max-new-tokens 64
+"""
+import argparse
+import dataclasses
+import random
+import time
+
+import pandas as pd
+
+from core.model_registry import registry
+from core.response_cache import response_cache
+from core.inference_log import inference_logger
+from pages import medreco
+
+SYMPTOMS = ["Headache", "Chest pain", "Fever", "Cough", "Back pain", "Fatigue", "Nausea", "Dizziness"]
+
+
+def synthetic_records(rows, seed=0):
+    rng = random.Random(seed)
+    return pd.DataFrame({
+        'Age': [rng.randint(1, 95) for _ in range(rows)],
+        'Gender': [rng.choice(["Male", "Female", "Other"]) for _ in range(rows)],
+        'Symptom': [rng.choice(SYMPTOMS) for _ in range(rows)],
+        'Duration': [f"{rng.randint(1, 14)} days" for _ in range(rows)],
+        'Severity': [rng.choice(["Mild", "Moderate", "Severe"]) for _ in range(rows)],
+        'Past Surgeries': [rng.choice(["None", "Appendectomy", "Knee replacement"]) for _ in range(rows)],
+        'Current Medications': [rng.choice(["None", "Ibuprofen", "Metformin", "Lisinopril"]) for _ in range(rows)],
+        'Allergies': [rng.choice(["None", "Penicillin", "Peanuts"]) for _ in range(rows)],
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=32)
+    parser.add_argument("--max-new-tokens", type=int, default=medreco.BUDGET.max_new_tokens)
+    parser.add_argument("--max-batch-size", type=int, default=medreco.MAX_BATCH_SIZE)
+    args = parser.parse_args()
+
+    # Both modes must generate every row, not read the other's results back from the cache
+    response_cache.enabled = False
+    inference_logger.enabled = False
+    medreco.BUDGET = dataclasses.replace(medreco.BUDGET, max_new_tokens=args.max_new_tokens,
+                                         min_new_tokens=min(medreco.BUDGET.min_new_tokens, args.max_new_tokens))
+    medreco.MAX_BATCH_SIZE = args.max_batch_size
+    input_texts = medreco.format_prompt_from_csv(synthetic_records(args.rows))
+    model, tokenizer = registry.get("medreco")
+
+    start_time = time.perf_counter()
+    for input_text in input_texts:
+        medreco.model_predict(model, tokenizer, input_text)
+    per_row_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for _ in medreco.model_predict_batch(model, tokenizer, input_texts):
+        pass
+    batched_seconds = time.perf_counter() - start_time
+
+    print(f"{'mode':<10}{'seconds':>10}{'rows/s':>10}")
+    print(f"{'per-row':<10}{per_row_seconds:>10.1f}{args.rows / per_row_seconds:>10.2f}")
+    print(f"{'batched':<10}{batched_seconds:>10.1f}{args.rows / batched_seconds:>10.2f}")
+    print(f"speedup: {per_row_seconds / batched_seconds:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
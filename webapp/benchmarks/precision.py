@@ -0,0 +1,144 @@
+"""Compares fp32, bf16 and dynamic int8 inference for each model on a fixed prompt/image set.
+
+Every (model, precision) pair runs in its own process so that peak RSS is measured in isolation. Outputs
+are compared against fp32: exact matches for generated text, pixel agreement for segmentation masks.
+Run from the webapp directory:
+
+    python -m benchmarks.precision --models chatbot segmentation --max-new-tokens 32
+"""
+import argparse
+import os
+import pickle
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+MODELS = ("chatbot", "medreco", "medpali", "segmentation")
+PRECISIONS = ("fp32", "bf16", "int8")
+PROMPTS = [
+    "What are the early symptoms of type 2 diabetes?",
+    "How is hypertension usually treated?",
+    "What should I do after a minor burn?",
+    "When is a fever in adults dangerous?",
+]
+MEDPALI_PROMPTS = ["caption en", "What organ is shown in this image?"]
+IMAGES = sorted(Path(__file__).resolve().parent.parent.joinpath("images_demo").glob("*.jpg"))[:4]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def run_text_model(name, max_new_tokens):
+    import torch
+    from core.model_registry import registry
+
+    loaded = registry.get(name)
+    tokenizer, model = loaded if name == "chatbot" else loaded[::-1]
+    outputs, latencies = [], []
+    for prompt in PROMPTS:
+        input_ids = tokenizer.encode(prompt, return_tensors="pt")
+        start_time = time.perf_counter()
+        with torch.inference_mode():
+            generation = model.generate(input_ids, max_new_tokens=max_new_tokens, do_sample=False)
+        latencies.append(time.perf_counter() - start_time)
+        outputs.append(generation[0, input_ids.shape[-1]:].tolist())
+    return outputs, latencies
+
+
+def run_medpali():
+    from PIL import Image
+    from pages import medpali
+
+    outputs, latencies = [], []
+    for path in IMAGES:
+        image = Image.open(path)
+        for prompt in MEDPALI_PROMPTS:
+            start_time = time.perf_counter()
+            outputs.append(medpali.model_predict(image, prompt))
+            latencies.append(time.perf_counter() - start_time)
+    return outputs, latencies
+
+
+def run_segmentation():
+    from PIL import Image
+    from pages import segmentation
+
+    outputs, latencies = [], []
+    for path in IMAGES:
+        image = Image.open(path)
+        start_time = time.perf_counter()
+        mask, _, _ = segmentation.predict_mask(image)
+        latencies.append(time.perf_counter() - start_time)
+        outputs.append(mask)
+    return outputs, latencies
+
+
+def worker(name, max_new_tokens, output_path):
+    from core.inference_log import inference_logger
+    from core.response_cache import response_cache
+    from pages import chatbot, medreco, medpali, segmentation  # registers the loaders
+
+    response_cache.enabled = False
+    inference_logger.enabled = False
+
+    start_time = time.perf_counter()
+    if name in ("chatbot", "medreco"):
+        outputs, latencies = run_text_model(name, max_new_tokens)
+    elif name == "medpali":
+        outputs, latencies = run_medpali()
+    else:
+        outputs, latencies = run_segmentation()
+    total_seconds = time.perf_counter() - start_time
+
+    with open(output_path, "wb") as f:
+        pickle.dump({"outputs": outputs, "latencies": latencies, "total_seconds": total_seconds,
+                     "peak_rss_mb": peak_rss_mb()}, f)
+
+
+def agreement(outputs, reference):
+    if isinstance(reference[0], np.ndarray):
+        return float(np.mean([(output == ref).mean() for output, ref in zip(outputs, reference)]))
+    return float(np.mean([output == ref for output, ref in zip(outputs, reference)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", choices=MODELS, default=list(MODELS))
+    parser.add_argument("--precisions", nargs="+", choices=PRECISIONS, default=list(PRECISIONS))
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--worker", nargs=2, metavar=("MODEL", "OUTPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker[0], args.max_new_tokens, args.worker[1])
+        return
+
+    precisions = ["fp32"] + [precision for precision in args.precisions if precision != "fp32"]
+    print(f"{'model':<14}{'precision':<11}{'mean s':>9}{'p95 s':>9}{'peak RSS MB':>13}{'agreement':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.models:
+            reference = None
+            for precision in precisions:
+                output_path = os.path.join(tmp, f"{name}-{precision}.pkl")
+                env = dict(os.environ, **{f"ANIMA_PRECISION_{name.upper()}": precision})
+                subprocess.run([sys.executable, "-m", "benchmarks.precision", "--max-new-tokens",
+                                str(args.max_new_tokens), "--worker", name, output_path], env=env, check=True)
+                with open(output_path, "rb") as f:
+                    result = pickle.load(f)
+
+                reference = reference if reference is not None else result["outputs"]
+                latencies = np.array(result["latencies"])
+                print(f"{name:<14}{precision:<11}{latencies.mean():>9.3f}{np.percentile(latencies, 95):>9.3f}"
+                      f"{result['peak_rss_mb']:>13.0f}{agreement(result['outputs'], reference):>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Offline benchmark suite for every page's inference path, run against tiny random models.
+
+Measures latency percentiles, throughput, tokens/s and peak RSS per path and writes them to
+benchmarks/results/<timestamp>-<commit>.json. Compare two runs with benchmarks.compare.
+Run from the webapp directory:
+
+    python -m benchmarks.run --repeats 20
+"""
+import argparse
+import io
+import itertools
+import json
+import platform
+import subprocess
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import psutil
+import torch
+import transformers
+from PIL import Image
+
+from core.generation import GenerationStats
+from core.inference_log import inference_logger
+from core.model_registry import registry
+from core.response_cache import response_cache
+from core.segformer_backend import BACKENDS
+from benchmarks.medreco_batching import synthetic_records
+from benchmarks.tiny_models import register_tiny_models
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+CHAT_PROMPTS = [
+    "What are the early symptoms of type 2 diabetes?",
+    "How is hypertension usually treated?",
+    "What should I do after a minor burn?",
+    "When is a fever in adults dangerous?",
+]
+
+
+class RssSampler:
+    """Samples process RSS on a background thread; peak_mb is the highest value seen."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.baseline_mb = self.peak_mb = self.process.memory_info().rss / 2**20
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, self.process.memory_info().rss / 2**20)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, self.process.memory_info().rss / 2**20)
+
+
+class TokenCounter:
+    """Counts tokens produced by a model's generate() while installed."""
+
+    def __init__(self, model):
+        self.model = model
+        self.tokens = 0
+
+    def __enter__(self):
+        original = self.model.generate
+
+        def generate(*args, **kwargs):
+            output = original(*args, **kwargs)
+            input_ids = kwargs.get("input_ids", args[0] if args else None)
+            sequences = output if torch.is_tensor(output) else output.sequences
+            self.tokens += sequences.numel() - input_ids.numel()
+            return output
+
+        self.model.generate = generate
+        return self
+
+    def __exit__(self, *exc_info):
+        del self.model.generate
+
+
+def percentiles(values):
+    values = np.asarray(values)
+    return {"mean": float(values.mean()), "p50": float(np.percentile(values, 50)),
+            "p90": float(np.percentile(values, 90)), "p99": float(np.percentile(values, 99))}
+
+
+def measure(fn, items_per_call, repeats, warmup, model=None, extra=None):
+    for _ in range(warmup):
+        fn()
+    for values in (extra or {}).values():
+        values.clear()
+
+    counter = TokenCounter(model) if model is not None else None
+    latencies = []
+    with RssSampler() as rss:
+        if counter is not None:
+            counter.__enter__()
+        try:
+            for _ in range(repeats):
+                start_time = time.perf_counter()
+                fn()
+                latencies.append(time.perf_counter() - start_time)
+        finally:
+            if counter is not None:
+                counter.__exit__()
+
+    total_seconds = sum(latencies)
+    result = {
+        "latency_ms": {key: 1000 * value for key, value in percentiles(latencies).items()},
+        "throughput_items_per_s": items_per_call * repeats / total_seconds,
+        "peak_rss_mb": rss.peak_mb,
+        "rss_growth_mb": rss.peak_mb - rss.baseline_mb,
+    }
+    if counter is not None:
+        result["tokens_per_s"] = counter.tokens / total_seconds
+    for name, values in (extra or {}).items():
+        result[name] = {key: 1000 * value for key, value in percentiles(values).items()}
+    return result
+
+
+def random_image(size, seed):
+    pixels = np.random.default_rng(seed).integers(0, 255, (size, size, 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def png_bytes(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def benchmark_paths(repeats, warmup, batch_rows, image_size):
+    from pages import chatbot, medpali, medreco, segmentation
+
+    _, chat_model = registry.get("chatbot")
+    medreco_model, medreco_tokenizer = registry.get("medreco")
+    medpali_model, _ = registry.get("medpali")
+    prompts = itertools.cycle(CHAT_PROMPTS)
+    medreco_prompts = medreco.format_prompt_from_csv(synthetic_records(batch_rows))
+    seeds = itertools.count(1)
+    results = {}
+
+    results["chatbot.conversation_chat"] = measure(
+        lambda: chatbot.generate_reply(next(prompts), [], uuid.uuid4().hex), 1, repeats, warmup, chat_model)
+
+    time_to_first_token = []
+
+    def stream_once():
+        stats = GenerationStats()
+        for _ in chatbot.stream_reply(next(prompts), [], uuid.uuid4().hex, stats):
+            pass
+        time_to_first_token.append(stats.time_to_first_token or 0.0)
+
+    results["chatbot.stream_reply"] = measure(stream_once, 1, repeats, warmup, chat_model,
+                                              extra={"time_to_first_token_ms": time_to_first_token})
+
+    def three_turns():
+        history, session_id = [], uuid.uuid4().hex
+        for query in CHAT_PROMPTS[:3]:
+            history.append((query, chatbot.generate_reply(query, history, session_id)))
+
+    results["chatbot.multi_turn"] = measure(three_turns, 3, repeats, warmup, chat_model)
+
+    results["medreco.model_predict"] = measure(
+        lambda: medreco.model_predict(medreco_model, medreco_tokenizer, medreco_prompts[0]), 1, repeats, warmup,
+        medreco_model)
+    results["medreco.model_predict_batch"] = measure(
+        lambda: list(medreco.model_predict_batch(medreco_model, medreco_tokenizer, medreco_prompts)), batch_rows,
+        repeats, warmup, medreco_model)
+
+    # A new image every call: the vision tower always runs
+    results["medpali.model_predict"] = measure(
+        lambda: medpali.model_predict(random_image(image_size, next(seeds)), "caption en"), 1, repeats, warmup,
+        medpali_model)
+    followup_image = random_image(image_size, 0)
+    results["medpali.model_predict_followup"] = measure(
+        lambda: medpali.model_predict(followup_image, "What organ is shown in this image?"), 1, repeats, warmup,
+        medpali_model)
+    results["medpali.model_predict_batch"] = measure(
+        lambda: medpali.model_predict_batch(random_image(image_size, next(seeds)),
+                                            ["caption en", "detect stomach", "Is there a tumor?"]),
+        3, repeats, warmup, medpali_model)
+
+    segmentation_image = random_image(image_size, 0)
+    results["segmentation.predict"] = measure(lambda: segmentation.predict(segmentation_image), 1, repeats, warmup)
+    results["segmentation.predict_mask"] = measure(
+        lambda: segmentation.predict_mask(segmentation_image), 1, repeats, warmup)
+    slices = [(f"slice_{i:03d}.png", png_bytes(random_image(image_size, i))) for i in range(batch_rows)]
+    results["segmentation.segment_series"] = measure(
+        lambda: list(segmentation.segment_series(slices, batch_size=segmentation.Configs.BATCH_SIZE)), batch_rows,
+        repeats, warmup)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--batch-rows", type=int, default=16, help="rows/slices per batched call")
+    parser.add_argument("--image-size", type=int, default=512)
+    parser.add_argument("--precision", choices=["fp32", "bf16", "int8"], default="fp32")
+    parser.add_argument("--segmentation-backend", choices=BACKENDS, default="eager")
+    parser.add_argument("--output", type=Path, help="result file (default: benchmarks/results/<timestamp>-<commit>.json)")
+    args = parser.parse_args()
+
+    response_cache.enabled = False
+    inference_logger.enabled = False
+    register_tiny_models(args.precision, args.segmentation_backend)
+
+    commit = git_commit()
+    started_at = datetime.now(timezone.utc)
+    report = {
+        "commit": commit,
+        "started_at": started_at.isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "transformers": transformers.__version__,
+            "machine": platform.machine(),
+            "cpu_count": psutil.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+        },
+        "settings": vars(args) | {"output": None},
+        "results": benchmark_paths(args.repeats, args.warmup, args.batch_rows, args.image_size),
+    }
+
+    output = args.output or RESULTS_DIR / f"{started_at:%Y%m%dT%H%M%S}-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+
+    print(f"{'path':<34}{'p50 ms':>10}{'p99 ms':>10}{'items/s':>10}{'tokens/s':>10}{'peak MB':>9}")
+    for path, result in report["results"].items():
+        tokens = result.get("tokens_per_s")
+        print(f"{path:<34}{result['latency_ms']['p50']:>10.1f}{result['latency_ms']['p99']:>10.1f}"
+              f"{result['throughput_items_per_s']:>10.2f}{'' if tokens is None else f'{tokens:.1f}':>10}"
+              f"{result['peak_rss_mb']:>9.0f}")
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
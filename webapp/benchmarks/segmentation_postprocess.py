@@ -0,0 +1,64 @@
+"""Times segmentation post-processing and rendering: original matplotlib path against the low-memory path.
+
+Uses synthetic Segformer-sized logits, so no model is needed. Run from the webapp directory:
+
+    python -m benchmarks.segmentation_postprocess --sizes 512 1024 2048
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from pages import segmentation
+
+
+def synthetic_logits(seed=0):
+    # Smooth blobs at the resolution Segformer produces (a quarter of the input size)
+    generator = torch.Generator().manual_seed(seed)
+    h, w = (side // 4 + 1 for side in segmentation.Configs.IMAGE_SIZE)
+    coarse = torch.randn((1, segmentation.Configs.NUM_CLASSES, 8, 8), generator=generator)
+    return torch.nn.functional.interpolate(coarse, size=(h, w), mode="bicubic", align_corners=False)[0]
+
+
+def timed(fn, repeats):
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return result, (time.perf_counter() - start_time) / repeats
+
+
+def legacy_render(image, mask):
+    seg_info = [(mask == idx, class_name) for idx, class_name in enumerate(segmentation.Configs.CLASSES, 1)]
+    plot = segmentation.plot_segmentation(image, seg_info, mask)
+    buffer = io.BytesIO()
+    plot.savefig(buffer, format="png")
+    plot.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    logits = synthetic_logits()
+    print(f"{'size':>6}{'stage':>12}{'mode':>10}{'ms':>10}{'agreement':>11}")
+    for size in args.sizes:
+        image = Image.fromarray(np.random.default_rng(0).integers(0, 255, (size, size), dtype=np.uint8))
+        reference = None
+        for mode in ["full", "chunked", "lowres"]:
+            mask, seconds = timed(lambda: segmentation.logits_to_mask(logits, (size, size), mode), args.repeats)
+            reference = mask if reference is None else reference
+            print(f"{size:>6}{'postprocess':>12}{mode:>10}{1000 * seconds:>10.1f}{(mask == reference).mean():>11.4f}")
+
+        _, seconds = timed(lambda: legacy_render(image, reference), args.repeats)
+        print(f"{size:>6}{'render':>12}{'mpl':>10}{1000 * seconds:>10.1f}")
+        _, seconds = timed(lambda: segmentation.render_overlay(image, reference), args.repeats)
+        print(f"{size:>6}{'render':>12}{'numpy':>10}{1000 * seconds:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
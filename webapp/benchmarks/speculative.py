@@ -0,0 +1,73 @@
+"""Compares speculative decoding with plain greedy generate() on a fixed prompt set.
+
+For every prompt it checks that both produce the same tokens and reports the draft acceptance rate, the
+measured speedup and the per-request estimate logged by the app. By default the target is a tiny random
+Gemma and the draft is its own first layer; pass hub ids or local paths to measure real models.
+Run from the webapp directory:
+
+    python -m benchmarks.speculative
+    python -m benchmarks.speculative --target mockingmonkey/MedGemma --draft <draft model> --max-new-tokens 300
+"""
+import argparse
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from benchmarks.precision import PROMPTS
+from benchmarks.tiny_models import tiny_gemma
+from core.speculative import NUM_DRAFT_TOKENS, SpeculativeDecoder
+
+
+def tiny_pair():
+    tokenizer, target = tiny_gemma("tiny/target")
+    _, draft = tiny_gemma("tiny/draft")  # same seed, so the same weights as the target
+    draft.model.layers = draft.model.layers[:1]
+    draft.config.num_hidden_layers = 1
+    return tokenizer, target, draft
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default=None)
+    parser.add_argument("--draft", default=None)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--draft-tokens", type=int, default=NUM_DRAFT_TOKENS)
+    args = parser.parse_args()
+
+    if args.target:
+        tokenizer = AutoTokenizer.from_pretrained(args.target)
+        target = AutoModelForCausalLM.from_pretrained(args.target).eval()
+        draft = AutoModelForCausalLM.from_pretrained(args.draft).eval()
+    else:
+        tokenizer, target, draft = tiny_pair()
+    decoder = SpeculativeDecoder(target, draft, num_draft_tokens=args.draft_tokens)
+
+    print(f"{'prompt':<8}{'same':>6}{'tokens':>8}{'accept':>8}{'plain s':>9}{'spec s':>9}{'speedup':>9}{'est.':>7}")
+    plain_total = speculative_total = 0.0
+    for i, prompt in enumerate(PROMPTS):
+        input_ids = tokenizer.encode(prompt, return_tensors="pt")
+        # Warm both paths so that one-off allocation costs are not measured
+        decoder.generate(input_ids, max_new_tokens=2)
+        with torch.inference_mode():
+            target.generate(input_ids, max_new_tokens=2, do_sample=False)
+
+            start_time = time.perf_counter()
+            plain = target.generate(input_ids, max_new_tokens=args.max_new_tokens, do_sample=False)
+            plain_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        speculative = decoder.generate(input_ids, max_new_tokens=args.max_new_tokens)
+        speculative_seconds = time.perf_counter() - start_time
+
+        stats = decoder.stats
+        plain_total += plain_seconds
+        speculative_total += speculative_seconds
+        print(f"{i:<8}{str(torch.equal(plain, speculative)):>6}{stats.new_tokens:>8}{stats.acceptance_rate:>8.0%}"
+              f"{plain_seconds:>9.3f}{speculative_seconds:>9.3f}{plain_seconds / speculative_seconds:>8.2f}x"
+              f"{stats.estimated_speedup:>6.2f}x")
+    print(f"overall speedup: {plain_total / speculative_total:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
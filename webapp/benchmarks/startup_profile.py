@@ -0,0 +1,116 @@
+"""Profiles app startup: time to the first render of each page in a fresh process, with the pages imported
+lazily (as app.py does) or all up front (as it used to), and where the import time goes.
+
+Each configuration runs app.py headless, through Streamlit's app-testing API, under python -X importtime,
+with no models preloaded. The render of a model page therefore covers its imports, not its model loads.
+Run from the webapp directory:
+
+    python -m benchmarks.startup_profile
+    python -m benchmarks.startup_profile --pages Home Detection --top 15
+
+Results, including the per-package import breakdown, are written to
+benchmarks/results/startup-<timestamp>-<commit>.json.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+PAGES = ("Home", "Discussion", "MedPali", "Recommendation", "Detection", "Dashboard", "Contact")
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+\d+ \| *(\S+)")
+
+# Runs in the child process; prints one JSON line of timings
+CHILD = r'''
+import importlib, json, sys, time
+label, eager = sys.argv[1], sys.argv[2] == "eager"
+
+start_time = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+if eager:
+    for name in ("home", "chatbot", "medpali", "medreco", "segmentation", "dashboard", "contact"):
+        importlib.import_module(f"pages.{name}")
+app = AppTest.from_file("app.py", default_timeout=600)
+app.run()
+home_seconds = time.perf_counter() - start_time
+if label != "Home":
+    app.sidebar.radio[0].set_value(label).run()
+page_seconds = time.perf_counter() - start_time
+
+print(json.dumps({
+    "home_seconds": home_seconds,
+    "page_seconds": page_seconds,
+    "errors": [str(error.value) for error in app.error] + [str(exc.value) for exc in app.exception],
+}))
+'''
+
+
+def import_breakdown(stderr):
+    """Self import time per top-level package, in seconds, from python -X importtime output."""
+    seconds = defaultdict(float)
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            seconds[match.group(2).split(".")[0]] += int(match.group(1)) / 1e6
+    return dict(sorted(seconds.items(), key=lambda item: item[1], reverse=True))
+
+
+def run_child(label, mode):
+    # No preloading or logging: only imports and the page's own rendering are timed
+    env = dict(os.environ, ANIMA_PRELOAD="", ANIMA_INFERENCE_LOG="0", ANIMA_INFERENCE_URL="")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD, label, mode], env=env,
+                            capture_output=True, text=True, check=True)
+    run = json.loads(result.stdout.strip().splitlines()[-1])
+    run["imports"] = import_breakdown(result.stderr)
+    return run
+
+
+def git_commit():
+    # As benchmarks.run's, which would import torch just for this
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", nargs="+", default=list(PAGES), choices=PAGES)
+    parser.add_argument("--modes", nargs="+", default=["lazy", "eager"], choices=["lazy", "eager"])
+    parser.add_argument("--top", type=int, default=10, help="packages to list in the import breakdown")
+    args = parser.parse_args()
+
+    runs = []
+    print(f"{'page':<16}{'mode':<8}{'home (s)':>10}{'page (s)':>10}{'imports (s)':>13}  slowest imports")
+    for label in args.pages:
+        for mode in args.modes:
+            run = dict(page=label, mode=mode, **run_child(label, mode))
+            runs.append(run)
+            slowest = ", ".join(f"{name} {seconds:.2f}" for name, seconds in list(run["imports"].items())[:3])
+            print(f"{label:<16}{mode:<8}{run['home_seconds']:>10.2f}{run['page_seconds']:>10.2f}"
+                  f"{sum(run['imports'].values()):>13.2f}  {slowest}")
+            for error in run["errors"]:
+                print(f"    error: {error}")
+
+    # The full breakdown of the heaviest lazy run shows what a cold page still pays for
+    lazy_runs = [run for run in runs if run["mode"] == "lazy"] or runs
+    heaviest = max(lazy_runs, key=lambda run: run["page_seconds"])
+    print(f"\nImport time by package, {heaviest['page']} ({heaviest['mode']}):")
+    for name, seconds in list(heaviest["imports"].items())[:args.top]:
+        print(f"  {name:<24}{seconds:>8.3f}")
+
+    commit = git_commit()
+    RESULTS_DIR.mkdir(exist_ok=True)
+    path = RESULTS_DIR / f"startup-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{commit}.json"
+    path.write_text(json.dumps({"commit": commit, "python": sys.version.split()[0], "runs": runs}, indent=2))
+    print(f"\nWrote {path}")
+
+
+if __name__ == "__main__":
+    main()
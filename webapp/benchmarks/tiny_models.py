@@ -0,0 +1,117 @@
+"""Tiny randomly initialized models with the same architectures as the app's models.
+
+They need no network access or hub cache. `register_tiny_models()` swaps them into the model registry under
+the names the pages use, so page code runs unchanged against them.
+"""
+import tempfile
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, processors
+from transformers import (
+    GemmaConfig,
+    GemmaForCausalLM,
+    PaliGemmaConfig,
+    PaliGemmaForConditionalGeneration,
+    PaliGemmaProcessor,
+    PreTrainedTokenizerFast,
+    SegformerConfig,
+    SegformerForSemanticSegmentation,
+    SiglipImageProcessor,
+)
+
+from core.model_registry import registry
+from core.precision import apply_precision
+
+SPECIAL_TOKENS = ["<pad>", "<eos>", "<bos>", "<unk>"]
+TINY_IMAGE_SIZE = 32
+TINY_PATCH_SIZE = 8
+TEXT_CONFIG = dict(hidden_size=64, intermediate_size=128, num_hidden_layers=2, num_attention_heads=4,
+                   num_key_value_heads=1, head_dim=16, max_position_embeddings=2048,
+                   pad_token_id=0, eos_token_id=1, bos_token_id=2)
+
+
+def tiny_tokenizer():
+    # Byte-level vocabulary without merges: any text encodes, one token per byte
+    vocab = {token: i for i, token in enumerate(SPECIAL_TOKENS + sorted(pre_tokenizers.ByteLevel.alphabet()))}
+    tokenizer = Tokenizer(models.BPE(vocab=vocab, merges=[], unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="<bos> $A", pair="<bos> $A $B", special_tokens=[("<bos>", vocab["<bos>"])]
+    )
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token="<bos>", eos_token="<eos>",
+                                   pad_token="<pad>", unk_token="<unk>", padding_side="left")
+
+
+def tiny_gemma(name="tiny/gemma", seed=0):
+    torch.manual_seed(seed)
+    tokenizer = tiny_tokenizer()
+    config = GemmaConfig(vocab_size=len(tokenizer), **TEXT_CONFIG)
+    config.name_or_path = name
+    model = GemmaForCausalLM(config).eval()
+    return tokenizer, model
+
+
+def tiny_paligemma(name="tiny/paligemma", seed=0):
+    torch.manual_seed(seed)
+    image_processor = SiglipImageProcessor(size={"height": TINY_IMAGE_SIZE, "width": TINY_IMAGE_SIZE},
+                                           image_mean=[0.5] * 3, image_std=[0.5] * 3)
+    image_processor.image_seq_length = (TINY_IMAGE_SIZE // TINY_PATCH_SIZE) ** 2
+    # The processor adds the <image> and location/segmentation tokens to the tokenizer
+    processor = PaliGemmaProcessor(image_processor=image_processor, tokenizer=tiny_tokenizer())
+    vocab_size = len(processor.tokenizer)
+
+    config = PaliGemmaConfig(
+        vision_config=dict(hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=4,
+                           image_size=TINY_IMAGE_SIZE, patch_size=TINY_PATCH_SIZE),
+        text_config=dict(vocab_size=vocab_size, **TEXT_CONFIG),
+        image_token_index=processor.tokenizer.convert_tokens_to_ids("<image>"),
+        vocab_size=vocab_size,
+        projection_dim=TEXT_CONFIG["hidden_size"],
+        hidden_size=TEXT_CONFIG["hidden_size"],
+        pad_token_id=0,
+    )
+    config.name_or_path = name
+    model = PaliGemmaForConditionalGeneration(config).eval()
+    return model, processor
+
+
+def tiny_segformer(num_classes, name="tiny/segformer", seed=0):
+    torch.manual_seed(seed)
+    config = SegformerConfig(num_labels=num_classes, hidden_sizes=[8, 16, 32, 64], depths=[1, 1, 1, 1],
+                             num_attention_heads=[1, 1, 2, 4], decoder_hidden_size=32)
+    config.name_or_path = name
+    return SegformerForSemanticSegmentation(config).eval()
+
+
+def register_tiny_models(precision="fp32", segmentation_backend="eager"):
+    # Imported here so that the pages register their real loaders first and are then overridden
+    from core.segformer_backend import load_backend
+    from core.vision_cache import CachedVisionTower
+    from pages import chatbot, medpali, medreco, segmentation
+
+    def load_chatbot():
+        tokenizer, model = tiny_gemma("tiny/medgemma2")
+        return tokenizer, apply_precision(model, precision)
+
+    def load_medreco():
+        tokenizer, model = tiny_gemma("tiny/medgemma")
+        return apply_precision(model, precision), tokenizer
+
+    def load_medpali():
+        model, processor = tiny_paligemma("tiny/medpali")
+        model = apply_precision(model, precision)
+        model.vision_tower = CachedVisionTower(model.vision_tower, max_entries=medpali.FEATURE_CACHE_SIZE)
+        return model, processor
+
+    def load_segmentation():
+        model = tiny_segformer(segmentation.Configs.NUM_CLASSES, "tiny/segformer")
+        model = apply_precision(model, precision).to(segmentation.DEVICE)
+        # Exported into a fresh directory: tiny models have no revision to key a cached artifact on
+        return load_backend(model, segmentation_backend, segmentation.Configs.IMAGE_SIZE, precision,
+                            artifact_dir=tempfile.mkdtemp(prefix="segformer-"))
+
+    registry.register("chatbot", load_chatbot)
+    registry.register("medreco", load_medreco)
+    registry.register("medpali", load_medpali)
+    registry.register("segmentation", load_segmentation)
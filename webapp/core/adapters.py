@@ -0,0 +1,361 @@
+"""Shared-base mode: the chatbot and Medical Recommendations models as LoRA adapters on one Gemma base, held
+in memory once, instead of two full fine-tunes.
+
+    ANIMA_SHARED_BASE=google/gemma-2b         # base model; unset (default), each page loads its full model
+    ANIMA_ADAPTER_DIR=models/adapters         # one PEFT adapter directory per page: chatbot/, medreco/
+    ANIMA_ADAPTER_CHATBOT=<hub id or path>    # per-page override (CHATBOT, MEDRECO)
+    ANIMA_MERGE_ADAPTER=0                     # merge an adapter into the base weights: a page name, or "auto"
+                                              # for one serving most recent requests
+
+A page's adapter is loaded the first time the page is used, and is activated for each of its requests. The
+pages' models are registered as children of the base, so the memory budget evicts them together.
+Unmerged, switching adapters only changes which low-rank matrices run, at the cost of running them on every
+forward pass. A merged adapter runs at the full model's speed, but switching away from it rewrites the
+adapted weights twice: unmerged now, merged again on its next request. In bf16 every such round trip rounds the
+base weights a little further from what the other adapters expect, so merging needs an fp32 base. The Dashboard
+reports switch times and the memory saved against one full model per page.
+
+Adapters for the existing fine-tunes are extracted once from their difference to the base:
+
+    python -m core.adapters extract chatbot --base google/gemma-2b --rank 64
+
+A new fine-tune then costs its adapter's megabytes rather than a second base.
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from core.model_registry import registry
+from core.model_store import OFFLINE, from_pretrained
+from core.precision import apply_precision, load_kwargs, precision_for
+
+SHARED_BASE = os.environ.get("ANIMA_SHARED_BASE", "")
+# Registry parent of the adapter pages' models, which hold on to the shared base
+PARENT = "shared_base" if SHARED_BASE else None
+ADAPTER_DIR = os.environ.get("ANIMA_ADAPTER_DIR", os.path.join("models", "adapters"))
+MERGE_ADAPTER = os.environ.get("ANIMA_MERGE_ADAPTER", "0")
+# "auto" merges an adapter once it served this share of the last MERGE_WINDOW requests
+MERGE_WINDOW = 50
+MERGE_SHARE = 0.8
+
+# Page name -> the full fine-tune its adapter stands in for, which `extract` reads
+FINE_TUNES = {
+    "chatbot": "mockingmonkey/MedGemma2",
+    "medreco": "mockingmonkey/MedGemma",
+}
+TARGET_MODULES = ("q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj")
+
+
+def adapter_source(name):
+    return os.environ.get(f"ANIMA_ADAPTER_{name.upper()}", os.path.join(ADAPTER_DIR, name))
+
+
+def _nbytes(named_parameters):
+    return sum(parameter.numel() * parameter.element_size() for _, parameter in named_parameters)
+
+
+@dataclass
+class AdapterInfo:
+    source: str
+    size_bytes: int
+    load_seconds: float
+    requests: int = 0
+
+
+class SharedBase:
+    """One base model with a LoRA adapter per page, of which one is active at a time; see activate()."""
+
+    def __init__(self, model, base_id, merge=MERGE_ADAPTER):
+        self.model = model  # the base model until the first adapter is added, then its PeftModel
+        self.base_id = base_id
+        self.merge = merge
+        dtype = next(model.parameters()).dtype
+        if merge not in ("", "0") and dtype != torch.float32:
+            logging.warning(f"ANIMA_MERGE_ADAPTER={merge} ignored: merging adapters into {dtype} weights "
+                            f"and unmerging them again does not restore the base weights")
+            self.merge = "0"
+        self.base_bytes = _nbytes(model.named_parameters())
+        self.adapters = {}  # page name -> AdapterInfo
+        self.active = None
+        self.merged = False
+        self.switches = 0
+        self.merges = 0
+        self.switch_seconds = 0.0
+        self.last_switch_seconds = 0.0
+        self.recent = deque(maxlen=MERGE_WINDOW)
+        self._users = 0
+        self._switching = False
+        self._waiting = Counter()
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def _exclusive(self):
+        with self._condition:
+            while self._switching or self._users:
+                self._condition.wait()
+            self._switching = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._switching = False
+                self._condition.notify_all()
+
+    def add(self, name, source):
+        """Loads page `name`'s adapter from `source`, a hub id or directory, unless it is already loaded."""
+        from peft import PeftModel
+
+        with self._exclusive():
+            if name in self.adapters:
+                return
+            if OFFLINE and not os.path.isdir(source):
+                raise FileNotFoundError(f"Adapter '{name}' is not a local directory ({source}) and ANIMA_OFFLINE "
+                                        f"is set; extract it with python -m core.adapters extract {name}")
+            start_time = time.perf_counter()
+            if isinstance(self.model, PeftModel):
+                self.model.load_adapter(source, adapter_name=name)
+            else:
+                self.model = PeftModel.from_pretrained(self.model, source, adapter_name=name)
+            self.model.eval()
+            load_seconds = time.perf_counter() - start_time
+            size_bytes = _nbytes((parameter_name, parameter) for parameter_name, parameter
+                                 in self.model.named_parameters() if f".{name}." in parameter_name)
+            self.adapters[name] = AdapterInfo(source, size_bytes, load_seconds)
+            # from_pretrained activates the new adapter, load_adapter keeps the active one
+            self.active = self.model.active_adapter
+            logging.info(f"Loaded adapter '{name}' from {source} ({size_bytes / 2**20:.1f} MB) in {load_seconds:.1f}s")
+
+    def _merge_target(self):
+        if self.merge in ("", "0"):
+            return None
+        if self.merge != "auto":
+            return self.merge
+        if len(self.recent) < MERGE_WINDOW // 2:
+            return None
+        name, count = Counter(self.recent).most_common(1)[0]
+        return name if count >= MERGE_SHARE * len(self.recent) else None
+
+    def _can_enter(self, name):
+        if self._switching:
+            return False
+        if not self._users:
+            return True
+        # Callers of the active adapter join it only while no caller of another adapter is waiting
+        return self.active == name and not any(count for other, count in self._waiting.items() if other != name)
+
+    def count_request(self, name):
+        """Counts one request of page `name`, for the Dashboard and for choosing which adapter to merge."""
+        with self._condition:
+            self._count(name)
+
+    def _count(self, name):
+        self.recent.append(name)
+        self.adapters[name].requests += 1
+
+    @contextmanager
+    def activate(self, name, count=True):
+        """Runs the block with page `name`'s adapter active. Callers of the active adapter run together; a
+        caller of another adapter waits until they are done, and switches. With `count`, the block is
+        counted as one request of the page."""
+        with self._condition:
+            self._waiting[name] += 1
+            try:
+                while not self._can_enter(name):
+                    self._condition.wait()
+            finally:
+                self._waiting[name] -= 1
+            if count:
+                self._count(name)
+            merge = self._merge_target() == name
+            switch = not self._users and (self.active != name or self.merged != merge)
+            if switch:
+                self._switching = True
+            else:
+                self._users += 1
+
+        if switch:
+            try:
+                seconds = self._switch(name, merge)
+            finally:
+                with self._condition:
+                    self._switching = False
+                    self._condition.notify_all()
+            with self._condition:
+                self.switches += 1
+                self.switch_seconds += seconds
+                self.last_switch_seconds = seconds
+                self._users += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._users -= 1
+                self._condition.notify_all()
+
+    def _switch(self, name, merge):
+        start_time = time.perf_counter()
+        if self.merged:
+            self.model.base_model.unmerge_adapter()
+            self.merged = False
+        if self.active != name:
+            self.model.set_adapter(name)
+            self.active = name
+        if merge:
+            self.model.base_model.merge_adapter()
+            self.merged = True
+            self.merges += 1
+        seconds = time.perf_counter() - start_time
+        logging.info(f"Switched to adapter '{name}'{' (merged)' if merge else ''} in {seconds * 1000:.0f} ms")
+        return seconds
+
+    def stats(self):
+        with self._condition:
+            adapter_bytes = sum(info.size_bytes for info in self.adapters.values())
+            return {
+                "base_model": self.base_id,
+                "active": self.active,
+                "merged": self.merged,
+                "base_mb": self.base_bytes / 2**20,
+                "adapter_mb": adapter_bytes / 2**20,
+                # Against one full model per page, each the size of the base
+                "saved_mb": (self.base_bytes * (len(self.adapters) - 1) - adapter_bytes) / 2**20 if self.adapters else 0.0,
+                "switches": self.switches,
+                "merges": self.merges,
+                "mean_switch_ms": 1000 * self.switch_seconds / self.switches if self.switches else 0.0,
+                "last_switch_ms": 1000 * self.last_switch_seconds,
+                "adapters": [
+                    {"page": name, "source": info.source, "size_mb": info.size_bytes / 2**20,
+                     "load_seconds": info.load_seconds, "requests": info.requests}
+                    for name, info in self.adapters.items()
+                ],
+            }
+
+
+class AdapterModel:
+    """Page `name`'s model: the shared base with the page's adapter active during each generate() or forward
+    call. Everything else (generation_config, config, device) is the shared model's.
+
+    Each generate() counts as one request of the page. Forward calls do not, since one request can make many
+    of them (a prefill, or each verify pass of speculative decoding); callers that decode through forward
+    calls count their request with count_request()."""
+
+    def __init__(self, shared, name):
+        self.shared = shared
+        self.adapter_name = name
+        # Keys response cache entries and log records apart from the full fine-tune's, and the other page's
+        self.name_or_path = f"{shared.base_id}+{shared.adapters[name].source}"
+
+    def generate(self, *args, **kwargs):
+        with self.shared.activate(self.adapter_name):
+            return self.shared.model.generate(*args, **kwargs)
+
+    def __call__(self, *args, **kwargs):
+        with self.shared.activate(self.adapter_name, count=False):
+            return self.shared.model(*args, **kwargs)
+
+    def count_request(self):
+        self.shared.count_request(self.adapter_name)
+
+    def __getattr__(self, attribute):
+        return getattr(self.shared.model, attribute)
+
+
+def load_shared_base():
+    precision = precision_for("shared_base")
+    if precision == "int8":
+        # Dynamic quantization replaces the Linear layers the adapters are attached to
+        raise ValueError("int8 precision is not supported in shared-base mode; use fp32 or bf16")
+    model = from_pretrained(AutoModelForCausalLM, SHARED_BASE, **load_kwargs(precision))
+    return SharedBase(apply_precision(model, precision).eval(), SHARED_BASE)
+
+if SHARED_BASE:
+    registry.register("shared_base", load_shared_base)
+
+
+def load(name):
+    """(tokenizer, model) for page `name`: its adapter on the shared base, loading either on first use."""
+    shared = registry.get("shared_base")
+    source = adapter_source(name)
+    shared.add(name, source)
+    try:
+        # Adapters extracted by this module carry their fine-tune's tokenizer
+        tokenizer = from_pretrained(AutoTokenizer, source)
+    except (OSError, ValueError):
+        tokenizer = from_pretrained(AutoTokenizer, SHARED_BASE)
+    return tokenizer, AdapterModel(shared, name)
+
+
+def stats():
+    """The shared base's stats, or None when shared-base mode is off or nothing has used it yet."""
+    shared = registry.peek("shared_base") if SHARED_BASE else None
+    return shared.stats() if shared is not None else None
+
+
+@torch.no_grad()
+def extract(model_id, base_id, output, rank=64, target_modules=TARGET_MODULES):
+    """Saves a full fine-tune as a rank-`rank` LoRA adapter on `base_id`: each targeted weight's difference to
+    the base, truncated to its top singular vectors. Differences elsewhere (embeddings, norms) are not kept."""
+    from peft import LoraConfig, get_peft_model
+    from peft.tuners.lora import LoraLayer
+
+    base = AutoModelForCausalLM.from_pretrained(base_id, torch_dtype=torch.float32)
+    tuned = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.float32)
+    tuned_weights = dict(tuned.named_parameters())
+    base_weights = dict(base.named_parameters())
+    mismatched = [name for name, weight in base_weights.items()
+                  if name not in tuned_weights or tuned_weights[name].shape != weight.shape]
+    if base.config.model_type != tuned.config.model_type or mismatched:
+        raise ValueError(f"'{model_id}' ({tuned.config.model_type}) is not a fine-tune of '{base_id}' "
+                         f"({base.config.model_type}); {len(mismatched)} weights differ in shape or name")
+    untargeted = max(((tuned_weights[name] - weight).abs().max().item(), name) for name, weight in base_weights.items()
+                     if not any(f".{module}." in name for module in target_modules))
+
+    config = LoraConfig(r=rank, lora_alpha=rank, lora_dropout=0.0, target_modules=list(target_modules),
+                        task_type="CAUSAL_LM")
+    peft_model = get_peft_model(base, config)
+    kept = []
+    for module_name, module in peft_model.base_model.model.named_modules():
+        if not isinstance(module, LoraLayer):
+            continue
+        delta = tuned_weights[f"{module_name}.weight"] - module.base_layer.weight
+        u, s, vh = torch.linalg.svd(delta, full_matrices=False)
+        # lora_alpha == r, so the adapter adds exactly lora_B @ lora_A
+        root = s[:rank].sqrt()
+        module.lora_B["default"].weight.copy_(u[:, :rank] * root)
+        module.lora_A["default"].weight.copy_(root[:, None] * vh[:rank])
+        kept.append((s[:rank].square().sum() / s.square().sum().clamp_min(1e-12)).item())
+
+    peft_model.save_pretrained(output)
+    AutoTokenizer.from_pretrained(model_id).save_pretrained(output)
+    size_mb = sum(entry.stat().st_size for entry in os.scandir(output)) / 2**20
+    logging.info(f"Adapter for '{model_id}' written to {output} ({size_mb:.1f} MB): rank {rank} keeps "
+                 f"{100 * min(kept):.1f}-{100 * max(kept):.1f}% of each weight difference's energy; largest "
+                 f"difference outside the adapted layers {untargeted[0]:.2e} ({untargeted[1]})")
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    extract_parser = subparsers.add_parser("extract", help="extract a page's adapter from its full fine-tune")
+    extract_parser.add_argument("page", choices=list(FINE_TUNES))
+    extract_parser.add_argument("--base", default=SHARED_BASE, required=not SHARED_BASE,
+                                help="base model (default: ANIMA_SHARED_BASE)")
+    extract_parser.add_argument("--rank", type=int, default=64)
+    extract_parser.add_argument("--output", default=None, help="adapter directory (default: the page's source)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    extract(FINE_TUNES[args.page], args.base, args.output or adapter_source(args.page), rank=args.rank)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from transformers import DynamicCache
+
+# Upper bound on past-key-values memory held across all chat sessions
+CONVERSATION_CACHE_MB = float(os.environ.get("ANIMA_CONVERSATION_CACHE_MB", "512"))
+# Sessions idle for longer than this lose their cache
+CONVERSATION_TTL_SECONDS = float(os.environ.get("ANIMA_CONVERSATION_TTL_SECONDS", "1800"))
+
+
+def supports_prefix_cache(model):
+    # Models with a preset cache implementation (e.g. Gemma2's hybrid cache) refuse a user-provided DynamicCache
+    return getattr(model, "_supports_cache_class", False) and model.generation_config.cache_implementation is None
+
+
+def cache_nbytes(cache):
+    return sum(t.numel() * t.element_size() for t in cache.key_cache + cache.value_cache)
+
+
+def common_prefix_length(a, b):
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+@dataclass
+class ConversationState:
+    token_ids: list  # tokens whose keys/values are held in `cache`
+    cache: DynamicCache
+    nbytes: int
+    last_used: float
+
+
+class ConversationCacheStore:
+    """Per-session past-key-values, bounded by total memory and idle time."""
+
+    def __init__(self, max_total_mb=CONVERSATION_CACHE_MB, ttl_seconds=CONVERSATION_TTL_SECONDS):
+        self.max_total_bytes = int(max_total_mb * 2**20)
+        self.ttl_seconds = ttl_seconds
+        self._states = OrderedDict()  # session id -> ConversationState, least recently used first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
+        self.evictions = 0
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def checkout(self, session_id, input_ids):
+        """Returns a cache holding the longest reusable prefix of `input_ids` (a list of token ids).
+
+        The session's state is removed from the store until `checkin`, so a cache is never shared by two
+        generations at once.
+        """
+        with self._lock:
+            self._expire(time.time())
+            state = self._states.pop(session_id, None)
+            if state is not None:
+                self._total_bytes -= state.nbytes
+
+        if state is None:
+            cache = DynamicCache()
+            reused = 0
+        else:
+            cache = state.cache
+            # At least one token has to be prefilled to produce logits for the next step
+            reused = min(common_prefix_length(state.token_ids, input_ids), len(input_ids) - 1)
+            if reused < cache.get_seq_length():
+                cache.crop(reused)
+
+        self.reused_tokens += reused
+        self.prefilled_tokens += len(input_ids) - reused
+        return cache, reused
+
+    def checkin(self, session_id, cache, token_ids):
+        token_ids = list(token_ids[:cache.get_seq_length()])
+        state = ConversationState(token_ids, cache, cache_nbytes(cache), time.time())
+        with self._lock:
+            self._states[session_id] = state
+            self._total_bytes += state.nbytes
+            while self._total_bytes > self.max_total_bytes and self._states:
+                self._drop(next(iter(self._states)))
+
+    def drop(self, session_id):
+        with self._lock:
+            if session_id in self._states:
+                self._drop(session_id)
+
+    def _expire(self, now):
+        for session_id in [sid for sid, state in self._states.items() if now - state.last_used > self.ttl_seconds]:
+            self._drop(session_id)
+
+    def _drop(self, session_id):
+        state = self._states.pop(session_id)
+        self._total_bytes -= state.nbytes
+        self.evictions += 1
+        logging.info(f"Dropped conversation cache for session {session_id} ({state.nbytes / 2**20:.1f} MB)")
+
+
+conversation_caches = ConversationCacheStore()
@@ -0,0 +1,189 @@
+"""Bounded inference: a fixed number of concurrent inference slots per model, shared by every Streamlit
+session, with waiting callers served first come, first served.
+
+Each Streamlit session runs in its own thread. Without a bound, every concurrent call would use all of
+PyTorch's threads, and with a few users dozens of threads fight over the same cores. Instead, intra-op threads
+are divided between the slots, so that all slots busy at once roughly fill the machine.
+
+    ANIMA_INFERENCE_SLOTS=1             # concurrent inferences per model
+    ANIMA_INFERENCE_SLOTS_CHATBOT=2     # per-model override (CHATBOT, MEDRECO, MEDPALI, SEGMENTATION)
+    ANIMA_INFERENCE_THREADS=<n>         # intra-op threads per inference (default: cores / total slots)
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+MODELS = ("chatbot", "medreco", "medpali", "segmentation")
+NOTICE_INTERVAL = 0.5  # seconds between queue position updates to a waiting caller
+
+
+def slots_for(name):
+    return max(1, int(os.environ.get(f"ANIMA_INFERENCE_SLOTS_{name.upper()}",
+                                     os.environ.get("ANIMA_INFERENCE_SLOTS", "1"))))
+
+
+@dataclass
+class SlotStats:
+    completed: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    busy_seconds: float = 0.0
+    recent_waits: deque = field(default_factory=lambda: deque(maxlen=200))
+
+
+class _ModelSlots:
+    def __init__(self, slots):
+        self.slots = slots
+        self.active = 0
+        self.queue = deque()  # tickets of waiting callers, oldest first
+        self.stats = SlotStats()
+
+
+class InferenceExecutor:
+    """Grants inference slots per model in arrival order and keeps torch's thread pools sized to them."""
+
+    def __init__(self, slots=None, threads=None):
+        self.slots = slots if slots is not None else {name: slots_for(name) for name in MODELS}
+        self.start_time = time.perf_counter()
+        self._models = {name: _ModelSlots(count) for name, count in self.slots.items()}
+        self._condition = threading.Condition()
+        self._local = threading.local()
+        self.configure(threads)
+
+    def configure(self, threads=None):
+        """Sets intra-op threads per inference (default: ANIMA_INFERENCE_THREADS, else cores / total slots).
+
+        torch itself is configured at the next slot(), so that importing this module neither imports torch
+        nor sizes its thread pools as a side effect.
+        """
+        self.total_slots = sum(self.slots.values())
+        if threads is None:
+            threads = int(os.environ.get("ANIMA_INFERENCE_THREADS", "0")) or (os.cpu_count() or 1) // self.total_slots
+        self.threads = max(1, threads)
+        self._torch_configured = False
+
+    def apply_threads(self):
+        """Sizes torch's threads for an inference on the calling thread. slot() calls it; a thread that runs
+        an inference on behalf of a slot holder calls it too."""
+        import torch
+
+        if not self._torch_configured:
+            self._torch_configured = True
+            try:
+                # One inter-op worker per slot; this can only be set before the first inter-op parallel work
+                torch.set_num_interop_threads(self.total_slots)
+            except RuntimeError:
+                pass
+        # Threads that never ran torch work pick up the global setting lazily; set it for this one explicitly
+        torch.set_num_threads(self.threads)
+
+    def _model(self, name):
+        with self._condition:
+            if name not in self._models:
+                self.slots[name] = slots_for(name)
+                self._models[name] = _ModelSlots(self.slots[name])
+            return self._models[name]
+
+    @contextmanager
+    def slot(self, name):
+        """Holds one of model `name`'s slots for the duration of the block; yields the seconds spent queued."""
+        model = self._model(name)
+        on_wait = getattr(self._local, "on_wait", None)
+        ticket = object()
+        enqueued = time.perf_counter()
+        with self._condition:
+            model.queue.append(ticket)
+        try:
+            while True:
+                with self._condition:
+                    if model.queue[0] is ticket and model.active < model.slots:
+                        model.queue.popleft()
+                        model.active += 1
+                        # Wake the next in line too, in case another slot is free
+                        self._condition.notify_all()
+                        break
+                    if on_wait is None:
+                        self._condition.wait()
+                        continue
+                    position = model.queue.index(ticket) + 1
+                # Outside the lock: the callback may be slow, or raise when the Streamlit session reruns
+                on_wait(position, time.perf_counter() - enqueued)
+                with self._condition:
+                    if model.queue[0] is not ticket or model.active >= model.slots:
+                        self._condition.wait(NOTICE_INTERVAL)
+        except BaseException:
+            with self._condition:
+                if ticket in model.queue:
+                    model.queue.remove(ticket)
+                    self._condition.notify_all()
+            raise
+        waited = time.perf_counter() - enqueued
+
+        self.apply_threads()
+        start_time = time.perf_counter()
+        try:
+            yield waited
+        finally:
+            busy = time.perf_counter() - start_time
+            with self._condition:
+                model.active -= 1
+                stats = model.stats
+                stats.completed += 1
+                stats.wait_seconds += waited
+                stats.max_wait_seconds = max(stats.max_wait_seconds, waited)
+                stats.busy_seconds += busy
+                stats.recent_waits.append(waited)
+                self._condition.notify_all()
+            if waited > 1.0:
+                logging.info(f"Inference on '{name}' waited {waited:.1f}s for a slot")
+
+    @contextmanager
+    def wait_notices(self, on_wait):
+        """Calls `on_wait(queue position, seconds waited)` while this thread waits for a slot in the block."""
+        previous = getattr(self._local, "on_wait", None)
+        self._local.on_wait = on_wait
+        try:
+            yield
+        finally:
+            self._local.on_wait = previous
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.start_time
+        with self._condition:
+            rows = []
+            for name, model in self._models.items():
+                stats = model.stats
+                recent = sorted(stats.recent_waits)
+                rows.append({
+                    "model": name,
+                    "slots": model.slots,
+                    "active": model.active,
+                    "queued": len(model.queue),
+                    "completed": stats.completed,
+                    "throughput_per_min": 60 * stats.completed / elapsed if elapsed else 0.0,
+                    "mean_wait_seconds": stats.wait_seconds / stats.completed if stats.completed else 0.0,
+                    "p95_wait_seconds": recent[int(0.95 * (len(recent) - 1))] if recent else 0.0,
+                    "max_wait_seconds": stats.max_wait_seconds,
+                    "utilization": stats.busy_seconds / (elapsed * model.slots) if elapsed else 0.0,
+                })
+            return rows
+
+
+executor = InferenceExecutor()
+
+
+@contextmanager
+def queue_notices(placeholder):
+    """Shows queue position and waiting time on a Streamlit placeholder (st.empty()) during the block."""
+    def on_wait(position, waited_seconds):
+        placeholder.info(f"⏳ Waiting for the model: position {position} in the queue, {waited_seconds:.0f}s so far")
+
+    try:
+        with executor.wait_notices(on_wait):
+            yield
+    finally:
+        placeholder.empty()
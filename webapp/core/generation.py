@@ -0,0 +1,221 @@
+import logging
+import time
+from collections import deque
+from contextlib import nullcontext
+from dataclasses import dataclass
+from threading import Event, Thread
+from typing import Optional
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+from transformers.generation.streamers import BaseStreamer
+
+
+def truncate_to_last_sentence(response):
+    if '.' in response:
+        last_period_index = response.rfind('.')
+        response = response[:last_period_index + 1]
+    return response
+
+
+@dataclass
+class GenerationStats:
+    prompt_tokens: int = 0
+    new_tokens: int = 0
+    time_to_first_token: Optional[float] = None
+    total_time: float = 0.0
+    cached: bool = False  # served from the response cache, nothing was generated
+    acceptance_rate: Optional[float] = None  # share of drafted tokens accepted, when decoded speculatively
+    cancelled: bool = False  # the stream was closed before generation finished
+
+    @property
+    def tokens_per_second(self):
+        # Decode rate, excluding the prefill that precedes the first token
+        decode_time = self.total_time - (self.time_to_first_token or 0.0)
+        if self.new_tokens <= 1 or decode_time <= 0:
+            return 0.0
+        return (self.new_tokens - 1) / decode_time
+
+
+class TimedTextStreamer(TextIteratorStreamer):
+    # generate() first puts the prompt, then one tensor per decoded step
+    def __init__(self, tokenizer, **kwargs):
+        super().__init__(tokenizer, **kwargs)
+        self.start_time = time.perf_counter()
+        self.first_token_time = None
+        self.generated_ids = []
+        self._prompt_seen = False
+
+    def put(self, value):
+        if self._prompt_seen:
+            if self.first_token_time is None:
+                self.first_token_time = time.perf_counter()
+            self.generated_ids.extend(value.flatten().tolist())
+        else:
+            self._prompt_seen = True
+        super().put(value)
+
+
+class PrefillTimer(BaseStreamer):
+    """Records when generate() emits its first new token, which separates prefill from the decode loop."""
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.first_token_time = None
+        self._prompt_seen = False
+
+    def put(self, value):
+        if not self._prompt_seen:
+            self._prompt_seen = True
+        elif self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+
+    def end(self):
+        pass
+
+
+class CancelledCriteria(StoppingCriteria):
+    """Finishes every row once `event` is set."""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+def stream_generate(model, tokenizer, input_ids, stats, skip_prompt=True, output_ids=None, generate=None,
+                    **generate_kwargs):
+    """Yields decoded text chunks while generate() runs in a background thread.
+
+    Generated token ids are appended to `output_ids` once generation finishes, if a list is given. `generate`
+    replaces `model.generate`, e.g. with a SpeculativeDecoder's. The background thread uses the caller's
+    torch thread count, and when the stream is closed early (a Streamlit rerun, a dropped client), generation
+    stops at the next token and the thread is joined before the close returns, so a caller holding an
+    inference slot does not release it while its generation still runs.
+    """
+    generate = generate or model.generate
+    streamer = TimedTextStreamer(tokenizer, skip_prompt=skip_prompt, skip_special_tokens=True)
+    cancelled = Event()
+    stopping_criteria = StoppingCriteriaList(generate_kwargs.pop("stopping_criteria", None) or [])
+    stopping_criteria.append(CancelledCriteria(cancelled))
+    threads = torch.get_num_threads()
+    error = []
+
+    def run():
+        torch.set_num_threads(threads)
+        try:
+            generate(input_ids, streamer=streamer, stopping_criteria=stopping_criteria, **generate_kwargs)
+        except Exception as e:
+            error.append(e)
+            streamer.end()
+
+    stats.prompt_tokens = input_ids.shape[-1]
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        for text in streamer:
+            yield text
+    finally:
+        if thread.is_alive():
+            cancelled.set()
+            stats.cancelled = True
+        thread.join()
+
+    if error:
+        raise error[0]
+    stats.new_tokens = len(streamer.generated_ids)
+    if output_ids is not None:
+        output_ids.extend(streamer.generated_ids)
+    stats.total_time = time.perf_counter() - streamer.start_time
+    if streamer.first_token_time is not None:
+        stats.time_to_first_token = streamer.first_token_time - streamer.start_time
+
+
+def plan_batches(lengths, max_new_tokens, token_budget, max_batch_size):
+    """Groups prompt indices of similar length so that padding stays small.
+
+    A batch is closed once another prompt would push its padded size (prompt + new tokens, per row) past
+    `token_budget` or its row count past `max_batch_size`.
+    """
+    batches, batch = [], []
+    for index in sorted(range(len(lengths)), key=lengths.__getitem__):
+        # Indices arrive in ascending length, so the newest prompt is always the longest in the batch
+        padded_tokens = (len(batch) + 1) * (lengths[index] + max_new_tokens)
+        if batch and (len(batch) == max_batch_size or padded_tokens > token_budget):
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _is_out_of_memory(error):
+    message = str(error).lower()
+    return "out of memory" in message or "can't allocate memory" in message
+
+
+def generate_left_padded(model, tokenizer, rows, stopping=None, **generate_kwargs):
+    """Runs one generate() over token id lists and returns each row's sequence without its padding.
+
+    `stopping`, if given, takes the padded prompt width and returns the batch's stopping criteria."""
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    width = max(len(ids) for ids in rows)
+    input_ids = torch.full((len(rows), width), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(rows), width), dtype=torch.long)
+    for row, ids in enumerate(rows):
+        input_ids[row, width - len(ids):] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[row, width - len(ids):] = 1
+    if stopping is not None:
+        generate_kwargs["stopping_criteria"] = stopping(width)
+
+    with torch.inference_mode():
+        outputs = model.generate(input_ids=input_ids, attention_mask=attention_mask,
+                                 pad_token_id=pad_token_id, **generate_kwargs)
+    return [outputs[row, width - len(ids):] for row, ids in enumerate(rows)]
+
+
+def batched_generate(model, tokenizer, prompts, max_new_tokens, token_budget, max_batch_size, slot=None,
+                     stopping=None, deadline=None, **generate_kwargs):
+    """Yields (prompt index, output token ids, seconds) for every prompt, batch by batch as each one finishes.
+
+    `seconds` is the prompt's share of its batch's generation time. `slot`, if given, returns a context
+    manager held around each batch's generate(), e.g. an inference executor slot; waiting for it is not timed.
+    `stopping` builds each batch's stopping criteria, as in generate_left_padded. Rows that stop early are
+    right-padded to the batch's longest. `deadline`, if given, is a per-request time limit in seconds: each
+    batch's generate() gets that much per row, so a limit meant for one request does not cut a batch short.
+
+    Prompts are strings or lists of token ids. They are bucketed by length and left-padded. When a batch
+    runs out of memory it is split in half and the batch size is capped for the rest of the run.
+    """
+    encoded = [prompt if isinstance(prompt, list) else tokenizer.encode(prompt) for prompt in prompts]
+    pending = deque(plan_batches([len(ids) for ids in encoded], max_new_tokens, token_budget, max_batch_size))
+    batch_cap = max_batch_size
+
+    while pending:
+        batch = pending.popleft()
+        if len(batch) > batch_cap:
+            pending.appendleft(batch[batch_cap:])
+            batch = batch[:batch_cap]
+
+        try:
+            with slot() if slot is not None else nullcontext():
+                start_time = time.perf_counter()
+                if deadline:
+                    generate_kwargs["max_time"] = deadline * len(batch)
+                outputs = generate_left_padded(model, tokenizer, [encoded[i] for i in batch],
+                                               stopping=stopping, max_new_tokens=max_new_tokens,
+                                               **generate_kwargs)
+        except RuntimeError as e:
+            if len(batch) == 1 or not _is_out_of_memory(e):
+                raise
+            batch_cap = len(batch) // 2
+            logging.warning(f"Batch of {len(batch)} prompts ran out of memory, retrying with {batch_cap}")
+            pending.appendleft(batch[batch_cap:])
+            pending.appendleft(batch[:batch_cap])
+            continue
+
+        seconds = (time.perf_counter() - start_time) / len(batch)
+        for index, output_ids in zip(batch, outputs):
+            yield index, output_ids, seconds
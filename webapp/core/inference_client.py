@@ -0,0 +1,78 @@
+import base64
+import io
+import json
+import os
+import urllib.error
+import urllib.request
+
+import numpy as np
+from PIL import Image
+
+# When set, pages send inference to the headless service (python -m service.server) instead of loading models
+INFERENCE_SERVICE_URL = os.environ.get("ANIMA_INFERENCE_URL", "").rstrip("/")
+INFERENCE_TIMEOUT_SECONDS = float(os.environ.get("ANIMA_INFERENCE_TIMEOUT_SECONDS", "300"))
+# Prompts per /v1/recommend call, so long CSVs render progressively
+RECOMMEND_CHUNK_SIZE = 16
+
+
+class InferenceServiceError(RuntimeError):
+    """Raised when the inference service rejects a request or cannot be reached."""
+
+
+def enabled():
+    return bool(INFERENCE_SERVICE_URL)
+
+
+def _post(path, payload):
+    request = urllib.request.Request(INFERENCE_SERVICE_URL + path, data=json.dumps(payload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=INFERENCE_TIMEOUT_SECONDS) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read()).get("error", e.reason)
+        except ValueError:
+            message = e.reason
+        if e.code == 503:
+            message = f"inference service is busy, retry shortly ({message})"
+        raise InferenceServiceError(message) from e
+    except urllib.error.URLError as e:
+        raise InferenceServiceError(f"inference service unreachable at {INFERENCE_SERVICE_URL}: {e.reason}") from e
+
+
+def _encode_image(image):
+    if isinstance(image, bytes):
+        data = image
+    else:
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        data = buffer.getvalue()
+    return base64.b64encode(data).decode("ascii")
+
+
+def chat(query, history):
+    return _post("/v1/chat", {"query": query, "history": [list(turn) for turn in history]})["response"]
+
+
+def recommend(input_texts):
+    """Yields (index, recommendation) for each prompt, a chunk at a time."""
+    for start in range(0, len(input_texts), RECOMMEND_CHUNK_SIZE):
+        chunk = input_texts[start:start + RECOMMEND_CHUNK_SIZE]
+        for offset, text in enumerate(_post("/v1/recommend", {"prompts": chunk})["recommendations"]):
+            yield start + offset, text
+
+
+def medpali(image, prompts):
+    return _post("/v1/medpali", {"image": _encode_image(image), "prompts": list(prompts)})["answers"]
+
+
+def segment(image, postprocess=None):
+    """Returns (mask, inference_time) for an image given as a PIL image or encoded file bytes, post-processed
+    as `postprocess` asks (default: the service's configured mode)."""
+    payload = {"image": _encode_image(image)}
+    if postprocess is not None:
+        payload["postprocess"] = postprocess
+    result = _post("/v1/segment", payload)
+    mask = np.asarray(Image.open(io.BytesIO(base64.b64decode(result["mask_png"]))))
+    return mask, result["inference_time"]
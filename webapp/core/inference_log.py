@@ -0,0 +1,283 @@
+import atexit
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import numpy as np
+from PIL import Image
+
+DATABASE_PATH = os.path.join("databases", "inference_data.db")
+INFERENCE_LOG_ENABLED = os.environ.get("ANIMA_INFERENCE_LOG", "1") != "0"
+LOG_QUEUE_SIZE = int(os.environ.get("ANIMA_LOG_QUEUE_SIZE", "1000"))
+LOG_BATCH_SIZE = int(os.environ.get("ANIMA_LOG_BATCH_SIZE", "50"))
+LOG_FLUSH_INTERVAL = float(os.environ.get("ANIMA_LOG_FLUSH_INTERVAL", "0.5"))  # seconds a batch waits to fill up
+LOG_ENQUEUE_TIMEOUT = 0.1  # longest a request thread blocks on a full queue before the record is dropped
+
+# Columns added to model_inference after its original schema, created on existing databases at startup
+ADDED_COLUMNS = {
+    "input_image_hash": "TEXT",
+    "stage_timings": "TEXT",  # JSON object of stage name -> seconds
+    "prompt_tokens": "INTEGER",
+    "output_tokens": "INTEGER",
+    "rss_mb": "REAL",
+    "speculative_stats": "TEXT",  # JSON object of draft/accept counts and timings
+    "stop_stats": "TEXT",  # JSON object: why generation stopped, tokens saved and discarded
+    "input_content_hash": "TEXT",  # hash of the encoded upload (core.ingest.content_hash), for result lookups
+}
+
+
+def connect(path=DATABASE_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def setup_database(conn):
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS model_inference (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            model_name TEXT,
+            model_version TEXT,
+            model_type TEXT,
+            input_image BLOB,
+            input_size TEXT,
+            output_segmentation BLOB,
+            inference_time REAL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            device TEXT,
+            system_load REAL,
+            accuracy REAL,
+            loss REAL
+        )''')
+        # Rows written before images and masks moved to their own tables keep their inline blobs, and
+        # rows written before tracing have no stage timings, token counts or RSS
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(model_inference)")}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in columns:
+                conn.execute(f"ALTER TABLE model_inference ADD COLUMN {column} {column_type}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_model_inference_timestamp ON model_inference (timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_model_inference_content "
+                     "ON model_inference (input_content_hash, model_name, model_version)")
+        # Hourly per-model aggregates kept up to date by the writer, so totals never scan model_inference
+        conn.execute('''CREATE TABLE IF NOT EXISTS inference_rollup (
+            bucket TEXT,
+            model_name TEXT,
+            count INTEGER,
+            total_time REAL,
+            min_time REAL,
+            max_time REAL,
+            PRIMARY KEY (bucket, model_name)
+        )''')
+        if conn.execute("SELECT COUNT(*) FROM inference_rollup").fetchone()[0] == 0:
+            conn.execute('''INSERT INTO inference_rollup
+                            SELECT strftime('%Y-%m-%d %H:00:00', timestamp), model_name, COUNT(*),
+                                   SUM(inference_time), MIN(inference_time), MAX(inference_time)
+                            FROM model_inference GROUP BY 1, 2''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS images (
+            hash TEXT PRIMARY KEY,
+            format TEXT,
+            width INTEGER,
+            height INTEGER,
+            data BLOB
+        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS inference_masks (
+            inference_id INTEGER PRIMARY KEY REFERENCES model_inference (id),
+            height INTEGER,
+            width INTEGER,
+            encoding TEXT,
+            data BLOB
+        )''')
+
+
+def image_digest(image):
+    # Content address of the decoded pixels, so re-encodings of one image share an entry
+    digest = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def encode_mask(mask):
+    return "zlib-u8", zlib.compress(np.ascontiguousarray(mask, dtype=np.uint8).tobytes(), 3)
+
+
+def decode_mask(encoding, data, height, width):
+    if encoding != "zlib-u8":
+        raise ValueError(f"Unknown mask encoding '{encoding}'")
+    return np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(height, width)
+
+
+@dataclass
+class InferenceRecord:
+    model_name: str
+    model_type: str
+    inference_time: float
+    device: str = "cpu"
+    model_version: str = "1.0"
+    input_size: Optional[str] = None
+    system_load: Optional[float] = None
+    image: Any = None  # PIL image, stored once per distinct content; may be a reduced copy of image_bytes
+    image_bytes: Optional[bytes] = None  # original encoded upload; the image is PNG-encoded when missing
+    content_hash: Optional[str] = None  # content hash of image_bytes, as computed by core.ingest
+    mask: Optional[np.ndarray] = None
+    stage_timings: Optional[dict] = None
+    prompt_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    rss_mb: Optional[float] = None
+    speculative_stats: Optional[dict] = None
+    stop_stats: Optional[dict] = None
+
+
+class InferenceLogger:
+    """Writes inference records to SQLite from a background thread.
+
+    Request threads only enqueue; one writer thread owns a persistent WAL connection and commits records in
+    batches. When the bounded queue stays full, records are dropped rather than stalling inference.
+    """
+
+    def __init__(self, path=DATABASE_PATH, max_queue=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL):
+        self.enabled = INFERENCE_LOG_ENABLED
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self.write_seconds = 0.0
+        self.first_inference_time = {}  # model name -> inference time of its first request in this process
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            conn = connect(self.path)
+            try:
+                setup_database(conn)
+            finally:
+                conn.close()
+            self._thread = threading.Thread(target=self._run, name="inference-logger", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def log(self, record):
+        self.first_inference_time.setdefault(record.model_name, record.inference_time)
+        if not self.enabled:
+            return False
+        self.start()
+        try:
+            self._queue.put(record, timeout=LOG_ENQUEUE_TIMEOUT)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logging.warning(f"Inference log queue is full, dropped a {record.model_type} record")
+            return False
+
+    def flush(self, timeout=10.0):
+        # Waits until every record enqueued so far has been committed, or the timeout expires
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    @property
+    def mean_write_ms(self):
+        return 1000 * self.write_seconds / self.written if self.written else 0.0
+
+    def _run(self):
+        conn = connect(self.path)
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            start_time = time.perf_counter()
+            try:
+                written = 0
+                with conn:
+                    # One transaction per batch, one savepoint per record: a record that fails to write is
+                    # rolled back on its own and the rest of the batch is still committed
+                    conn.execute("BEGIN")
+                    for record in batch:
+                        conn.execute("SAVEPOINT record")
+                        try:
+                            self._write(conn, record)
+                            written += 1
+                        except Exception as e:
+                            conn.execute("ROLLBACK TO record")
+                            logging.error(f"Failed to write a {record.model_type} inference record: {e}")
+                        conn.execute("RELEASE record")
+                self.written += written
+                self.write_seconds += time.perf_counter() - start_time
+            except Exception as e:
+                logging.error(f"Failed to write {len(batch)} inference records: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, conn, record):
+        image_hash = None
+        if record.image is not None:
+            image_hash = image_digest(record.image)
+            if conn.execute("SELECT 1 FROM images WHERE hash = ?", (image_hash,)).fetchone() is None:
+                data = record.image_bytes
+                if data is None:
+                    buffer = io.BytesIO()
+                    record.image.save(buffer, format="PNG")
+                    image_format, (width, height), data = "PNG", record.image.size, buffer.getvalue()
+                else:
+                    # `image` may be a reduced copy; the stored upload describes itself
+                    with Image.open(io.BytesIO(data)) as encoded:
+                        image_format, (width, height) = encoded.format, encoded.size
+                conn.execute("INSERT INTO images VALUES (?, ?, ?, ?, ?)",
+                             (image_hash, image_format, width, height, data))
+
+        stage_timings = json.dumps(record.stage_timings) if record.stage_timings else None
+        speculative_stats = json.dumps(record.speculative_stats) if record.speculative_stats else None
+        stop_stats = json.dumps(record.stop_stats) if record.stop_stats else None
+        cursor = conn.execute('''INSERT INTO model_inference (model_name, model_version, model_type, input_size, inference_time, device, system_load, input_image_hash,
+                                                              stage_timings, prompt_tokens, output_tokens, rss_mb, speculative_stats, stop_stats,
+                                                              input_content_hash)
+                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                              (record.model_name, record.model_version, record.model_type, record.input_size,
+                               record.inference_time, record.device, record.system_load, image_hash,
+                               stage_timings, record.prompt_tokens, record.output_tokens, record.rss_mb,
+                               speculative_stats, stop_stats, record.content_hash))
+
+        conn.execute('''INSERT INTO inference_rollup VALUES (strftime('%Y-%m-%d %H:00:00', 'now'), ?, 1, ?, ?, ?)
+                        ON CONFLICT (bucket, model_name) DO UPDATE SET
+                            count = count + 1,
+                            total_time = total_time + excluded.total_time,
+                            min_time = MIN(min_time, excluded.min_time),
+                            max_time = MAX(max_time, excluded.max_time)''',
+                     (record.model_name, record.inference_time, record.inference_time, record.inference_time))
+
+        if record.mask is not None:
+            encoding, data = encode_mask(record.mask)
+            conn.execute("INSERT INTO inference_masks VALUES (?, ?, ?, ?, ?)",
+                         (cursor.lastrowid, record.mask.shape[0], record.mask.shape[1], encoding, data))
+
+
+inference_logger = InferenceLogger()
@@ -0,0 +1,170 @@
+"""Image ingestion shared by MedPali and segmentation.
+
+An upload is checked against the pixel limit from its header alone, before any pixels are decoded. JPEGs are
+then decoded at reduced scale: libjpeg's 1/2, 1/4 or 1/8 DCT scaling, never below the model's input size.
+The model-resolution result is cached by a hash of the encoded bytes, so a follow-up about the same upload
+skips decoding entirely.
+
+    ANIMA_MAX_IMAGE_PIXELS=50000000   # larger uploads are rejected
+    ANIMA_JPEG_DRAFT=1                # 0 decodes JPEGs at full resolution
+    ANIMA_INGEST_CACHE_SIZE=32        # ingested images kept, shared by all sessions
+    ANIMA_PREVIEW_SIZE=1024           # longest side of the copy shown back to the user
+"""
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import torch
+from PIL import Image
+
+MAX_IMAGE_PIXELS = int(os.environ.get("ANIMA_MAX_IMAGE_PIXELS", "50000000"))
+JPEG_DRAFT = os.environ.get("ANIMA_JPEG_DRAFT", "1") != "0"
+CACHE_SIZE = int(os.environ.get("ANIMA_INGEST_CACHE_SIZE", "32"))
+PREVIEW_SIZE = int(os.environ.get("ANIMA_PREVIEW_SIZE", "1024"))
+# PIL warns above its own limit and refuses images over twice it; keep it in step with ours, which the header
+# check enforces first
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+class ImageRejected(ValueError):
+    """Raised for uploads that cannot be decoded or exceed the pixel limit."""
+
+
+@dataclass
+class IngestedImage:
+    digest: Optional[str]  # content hash of the upload; None when it was not cached
+    original_size: tuple  # (width, height) of the upload at full resolution
+    preview: Image.Image  # at most PREVIEW_SIZE on its longest side, in the decoded mode
+    pixels: Image.Image  # RGB at the model's input size
+    tensor: Optional[torch.Tensor] = None  # (3, H, W) float32, normalized, when a mean and std were given
+
+
+def content_hash(source):
+    if isinstance(source, bytes):
+        return hashlib.blake2b(source, digest_size=16).hexdigest()
+    digest = hashlib.blake2b(f"{source.mode}:{source.size}".encode(), digest_size=16)
+    digest.update(source.tobytes())
+    return digest.hexdigest()
+
+
+def check_image(data):
+    """Returns the (width, height) of encoded image `data`, reading only its header."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            size = image.size
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageRejected(f"unreadable image: {e}") from e
+    if size[0] * size[1] > MAX_IMAGE_PIXELS:
+        raise ImageRejected(f"image is {size[0]}x{size[1]} pixels, above the {MAX_IMAGE_PIXELS} pixel limit")
+    return size
+
+
+def open_image(source, target_size=None):
+    """Decodes encoded bytes or a PIL image; returns (image, original size).
+
+    With `target_size` (width, height), a JPEG is decoded at the smallest DCT scale that is still at least
+    that large.
+    """
+    if isinstance(source, Image.Image):
+        return source, source.size
+    check_image(source)
+    try:
+        image = Image.open(io.BytesIO(source))
+        original_size = image.size
+        if target_size is not None and JPEG_DRAFT and image.format == "JPEG":
+            image.draft("RGB", target_size)
+        image.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageRejected(f"unreadable image: {e}") from e
+    return image, original_size
+
+
+def model_pixels(image, size, resample):
+    # Grayscale scans are resized on their single channel and only then expanded to RGB
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    pixels = image.resize(size, resample)
+    return pixels if pixels.mode == "RGB" else pixels.convert("RGB")
+
+
+def to_tensor(pixels, mean, std):
+    """RGB uint8 pixels to a normalized (3, H, W) float32 tensor: (x / 255 - mean) / std as one multiply-add."""
+    array = torch.from_numpy(np.array(pixels)).permute(2, 0, 1).to(torch.float32, memory_format=torch.contiguous_format)
+    scale = torch.tensor([1 / (255 * s) for s in std]).view(3, 1, 1)
+    shift = torch.tensor([-m / s for m, s in zip(mean, std)]).view(3, 1, 1)
+    return torch.addcmul(shift, array, scale)
+
+
+class _Cache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+cache = _Cache(CACHE_SIZE)
+
+
+def _preview(image):
+    if max(image.size) <= PREVIEW_SIZE:
+        return image
+    preview = image.copy()
+    preview.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE))
+    return preview
+
+
+def ingest(source, size, resample=Image.BILINEAR, mean=None, std=None, use_cache=True):
+    """Prepares an upload (encoded bytes, a file path or a PIL image) for a model taking `size` (width, height)
+    inputs. Results are cached by content, per size and normalization."""
+    if isinstance(source, (str, os.PathLike)):
+        source = Path(source).read_bytes()
+    key = None
+    if use_cache:
+        key = (content_hash(source), tuple(size), int(resample), mean, std)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    image, original_size = open_image(source, size)
+    pixels = model_pixels(image, tuple(size), resample)
+    tensor = to_tensor(pixels, mean, std) if mean is not None else None
+    ingested = IngestedImage(key[0] if key else None, original_size, _preview(image), pixels, tensor)
+    if use_cache:
+        cache.put(key, ingested)
+    return ingested
+
+
+def preview(source):
+    """A display copy of an upload, decoded at reduced scale where the format allows; cached by content."""
+    key = (content_hash(source), "preview")
+    cached = cache.get(key)
+    if cached is None:
+        image, _ = open_image(source, (PREVIEW_SIZE, PREVIEW_SIZE))
+        cached = _preview(image)
+        cache.put(key, cached)
+    return cached
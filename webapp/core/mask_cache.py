@@ -0,0 +1,137 @@
+"""Segmentation results by content: masks keyed by a hash of the uploaded bytes plus model name and version.
+
+Lookups are served from an in-memory LRU first, then from the inference database, which already stores the
+mask of every logged segmentation (see core/inference_log.py). Rendered overlays share the LRU, so re-opening
+a study, or a Streamlit rerun of the page, neither runs the model nor redraws the overlay.
+
+    ANIMA_MASK_CACHE=1           # 0 disables the cache
+    ANIMA_MASK_CACHE_MB=256      # memory for cached masks and overlays, shared by all sessions
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from core.inference_log import DATABASE_PATH, connect, decode_mask
+
+MASK_CACHE_ENABLED = os.environ.get("ANIMA_MASK_CACHE", "1") != "0"
+MASK_CACHE_MB = float(os.environ.get("ANIMA_MASK_CACHE_MB", "256"))
+
+
+def _size(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    return len(value)
+
+
+class MaskCache:
+    """Masks and rendered overlays per (content hash, model name, model version), LRU-evicted by size."""
+
+    def __init__(self, path=DATABASE_PATH, max_mb=MASK_CACHE_MB):
+        self.enabled = MASK_CACHE_ENABLED
+        self.path = path
+        self.max_bytes = int(max_mb * 2**20)
+        self.hits = 0
+        self.database_hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._conn = None
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+
+    def _get_entry(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def _put_entry(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= _size(self._entries.pop(key))
+            self._entries[key] = value
+            self._bytes += _size(value)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= _size(evicted)
+
+    def _load(self, digest, model_name, model_version):
+        # The newest logged mask for this upload; the writer may not have caught up with the latest ones yet
+        with self._db_lock:
+            if self._conn is None:
+                self._conn = connect(self.path)
+            try:
+                row = self._conn.execute('''SELECT m.height, m.width, m.encoding, m.data
+                                            FROM model_inference i JOIN inference_masks m ON m.inference_id = i.id
+                                            WHERE i.input_content_hash = ? AND i.model_name = ? AND i.model_version = ?
+                                            ORDER BY i.id DESC LIMIT 1''',
+                                         (digest, model_name, model_version)).fetchone()
+            except sqlite3.OperationalError as e:
+                # Nothing logged yet, or a database from before content hashes were recorded
+                logging.debug(f"Mask lookup skipped the database: {e}")
+                return None
+        if row is None:
+            return None
+        height, width, encoding, data = row
+        return decode_mask(encoding, data, height, width)
+
+    def get(self, digest, model_name, model_version):
+        """The cached mask for an upload, or None. A mask found in the database is kept in memory from then on."""
+        if not self.enabled or digest is None:
+            return None
+        start_time = time.perf_counter()
+        key = (digest, model_name, model_version)
+        mask = self._get_entry(key)
+        if mask is not None:
+            self.hits += 1
+        else:
+            mask = self._load(digest, model_name, model_version)
+            if mask is None:
+                self.misses += 1
+            else:
+                self.database_hits += 1
+                self._put_entry(key, mask)
+        self.lookup_seconds += time.perf_counter() - start_time
+        return mask
+
+    def put(self, digest, model_name, model_version, mask):
+        # The database copy is written by the inference logger along with the record, as uint8
+        if self.enabled and digest is not None:
+            self._put_entry((digest, model_name, model_version), np.ascontiguousarray(mask, dtype=np.uint8))
+
+    def overlay(self, digest, model_name, model_version, renderer, render):
+        """The overlay drawn by `renderer` for an upload, calling `render()` only when it is not cached."""
+        if not self.enabled or digest is None:
+            return render()
+        key = (digest, model_name, model_version, renderer)
+        overlay = self._get_entry(key)
+        if overlay is None:
+            overlay = render()
+            self._put_entry(key, overlay)
+        return overlay
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.database_hits + self.misses
+            return {
+                "hits": self.hits,
+                "database_hits": self.database_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.database_hits) / lookups if lookups else 0.0,
+                "mean_lookup_ms": 1000 * self.lookup_seconds / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "size_mb": self._bytes / 2**20,
+            }
+
+
+mask_cache = MaskCache()
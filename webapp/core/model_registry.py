@@ -0,0 +1,190 @@
+import ctypes
+import gc
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import psutil
+
+# Resident set size (in MB) above which least-recently-used models are evicted.
+# 0 disables eviction: every model stays resident once loaded.
+MEMORY_BUDGET_MB = float(os.environ.get("ANIMA_MODEL_MEMORY_BUDGET_MB", "0"))
+# Run each model's warmup (one tiny inference) right after it loads, so the first request does not pay for
+# lazy kernel and allocator initialization
+WARMUP_ENABLED = os.environ.get("ANIMA_WARMUP", "0") != "0"
+
+
+def current_rss_mb():
+    return psutil.Process().memory_info().rss / 2**20
+
+
+def _release_memory():
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+    # glibc keeps freed arenas around; hand them back so RSS reflects the eviction
+    if sys.platform.startswith("linux"):
+        try:
+            ctypes.CDLL("libc.so.6").malloc_trim(0)
+        except OSError:
+            pass
+
+
+@dataclass
+class ModelStats:
+    loads: int = 0
+    evictions: int = 0
+    hits: int = 0
+    last_load_seconds: float = 0.0
+    last_warmup_seconds: float = 0.0
+
+
+class ModelRegistry:
+    """Loads models on first use and keeps them resident under an RSS budget."""
+
+    def __init__(self, memory_budget_mb=MEMORY_BUDGET_MB, warmup=WARMUP_ENABLED):
+        self.memory_budget_mb = memory_budget_mb
+        self.warmup = warmup
+        self._loaders = {}
+        self._warmups = {}
+        self._models = OrderedDict()  # name -> loaded object, least recently used first
+        self._stats = {}
+        self._load_locks = {}
+        self._parents = {}  # name -> the model its loaded object holds on to, e.g. a shared base
+        self._lock = threading.RLock()
+
+    def register(self, name, loader, warmup=None, parent=None):
+        # `warmup(loaded)` runs one throwaway inference on a freshly loaded model, when warmup is enabled.
+        # A model with a `parent` is evicted along with it, and evicting the parent's last loaded child evicts
+        # the parent too: neither frees memory while the other still references it
+        with self._lock:
+            if self._loaders.get(name) is not loader:
+                self._models.pop(name, None)
+            self._loaders[name] = loader
+            self._warmups[name] = warmup
+            self._parents[name] = parent
+            self._stats.setdefault(name, ModelStats())
+            self._load_locks.setdefault(name, threading.Lock())
+
+    def is_loaded(self, name):
+        with self._lock:
+            return name in self._models
+
+    def peek(self, name):
+        """The loaded object for `name`, or None, without loading it or counting a use."""
+        with self._lock:
+            return self._models.get(name)
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._loaders:
+                raise KeyError(f"No model registered under '{name}'")
+            if name in self._models:
+                return self._hit(name)
+            load_lock = self._load_locks[name]
+
+        # One loader per model at a time; other sessions wait for it instead of loading a second copy
+        with load_lock:
+            with self._lock:
+                if name in self._models:
+                    return self._hit(name)
+                loader = self._loaders[name]
+                warmup = self._warmups[name] if self.warmup else None
+
+            self._make_room(exclude=name)
+            start_time = time.perf_counter()
+            loaded = loader()
+            load_seconds = time.perf_counter() - start_time
+            logging.info(f"Loaded model '{name}' in {load_seconds:.1f}s (RSS {current_rss_mb():.0f} MB)")
+
+            warmup_seconds = 0.0
+            if warmup is not None:
+                start_time = time.perf_counter()
+                try:
+                    warmup(loaded)
+                except Exception:
+                    logging.exception(f"Warmup of model '{name}' failed")
+                warmup_seconds = time.perf_counter() - start_time
+                logging.info(f"Warmed up model '{name}' in {warmup_seconds:.1f}s")
+
+            with self._lock:
+                self._models[name] = loaded
+                stats = self._stats[name]
+                stats.loads += 1
+                stats.last_load_seconds = load_seconds
+                stats.last_warmup_seconds = warmup_seconds
+
+            self._make_room(exclude=name)
+            return loaded
+
+    def evict(self, name):
+        with self._lock:
+            evicted = self._evict_related(name)
+        if not evicted:
+            return False
+        _release_memory()
+        logging.info(f"Evicted model{'s' if len(evicted) > 1 else ''} {', '.join(map(repr, evicted))} "
+                     f"(RSS {current_rss_mb():.0f} MB)")
+        return True
+
+    def _evict_related(self, name):
+        if self._models.pop(name, None) is None:
+            return []
+        self._stats[name].evictions += 1
+        evicted = [name]
+        for child, parent in self._parents.items():
+            if parent == name:
+                evicted += self._evict_related(child)
+        parent = self._parents.get(name)
+        # A child that is loading right now is about to hold on to the parent as well
+        if parent is not None and not any(self._parents.get(other) == parent and
+                                          (other in self._models or self._load_locks[other].locked())
+                                          for other in self._loaders):
+            evicted += self._evict_related(parent)
+        return evicted
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                {
+                    "model": name,
+                    "loaded": name in self._models,
+                    "loads": stats.loads,
+                    "evictions": stats.evictions,
+                    "hits": stats.hits,
+                    "last_load_seconds": stats.last_load_seconds,
+                    "last_warmup_seconds": stats.last_warmup_seconds,
+                }
+                for name, stats in self._stats.items()
+            ]
+
+    def _hit(self, name):
+        self._models.move_to_end(name)
+        self._stats[name].hits += 1
+        return self._models[name]
+
+    def _make_room(self, exclude):
+        if self.memory_budget_mb <= 0:
+            return
+        while current_rss_mb() > self.memory_budget_mb:
+            with self._lock:
+                # Evicting the parent of the model being loaded would evict that model as well
+                candidates = [name for name in self._models if name not in (exclude, self._parents.get(exclude))]
+            if not candidates:
+                if exclude in self._models:
+                    logging.warning(
+                        f"Model '{exclude}' alone exceeds the {self.memory_budget_mb:.0f} MB memory budget"
+                    )
+                return
+            self.evict(candidates[0])
+
+
+registry = ModelRegistry()
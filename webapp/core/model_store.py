@@ -0,0 +1,121 @@
+"""Local model snapshots: every hub model saved once as safetensors, then loaded from disk with no network
+access or hub-cache lookups.
+
+    python -m core.model_store                                  # every model, into ANIMA_MODEL_DIR
+    python -m core.model_store --models mockingmonkey/MedGemma  # selected models
+
+Snapshots live in ANIMA_MODEL_DIR (default models/snapshot), one directory per model. safetensors files are
+memory-mapped on load, so weights are paged in from the page cache rather than unpickled; replicas on one
+host share those pages until a precision change copies them. A model without a snapshot is fetched from the
+hub as before, unless ANIMA_OFFLINE=1, which makes a missing snapshot an error.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+
+SNAPSHOT_DIR = os.environ.get("ANIMA_MODEL_DIR", os.path.join("models", "snapshot"))
+OFFLINE = os.environ.get("ANIMA_OFFLINE", "0") != "0"
+MANIFEST = "snapshot.json"
+
+# Hub id -> (model class, preprocessing class or None), by transformers attribute name
+MODELS = {
+    "mockingmonkey/MedGemma2": ("AutoModelForCausalLM", "AutoTokenizer"),
+    "mockingmonkey/MedGemma": ("AutoModelForCausalLM", "AutoTokenizer"),
+    "mockingmonkey/MedPali": ("PaliGemmaForConditionalGeneration", "AutoProcessor"),
+    "davidle7/segformer": ("SegformerForSemanticSegmentation", None),
+}
+
+# Hub id -> "snapshot" or "hub", for every model loaded by this process
+loaded_from = {}
+
+
+def snapshot_path(model_id, root=SNAPSHOT_DIR):
+    return os.path.join(root, model_id.replace("/", "--"))
+
+
+def read_manifest(model_id, root=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(snapshot_path(model_id, root), MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def from_pretrained(cls, model_id, **kwargs):
+    """`cls.from_pretrained(model_id, **kwargs)`, read from the local snapshot when there is one.
+
+    The result keeps the hub id as its name_or_path and the hub revision as its commit hash, so response
+    cache keys, log records and compiled backend artifacts are the same either way.
+    """
+    if os.path.isdir(model_id):
+        # A local directory, e.g. an extracted adapter's, is never looked up on the hub
+        return cls.from_pretrained(model_id, local_files_only=True, **kwargs)
+    manifest = read_manifest(model_id)
+    if manifest is None:
+        if OFFLINE:
+            raise FileNotFoundError(f"No snapshot of '{model_id}' in {SNAPSHOT_DIR} and ANIMA_OFFLINE is set; "
+                                    f"create one with python -m core.model_store")
+        loaded_from[model_id] = "hub"
+        return cls.from_pretrained(model_id, **kwargs)
+
+    loaded = cls.from_pretrained(snapshot_path(model_id), local_files_only=True, **kwargs)
+    loaded_from[model_id] = "snapshot"
+    if hasattr(loaded, "name_or_path"):
+        loaded.name_or_path = model_id
+    config = getattr(loaded, "config", None)
+    if config is not None:
+        config.name_or_path = model_id
+        config._commit_hash = manifest.get("revision")
+    return loaded
+
+
+def snapshot(model_id, root=SNAPSHOT_DIR):
+    """Saves `model_id` as published, in its own dtype and with its own head; pages apply precision, head
+    resizing and wrappers at load time, exactly as they do for a hub load."""
+    import transformers
+
+    model_class, preprocessor_class = MODELS[model_id]
+    target = snapshot_path(model_id, root)
+    staging = target + ".partial"
+    shutil.rmtree(staging, ignore_errors=True)
+
+    start_time = time.perf_counter()
+    model = getattr(transformers, model_class).from_pretrained(model_id, torch_dtype="auto")
+    model.save_pretrained(staging, safe_serialization=True)
+    if preprocessor_class is not None:
+        getattr(transformers, preprocessor_class).from_pretrained(model_id).save_pretrained(staging)
+    manifest = {
+        "model_id": model_id,
+        "revision": getattr(model.config, "_commit_hash", None),
+        "model_class": model_class,
+        "transformers_version": transformers.__version__,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    with open(os.path.join(staging, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    # The manifest marks a complete snapshot; an interrupted run leaves only the staging directory behind
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(staging, target)
+    size_mb = sum(entry.stat().st_size for entry in os.scandir(target)) / 2**20
+    logging.info(f"Snapshot of '{model_id}' written to {target} ({size_mb:.0f} MB) in "
+                 f"{time.perf_counter() - start_time:.1f}s")
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--models", nargs="*", default=list(MODELS), choices=list(MODELS))
+    parser.add_argument("--output", default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    for model_id in args.models:
+        snapshot(model_id, args.output)
+
+
+if __name__ == "__main__":
+    main()
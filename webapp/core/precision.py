@@ -0,0 +1,27 @@
+import os
+
+import torch
+
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def precision_for(name):
+    """Precision of a registered model: ANIMA_PRECISION_<NAME>, else ANIMA_PRECISION, else fp32."""
+    precision = os.environ.get(f"ANIMA_PRECISION_{name.upper()}", os.environ.get("ANIMA_PRECISION", "fp32")).lower()
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}' for model '{name}', expected one of {PRECISIONS}")
+    return precision
+
+
+def load_kwargs(precision):
+    # bf16 weights are materialized in bf16 directly, never as a full fp32 copy first
+    return {"torch_dtype": torch.bfloat16} if precision == "bf16" else {}
+
+
+def apply_precision(model, precision):
+    if precision == "bf16":
+        return model.to(torch.bfloat16)
+    if precision == "int8":
+        # Weights of every Linear layer stored as int8; activations are quantized on the fly at each call
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
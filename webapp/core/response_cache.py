@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+RESPONSE_CACHE_ENABLED = os.environ.get("ANIMA_RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_PATH = os.environ.get("ANIMA_RESPONSE_CACHE_PATH", os.path.join("databases", "response_cache.db"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get("ANIMA_RESPONSE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_MB = float(os.environ.get("ANIMA_RESPONSE_CACHE_MAX_MB", "64"))
+
+
+def normalize_prompt(prompt):
+    # Whitespace-only differences (trailing spaces, doubled spaces, CRLF) map to the same entry
+    prompt = unicodedata.normalize("NFC", prompt).replace("\r\n", "\n")
+    lines = (re.sub(r"[ \t]+", " ", line).strip() for line in prompt.split("\n"))
+    return "\n".join(lines).strip()
+
+
+def cache_key(model_id, prompt, params):
+    payload = json.dumps([model_id, normalize_prompt(prompt), params], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """On-disk prompt -> response cache for deterministic text generation, with TTL and LRU size eviction."""
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS, max_mb=RESPONSE_CACHE_MAX_MB):
+        self.enabled = RESPONSE_CACHE_ENABLED
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = int(max_mb * 2**20)
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            with self._conn:
+                self._conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model_id TEXT,
+                    response TEXT,
+                    size INTEGER,
+                    created_at REAL,
+                    last_access REAL
+                )''')
+                self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+        return self._conn
+
+    def get(self, model_id, prompt, params):
+        if not self.enabled:
+            return None
+        key = cache_key(model_id, prompt, params)
+        start_time = time.perf_counter()
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            with conn:
+                if row is not None and now - row[1] > self.ttl_seconds:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    row = None
+                elif row is not None:
+                    conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self.lookup_seconds += time.perf_counter() - start_time
+        return None if row is None else row[0]
+
+    def put(self, model_id, prompt, params, response):
+        if not self.enabled:
+            return
+        key = cache_key(model_id, prompt, params)
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, model_id, response, size, now, now))
+                conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+                self._evict(conn)
+
+    def _evict(self, conn):
+        total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            if total_bytes <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total_bytes -= size
+            evicted += 1
+        logging.info(f"Evicted {evicted} cached responses to stay under {self.max_bytes / 2**20:.0f} MB")
+
+    def stats(self):
+        with self._lock:
+            entries, total_bytes = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "mean_lookup_ms": 1000 * self.lookup_seconds / lookups if lookups else 0.0,
+                "entries": entries,
+                "size_mb": total_bytes / 2**20,
+            }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,227 @@
+"""Alternative runtimes for the Segformer forward pass at its fixed input size.
+
+`load_backend` turns an eager Segformer into one of:
+
+    eager        the Hugging Face module as is
+    compile      torch.compile, with Inductor's compiled kernels cached under the artifact directory
+    torchscript  a traced and frozen TorchScript module, saved as <artifact dir>/segformer-<key>.pt
+    onnx         an ONNX export run by ONNX Runtime on CPU, saved as <artifact dir>/segformer-<key>.onnx
+
+Exported artifacts are keyed by model revision, input size, precision and library versions (torch,
+transformers, and for onnx the onnx and ONNX Runtime versions), so they are rebuilt only when one of these
+changes. Each non-eager backend is checked against eager on fixed batches of
+one image and of the series batch size; when the predicted masks disagree beyond a threshold at either,
+eager is used instead.
+
+Export and check a backend ahead of time from the webapp directory:
+
+    python -m core.segformer_backend --backend onnx
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import torch
+import transformers
+from transformers.modeling_outputs import SemanticSegmenterOutput
+
+BACKENDS = ("eager", "compile", "torchscript", "onnx")
+ARTIFACT_DIR = Path(os.environ.get("ANIMA_BACKEND_ARTIFACT_DIR", os.path.join("models", "compiled")))
+# Minimum fraction of mask pixels that must match eager for a backend to be used
+PARITY_THRESHOLD = float(os.environ.get("ANIMA_BACKEND_PARITY_THRESHOLD", "0.999"))
+# Batch sizes the parity check runs at: single uploads, and series batches
+PARITY_BATCH_SIZES = (1, 2)
+
+
+class _LogitsOnly(torch.nn.Module):
+    # Tracing and ONNX export need a module that takes and returns plain tensors
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values, return_dict=False)[0]
+
+
+class SegformerBackend:
+    """Calls a compiled or exported Segformer the way the eager model is called:
+    `backend(pixel_values=batch, return_dict=True).logits`."""
+
+    def __init__(self, name, run, dtype, device):
+        self.name = name
+        self._run = run
+        self.dtype = dtype
+        self.device = device
+
+    def __call__(self, pixel_values, return_dict=True):
+        logits = self._run(pixel_values)
+        return SemanticSegmenterOutput(logits=logits) if return_dict else (logits,)
+
+
+def artifact_key(model, image_size, precision, backend):
+    parts = {
+        "model": model.name_or_path,
+        "revision": getattr(model.config, "_commit_hash", None),
+        "num_labels": model.config.num_labels,
+        "image_size": list(image_size),
+        "precision": precision,
+        "backend": backend,
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _example_input(model, image_size, batch_size=2):
+    generator = torch.Generator().manual_seed(0)
+    pixel_values = torch.randn(batch_size, 3, image_size[1], image_size[0], generator=generator)
+    return pixel_values.to(model.device, dtype=model.dtype)
+
+
+def _build_compile(model, image_size, precision, artifact_dir):
+    # Inductor caches generated kernels on disk, so later processes skip most of the compile work. The first
+    # batch size seen is compiled static; the first different one recompiles once with a dynamic batch
+    # dimension, which then serves every other size, a series' final partial batch included
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(artifact_dir / "inductor"))
+    compiled = torch.compile(_LogitsOnly(model), dynamic=None)
+    return SegformerBackend("compile", compiled, model.dtype, model.device)
+
+
+def _build_torchscript(model, image_size, precision, artifact_dir):
+    path = artifact_dir / f"segformer-{artifact_key(model, image_size, precision, 'torchscript')}.pt"
+    if path.exists():
+        module = torch.jit.load(str(path), map_location=model.device)
+    else:
+        with torch.no_grad():
+            traced = torch.jit.trace(_LogitsOnly(model).eval(), _example_input(model, image_size))
+            module = torch.jit.freeze(traced)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        torch.jit.save(module, str(tmp_path))
+        os.replace(tmp_path, path)
+        logging.info(f"Saved TorchScript Segformer to {path}")
+    return SegformerBackend("torchscript", module, model.dtype, model.device)
+
+
+def _build_onnx(model, image_size, precision, artifact_dir):
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError("The onnx backend needs onnxruntime: pip install onnxruntime") from e
+    if precision != "fp32":
+        raise ValueError(f"The onnx backend runs fp32 only, not {precision}; set ANIMA_PRECISION_SEGMENTATION=fp32")
+
+    try:
+        # The exporter may hand the graph to the onnx package; without it, torch alone writes the file
+        import onnx
+        onnx_version = onnx.__version__
+    except ImportError:
+        onnx_version = "none"
+    key = artifact_key(model, image_size, precision, f"onnx-{onnx_version}-onnxruntime-{onnxruntime.__version__}")
+    path = artifact_dir / f"segformer-{key}.onnx"
+    if not path.exists():
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with torch.no_grad():
+            torch.onnx.export(_LogitsOnly(model).eval().cpu(), _example_input(model, image_size).cpu(), str(tmp_path),
+                              input_names=["pixel_values"], output_names=["logits"], opset_version=17,
+                              dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}})
+        os.replace(tmp_path, path)
+        logging.info(f"Saved ONNX Segformer to {path}")
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = torch.get_num_threads()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = onnxruntime.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+
+    def run(pixel_values):
+        (logits,) = session.run(["logits"], {"pixel_values": pixel_values.detach().cpu().float().numpy()})
+        return torch.from_numpy(logits)
+
+    return SegformerBackend("onnx", run, torch.float32, torch.device("cpu"))
+
+
+_BUILDERS = {"compile": _build_compile, "torchscript": _build_torchscript, "onnx": _build_onnx}
+
+
+def mask_agreement(model, backend, image_size, batch_sizes=PARITY_BATCH_SIZES):
+    """Lowest fraction of pixels where the backend's argmax mask matches eager's, over fixed random batches of
+    each size in `batch_sizes`. A backend that fails to run at one of them agrees on none."""
+    agreements = []
+    for batch_size in batch_sizes:
+        pixel_values = _example_input(model, image_size, batch_size)
+        with torch.inference_mode():
+            expected = model(pixel_values=pixel_values, return_dict=True).logits.argmax(dim=1).cpu()
+            try:
+                actual = backend(pixel_values=pixel_values.to(backend.device, dtype=backend.dtype)).logits
+            except Exception as e:
+                logging.warning(f"Segformer {backend.name} backend failed at batch size {batch_size}: {e}")
+                return 0.0
+        actual = actual.argmax(dim=1).cpu()
+        agreements.append((expected == actual).float().mean().item() if actual.shape == expected.shape else 0.0)
+    return min(agreements)
+
+
+def load_backend(model, backend, image_size, precision="fp32", artifact_dir=ARTIFACT_DIR,
+                 batch_sizes=PARITY_BATCH_SIZES):
+    """Returns `model` run by `backend`, or `model` itself for eager or when the backend fails its parity check
+    at any of `batch_sizes`."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown segmentation backend '{backend}', expected one of {BACKENDS}")
+    if backend == "eager":
+        return model
+
+    artifact_dir = Path(artifact_dir)
+    artifact_dir.mkdir(parents=True, exist_ok=True)
+    start_time = time.perf_counter()
+    runner = _BUILDERS[backend](model, image_size, precision, artifact_dir)
+    agreement = mask_agreement(model, runner, image_size, batch_sizes)
+    if agreement < PARITY_THRESHOLD:
+        logging.warning(f"Segformer {backend} masks match eager on {agreement:.4%} of pixels "
+                        f"(threshold {PARITY_THRESHOLD:.4%}); using eager")
+        return model
+    logging.info(f"Segformer {backend} backend ready in {time.perf_counter() - start_time:.1f}s, "
+                 f"mask agreement {agreement:.4%}")
+    return runner
+
+
+def _latency(run, pixel_values, repeats):
+    with torch.inference_mode():
+        run(pixel_values=pixel_values)
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            run(pixel_values=pixel_values)
+    return (time.perf_counter() - start_time) / repeats
+
+
+def main():
+    from core.precision import precision_for
+    from pages import segmentation
+
+    parser = argparse.ArgumentParser(description="Export a Segformer backend and compare it with eager.")
+    parser.add_argument("--backend", choices=BACKENDS[1:], default="torchscript")
+    parser.add_argument("--batch-size", type=int, default=segmentation.Configs.BATCH_SIZE)
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    precision = precision_for("segmentation")
+    model = segmentation.get_model(segmentation.Configs.MODEL_NAME, segmentation.Configs.NUM_CLASSES, precision)
+    model.to(segmentation.DEVICE).eval()
+    image_size = segmentation.Configs.IMAGE_SIZE
+
+    ARTIFACT_DIR.mkdir(parents=True, exist_ok=True)
+    runner = _BUILDERS[args.backend](model, image_size, precision, ARTIFACT_DIR)
+    agreement = mask_agreement(model, runner, image_size, (1, args.batch_size))
+    pixel_values = _example_input(model, image_size, args.batch_size)
+    eager_seconds = _latency(model, pixel_values, args.repeats)
+    backend_seconds = _latency(runner, pixel_values.to(runner.device, dtype=runner.dtype), args.repeats)
+    print(f"mask agreement with eager: {agreement:.4%} (threshold {PARITY_THRESHOLD:.4%})")
+    print(f"batch of {args.batch_size}: eager {eager_seconds * 1000:.1f} ms, {args.backend} {backend_seconds * 1000:.1f} ms "
+          f"({eager_seconds / backend_seconds:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
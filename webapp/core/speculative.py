@@ -0,0 +1,199 @@
+"""Speculative decoding: a small draft model proposes tokens and the page's model verifies them in one pass.
+
+Under greedy decoding every emitted token is the target model's own argmax, so replies match plain
+`generate()`. Only the number of target forward passes changes: one per accepted run of drafted tokens
+instead of one per token.
+
+Enable it by naming a draft model that shares the target's tokenizer, and turning it on per page:
+
+    ANIMA_DRAFT_MODEL=<hub id or local path>
+    ANIMA_SPECULATIVE=1                 # every text page, or
+    ANIMA_SPECULATIVE_CHATBOT=1         # one page (CHATBOT, MEDRECO)
+    ANIMA_DRAFT_TOKENS=4                # tokens drafted per verification pass
+"""
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass
+
+import torch
+from transformers import AutoModelForCausalLM, DynamicCache
+
+from core.model_registry import registry
+from core.model_store import from_pretrained
+from core.precision import apply_precision, load_kwargs, precision_for
+
+DRAFT_MODEL = os.environ.get("ANIMA_DRAFT_MODEL", "")
+NUM_DRAFT_TOKENS = int(os.environ.get("ANIMA_DRAFT_TOKENS", "4"))
+
+
+def speculative_enabled(name):
+    """Whether page `name` decodes speculatively: ANIMA_SPECULATIVE_<NAME>, else ANIMA_SPECULATIVE."""
+    setting = os.environ.get(f"ANIMA_SPECULATIVE_{name.upper()}", os.environ.get("ANIMA_SPECULATIVE", "0"))
+    return bool(DRAFT_MODEL) and setting != "0"
+
+
+def load_draft_model():
+    precision = precision_for("draft")
+    model = from_pretrained(AutoModelForCausalLM, DRAFT_MODEL, **load_kwargs(precision))
+    return apply_precision(model, precision).eval()
+
+if DRAFT_MODEL:
+    registry.register("draft", load_draft_model)
+
+
+def is_greedy(generation_config):
+    return (not generation_config.do_sample and generation_config.num_beams == 1
+            and generation_config.repetition_penalty in (None, 1.0))
+
+
+@dataclass
+class SpeculativeStats:
+    drafted: int = 0
+    accepted: int = 0
+    target_calls: int = 0
+    new_tokens: int = 0
+    prefill_seconds: float = 0.0  # the first target pass, which also verifies the first drafts
+    draft_seconds: float = 0.0
+    verify_seconds: float = 0.0
+    total_seconds: float = 0.0
+
+    @property
+    def acceptance_rate(self):
+        return self.accepted / self.drafted if self.drafted else 0.0
+
+    @property
+    def estimated_speedup(self):
+        # Plain decoding runs one target step per token after the first; a verification pass stands in for a
+        # step, which slightly overestimates a step's cost and so underestimates the speedup
+        steps = self.target_calls - 1
+        if steps <= 0 or self.total_seconds <= 0:
+            return 1.0
+        plain_seconds = self.prefill_seconds + (self.new_tokens - 1) * self.verify_seconds / steps
+        return plain_seconds / self.total_seconds
+
+    def summary(self):
+        return asdict(self) | {"acceptance_rate": self.acceptance_rate, "estimated_speedup": self.estimated_speedup}
+
+
+class SpeculativeDecoder:
+    """Greedy speculative decoding of one sequence, callable like `model.generate`.
+
+    Both models keep a DynamicCache holding every token of the sequence but the last. Each round the draft
+    proposes up to `num_draft_tokens` tokens, the target scores them all in one pass, the longest prefix
+    matching the target's argmax is kept plus the target's own next token, and both caches are cropped back.
+    """
+
+    def __init__(self, model, draft_model, num_draft_tokens=NUM_DRAFT_TOKENS):
+        if draft_model.config.vocab_size != model.config.vocab_size:
+            raise ValueError(f"Draft model vocabulary ({draft_model.config.vocab_size}) does not match the "
+                             f"target's ({model.config.vocab_size})")
+        self.model = model
+        self.draft_model = draft_model
+        self.num_draft_tokens = num_draft_tokens
+        eos_token_id = model.generation_config.eos_token_id
+        self.eos_token_ids = set(eos_token_id if isinstance(eos_token_id, list) else [eos_token_id]) - {None}
+        self.stats = SpeculativeStats()
+
+    def _forward(self, model, cache, token_ids):
+        input_ids = torch.tensor([token_ids], device=model.device)
+        return model(input_ids=input_ids, past_key_values=cache, use_cache=True).logits[0]
+
+    def _draft(self, tokens, cache, count):
+        drafts = []
+        feed = tokens[cache.get_seq_length():]
+        for _ in range(count):
+            next_token = int(self._forward(self.draft_model, cache, feed)[-1].argmax())
+            drafts.append(next_token)
+            feed = [next_token]
+        return drafts
+
+    def _verify(self, tokens, drafts, cache):
+        # The target's argmax after the last token and after each draft
+        logits = self._forward(self.model, cache, tokens[cache.get_seq_length():] + drafts)
+        return logits[-(len(drafts) + 1):].argmax(dim=-1).tolist()
+
+    def _should_stop(self, stopping_criteria, tokens):
+        if tokens[-1] in self.eos_token_ids:
+            return True
+        return stopping_criteria is not None and bool(stopping_criteria(torch.tensor([tokens]), None)[0])
+
+    def generate(self, input_ids, max_new_tokens, past_key_values=None, streamer=None, stopping_criteria=None,
+                 max_time=None, **generate_kwargs):
+        """Returns prompt and new tokens as a (1, length) tensor. `past_key_values` may hold a prefix of the
+        prompt, as with `generate()`; it is left holding every returned token but the last.
+
+        `stopping_criteria` is checked after every accepted token and `max_time` after every round, as
+        generate() does."""
+        stats = self.stats = SpeculativeStats()
+        start_time = time.perf_counter()
+        # A shared-base adapter counts generate() calls, not the verify passes made here
+        count_request = getattr(self.model, "count_request", None)
+        if count_request is not None:
+            count_request()
+        tokens = input_ids[0].tolist()
+        prompt_length = len(tokens)
+        target_cache = past_key_values if past_key_values is not None else DynamicCache()
+        draft_cache = DynamicCache()
+        if streamer is not None:
+            streamer.put(input_ids.cpu())
+
+        with torch.inference_mode():
+            while len(tokens) - prompt_length < max_new_tokens:
+                remaining = max_new_tokens - (len(tokens) - prompt_length)
+
+                step_start = time.perf_counter()
+                drafts = self._draft(tokens, draft_cache, min(self.num_draft_tokens, remaining - 1))
+                stats.draft_seconds += time.perf_counter() - step_start
+
+                step_start = time.perf_counter()
+                predictions = self._verify(tokens, drafts, target_cache)
+                if stats.target_calls == 0:
+                    stats.prefill_seconds += time.perf_counter() - step_start
+                else:
+                    stats.verify_seconds += time.perf_counter() - step_start
+                stats.target_calls += 1
+
+                accepted = 0
+                while accepted < len(drafts) and drafts[accepted] == predictions[accepted]:
+                    accepted += 1
+                stats.drafted += len(drafts)
+                stats.accepted += accepted
+
+                new_tokens = drafts[:accepted] + [predictions[accepted]]
+                stop = False
+                for i in range(len(new_tokens)):
+                    if self._should_stop(stopping_criteria, tokens + new_tokens[:i + 1]):
+                        new_tokens = new_tokens[:i + 1]
+                        stop = True
+                        break
+                tokens.extend(new_tokens)
+                # Rejected drafts leave stale entries behind; keep exactly the processed prefix
+                target_cache.crop(len(tokens) - 1)
+                draft_cache.crop(len(tokens) - 1)
+                if streamer is not None:
+                    streamer.put(torch.tensor(new_tokens))
+                if stop or (max_time is not None and time.perf_counter() - start_time >= max_time):
+                    break
+
+        if streamer is not None:
+            streamer.end()
+        stats.new_tokens = len(tokens) - prompt_length
+        stats.total_seconds = time.perf_counter() - start_time
+        logging.info(f"Speculative decoding: {stats.new_tokens} tokens in {stats.target_calls} target passes, "
+                     f"acceptance {stats.acceptance_rate:.0%}, estimated speedup {stats.estimated_speedup:.2f}x")
+        return torch.tensor([tokens], device=input_ids.device)
+
+
+def speculative_decoder(name, model):
+    """A SpeculativeDecoder for page `name`'s model, or None when the page decodes plainly."""
+    if not speculative_enabled(name) or not is_greedy(model.generation_config):
+        return None
+    return SpeculativeDecoder(model, registry.get("draft"))
+
+
+def trace_speculative(trace, stats):
+    trace.add("prefill", stats.prefill_seconds)
+    trace.add("draft", stats.draft_seconds)
+    trace.add("verify", stats.verify_seconds)
+    trace.speculative_stats = stats.summary()
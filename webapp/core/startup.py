@@ -0,0 +1,83 @@
+"""Boot-time model preloading and the cold-start report.
+
+    ANIMA_PRELOAD=chatbot,segmentation   # or "all": load these models in the background at startup
+    ANIMA_WARMUP=1                       # run one tiny inference right after each model loads
+
+The report gives the time from process start until the preloaded models were ready, each model's load and
+warmup time and where it was loaded from, and the latency of its first request in this process.
+"""
+import importlib
+import logging
+import os
+import threading
+import time
+
+import psutil
+
+from core import model_store
+from core.model_registry import registry
+
+MODELS = ("chatbot", "medreco", "medpali", "segmentation")
+_preload_setting = os.environ.get("ANIMA_PRELOAD", "")
+PRELOAD = MODELS if _preload_setting == "all" else tuple(name for name in _preload_setting.split(",") if name)
+
+PROCESS_START = psutil.Process().create_time()
+
+_state = {"ready_seconds": None, "preloaded": (), "failed": {}}
+_started = False
+_lock = threading.Lock()
+
+
+def preload(names=PRELOAD):
+    """Loads (and, with ANIMA_WARMUP, warms up) each model in turn; returns seconds since process start.
+
+    A model that fails to load is logged and reported, and the others still load; its page retries on use.
+    """
+    loaded, failed = [], {}
+    for name in names:
+        try:
+            # Each model's page module registers its loader and warmup
+            importlib.import_module(f"pages.{name}")
+            registry.get(name)
+            loaded.append(name)
+        except Exception as e:
+            logging.exception(f"Preloading '{name}' failed")
+            failed[name] = f"{type(e).__name__}: {e}"
+    ready_seconds = time.time() - PROCESS_START
+    _state.update(ready_seconds=ready_seconds, preloaded=tuple(loaded), failed=failed)
+    logging.info(f"Preloaded {', '.join(loaded) or 'no models'} {ready_seconds:.1f}s after process start")
+    return ready_seconds
+
+
+def start_preload(names=PRELOAD):
+    """Runs preload() once per process on a background thread, so the first page renders meanwhile."""
+    global _started
+    with _lock:
+        if _started or not names:
+            return
+        _started = True
+    threading.Thread(target=preload, args=(names,), name="preload", daemon=True).start()
+
+
+def report():
+    # The inference log (numpy, PIL) is only needed here, not to start the app
+    from core.inference_log import inference_logger
+
+    models = []
+    for entry in registry.snapshot():
+        models.append({
+            "model": entry["model"],
+            "loaded": entry["loaded"],
+            "load_seconds": entry["last_load_seconds"],
+            "warmup_seconds": entry["last_warmup_seconds"],
+        })
+    return {
+        "process_seconds": time.time() - PROCESS_START,
+        "ready_seconds": _state["ready_seconds"],
+        "preloaded": list(_state["preloaded"]),
+        "failed": dict(_state["failed"]),
+        "warmup": registry.warmup,
+        "models": models,
+        "loaded_from": dict(model_store.loaded_from),
+        "first_request_seconds": dict(inference_logger.first_inference_time),
+    }
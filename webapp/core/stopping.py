@@ -0,0 +1,124 @@
+"""Generation control: stop a reply at a sentence boundary once it is long enough, instead of generating the
+whole budget and cutting it back to the last period afterwards.
+
+A reply stops at the first token ending a sentence after `min_new_tokens` new tokens, at `max_new_tokens`, at
+end of sequence, or at a wall-clock deadline (generate()'s `max_time`). Each request reports why it stopped,
+how many tokens it saved relative to a fixed budget, and how many generated tokens were still discarded.
+
+    ANIMA_GENERATION_DEADLINE=<seconds>           # wall-clock limit per generate(); 0 for none
+    ANIMA_GENERATION_DEADLINE_CHATBOT=<seconds>   # per-page override (CHATBOT, MEDRECO)
+"""
+import os
+import weakref
+from dataclasses import asdict, dataclass
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+# The same boundary truncate_to_last_sentence cuts at
+SENTENCE_END = "."
+
+_sentence_end_ids = weakref.WeakKeyDictionary()
+
+
+def deadline_for(name, default):
+    return float(os.environ.get(f"ANIMA_GENERATION_DEADLINE_{name.upper()}",
+                                os.environ.get("ANIMA_GENERATION_DEADLINE", default)))
+
+
+def sentence_end_ids(tokenizer):
+    """Ids of every vocabulary token whose text ends a sentence, computed once per tokenizer."""
+    ids = _sentence_end_ids.get(tokenizer)
+    if ids is None:
+        tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+        ids = torch.tensor([i for i, token in enumerate(tokens) if token and token.rstrip().endswith(SENTENCE_END)],
+                           dtype=torch.long)
+        _sentence_end_ids[tokenizer] = ids
+    return ids
+
+
+class SentenceStoppingCriteria(StoppingCriteria):
+    """Finishes each row whose newest token ends a sentence, once it has `min_new_tokens` new tokens."""
+
+    def __init__(self, tokenizer, prompt_length, min_new_tokens):
+        self.end_ids = sentence_end_ids(tokenizer)
+        self.prompt_length = prompt_length
+        self.min_new_tokens = min_new_tokens
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if input_ids.shape[1] - self.prompt_length < self.min_new_tokens:
+            return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        return torch.isin(input_ids[:, -1], self.end_ids.to(input_ids.device))
+
+
+@dataclass
+class Budget:
+    """Token budgets of one page. Prompt and answer budgets are separate, so a long question keeps its answer."""
+    max_prompt_tokens: int
+    max_new_tokens: int
+    min_new_tokens: int
+    deadline_seconds: float = 0.0  # 0 for none
+
+    def fit_prompt(self, ids, bos_token_id=None):
+        # The end of a prompt carries the question or instruction, so an over-long prompt loses its beginning
+        if len(ids) <= self.max_prompt_tokens:
+            return ids
+        if bos_token_id is not None and ids and ids[0] == bos_token_id:
+            return ids[:1] + ids[len(ids) - self.max_prompt_tokens + 1:]
+        return ids[len(ids) - self.max_prompt_tokens:]
+
+    def criteria(self, tokenizer, prompt_length):
+        return StoppingCriteriaList([SentenceStoppingCriteria(tokenizer, prompt_length, self.min_new_tokens)])
+
+    def deadline_kwargs(self):
+        return {"max_time": self.deadline_seconds} if self.deadline_seconds > 0 else {}
+
+    def generate_kwargs(self, tokenizer, prompt_length):
+        """generate() keyword arguments for one sequence whose prompt is `prompt_length` tokens long."""
+        return {"max_new_tokens": self.max_new_tokens, "stopping_criteria": self.criteria(tokenizer, prompt_length),
+                **self.deadline_kwargs()}
+
+    def cache_params(self, precision):
+        # Response cache parameters: replies only match when generated under the same stopping rule and at the
+        # same precision, since fp32, bf16 and int8 weights can produce different greedy replies
+        return {"max_new_tokens": self.max_new_tokens, "min_new_tokens": self.min_new_tokens, "stop": "sentence",
+                "precision": precision}
+
+
+@dataclass
+class StopStats:
+    reason: str  # "sentence", "eos", "length", "cancelled" or "deadline"
+    new_tokens: int
+    saved_tokens: int  # budget left unspent by stopping at a sentence; a fixed budget would have spent it
+    discarded_tokens: int  # generated tokens after the last sentence end, cut from the reply
+
+    def summary(self):
+        return asdict(self)
+
+
+def stop_stats(tokenizer, new_ids, budget, cancelled=False):
+    """Why generation of `new_ids` (a row's new token ids, possibly right-padded) stopped. `cancelled` tells
+    a stream closed by its reader apart from one cut short by the deadline."""
+    new_ids = list(new_ids)
+    pad_token_id = tokenizer.pad_token_id
+    while new_ids and pad_token_id is not None and new_ids[-1] == pad_token_id and pad_token_id != tokenizer.eos_token_id:
+        new_ids.pop()
+    end_ids = set(sentence_end_ids(tokenizer).tolist())
+
+    if len(new_ids) >= budget.max_new_tokens:
+        reason = "length"
+    elif new_ids and new_ids[-1] == tokenizer.eos_token_id:
+        reason = "eos"
+    elif len(new_ids) >= budget.min_new_tokens and new_ids and new_ids[-1] in end_ids:
+        reason = "sentence"
+    elif cancelled:
+        reason = "cancelled"
+    else:
+        reason = "deadline"
+
+    last_end = max((i for i, token in enumerate(new_ids) if token in end_ids), default=None)
+    discarded = 0
+    if last_end is not None:
+        discarded = sum(1 for token in new_ids[last_end + 1:] if token != tokenizer.eos_token_id)
+    saved = budget.max_new_tokens - len(new_ids) if reason == "sentence" else 0
+    return StopStats(reason, len(new_ids), saved, discarded)
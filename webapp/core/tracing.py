@@ -0,0 +1,70 @@
+import time
+from contextlib import contextmanager
+
+import psutil
+
+from core.model_registry import current_rss_mb
+
+# cpu_percent(interval=None) reports utilisation since its previous call, and 0.0 on the very first one
+psutil.cpu_percent(interval=None)
+
+
+def system_load():
+    """Machine-wide CPU utilisation (0-1) since the previous call, without blocking."""
+    return psutil.cpu_percent(interval=None) / 100
+
+
+class Trace:
+    """Stage timings and token counts of one inference, stored with its inference log record.
+
+    Stages are named by the caller, e.g. preprocess, tokenize, prefill, decode, forward, postprocess and
+    render. Timing the same stage again adds to it.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.prompt_tokens = None
+        self.output_tokens = None
+        self.speculative_stats = None
+        self.stop_stats = None
+
+    @contextmanager
+    def stage(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start_time)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_generation(self, start_time, first_token_time, end_time):
+        # Prefill ends when the first new token is out; without that timestamp the call is one stage
+        if first_token_time is None:
+            self.add("generate", end_time - start_time)
+        else:
+            self.add("prefill", first_token_time - start_time)
+            self.add("decode", end_time - first_token_time)
+
+    def scaled(self, factor):
+        """A copy with every stage multiplied by `factor`, e.g. one row's share of a batch."""
+        trace = Trace()
+        trace.stages = {name: seconds * factor for name, seconds in self.stages.items()}
+        trace.prompt_tokens = self.prompt_tokens
+        trace.output_tokens = self.output_tokens
+        trace.speculative_stats = self.speculative_stats
+        trace.stop_stats = self.stop_stats
+        return trace
+
+    def record_fields(self):
+        """InferenceRecord fields: the stages and tokens, plus CPU load and process RSS at logging time."""
+        return {
+            "stage_timings": dict(self.stages) or None,
+            "prompt_tokens": self.prompt_tokens,
+            "output_tokens": self.output_tokens,
+            "speculative_stats": self.speculative_stats,
+            "stop_stats": self.stop_stats,
+            "system_load": system_load(),
+            "rss_mb": current_rss_mb(),
+        }
@@ -0,0 +1,59 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import torch
+from transformers.modeling_outputs import BaseModelOutputWithPooling
+
+
+def tensor_digest(tensor):
+    data = tensor.detach().cpu().contiguous().view(torch.uint8).numpy()
+    return hashlib.blake2b(data.tobytes(), digest_size=16).hexdigest()
+
+
+class CachedVisionTower(torch.nn.Module):
+    """Wraps a vision encoder and memoizes its last hidden state per input image.
+
+    Images are identified by a digest of their preprocessed pixels, so a follow-up question about the same
+    image, or several questions batched together, only encode it once. Entries are shared by all sessions
+    and evicted least-recently-used beyond `max_entries`.
+    """
+
+    def __init__(self, vision_tower, max_entries):
+        super().__init__()
+        self.vision_tower = vision_tower
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._features = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def dtype(self):
+        return self.vision_tower.dtype
+
+    @property
+    def device(self):
+        return self.vision_tower.device
+
+    def forward(self, pixel_values, **kwargs):
+        digests = [tensor_digest(image) for image in pixel_values]
+        with self._lock:
+            features = {digest: self._features[digest] for digest in digests if digest in self._features}
+            for digest in features:
+                self._features.move_to_end(digest)
+            self.hits += sum(digest in features for digest in digests)
+
+        missing = list(dict.fromkeys(digest for digest in digests if digest not in features))
+        if missing:
+            rows = [digests.index(digest) for digest in missing]
+            outputs = self.vision_tower(pixel_values[rows], **kwargs)
+            with self._lock:
+                self.misses += len(missing)
+                for digest, hidden_state in zip(missing, outputs.last_hidden_state):
+                    features[digest] = hidden_state
+                    self._features[digest] = hidden_state
+                while len(self._features) > self.max_entries:
+                    self._features.popitem(last=False)
+
+        return BaseModelOutputWithPooling(last_hidden_state=torch.stack([features[digest] for digest in digests]))
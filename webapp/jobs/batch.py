@@ -0,0 +1,393 @@
+"""Offline batch runner for patient CSVs (recommendations) and image folders (segmentation masks).
+
+Input is streamed in chunks and fanned out to a pool of worker processes, each holding one copy of the
+model. Results are written as they arrive, and every write is recorded in a checkpoint journal next to
+the output. Rerunning the same command after an interruption resumes where the previous run stopped.
+Run from the webapp directory:
+
+    python -m jobs.batch medreco patients.csv recommendations.csv --workers 4
+    python -m jobs.batch medreco patients.csv recommendations.parquet
+    python -m jobs.batch segmentation slices/ segmented/ --workers 2
+
+A `.parquet` output is a directory of part files, readable with `pandas.read_parquet`; it needs pyarrow.
+Segmentation writes one PNG class mask per slice to `<output>/masks/`, named after the slice's file name with
+its extension (`1.png` -> `1.png.mask.png`), plus `<output>/summary.csv` (or `--summary`).
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import pandas as pd
+
+
+class Checkpoint:
+    """Append-only journal of completed work: which items are done, and how far the output is valid."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def exists(self):
+        return self.path.exists()
+
+    def load(self):
+        # A line torn by a crash is cut off, so the next record starts on a clean line
+        entries, valid_bytes = [], 0
+        if not self.path.exists():
+            return entries
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+                valid_bytes += len(line)
+        with open(self.path, "r+b") as f:
+            f.truncate(valid_bytes)
+        return entries
+
+    def record(self, done, **state):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"done": done, **state}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class CsvOutput:
+    """Rows appended to one CSV file; a resumed run first cuts the file back to the last checkpoint."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def exists(self):
+        return self.path.exists()
+
+    def remove(self):
+        self.path.unlink(missing_ok=True)
+
+    def restore(self, entries):
+        offset = entries[-1]["offset"] if entries else 0
+        if self.path.exists():
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+
+    def write(self, frame):
+        header = not self.path.exists() or self.path.stat().st_size == 0
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            frame.to_csv(f, header=header, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+            return {"offset": f.tell()}
+
+
+class ParquetOutput:
+    """One Parquet part file per write in a dataset directory; parts not in the checkpoint are discarded."""
+
+    def __init__(self, path):
+        try:
+            import pyarrow  # noqa: F401 - pandas' Parquet engine
+        except ImportError as e:
+            raise SystemExit(f"Writing {path} needs pyarrow: pip install pyarrow, or write a .csv file") from e
+        self.path = Path(path)
+        self._next_part = 0
+
+    def exists(self):
+        return self.path.exists()
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def restore(self, entries):
+        committed = {entry["part"] for entry in entries}
+        self.path.mkdir(parents=True, exist_ok=True)
+        for part in self.path.glob("part-*.parquet"):
+            if part.name not in committed:
+                part.unlink()
+        self._next_part = len(committed)
+
+    def write(self, frame):
+        name = f"part-{self._next_part:06d}.parquet"
+        tmp_path = self.path / f".{name}.tmp"
+        frame.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.path / name)
+        self._next_part += 1
+        return {"part": name}
+
+
+def open_output(path):
+    return ParquetOutput(path) if Path(path).suffix.lower() == ".parquet" else CsvOutput(path)
+
+
+class Progress:
+    def __init__(self, unit, interval=10.0):
+        self.unit = unit
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.start_time = time.perf_counter()
+        self._last_report = self.start_time
+
+    def update(self, done, failed=0):
+        self.done += done
+        self.failed += failed
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start_time
+        rate = self.done / elapsed if elapsed else 0.0
+        logging.info(f"{self.done} {self.unit} done ({rate:.2f}/s), {self.failed} failed")
+
+
+# Worker side: one model copy per process, loaded by the pool initializer
+
+def _init_worker(job, threads, log_inferences):
+    from core.executor import executor
+    from core.inference_log import inference_logger
+    from core.model_registry import registry
+
+    executor.configure(threads)
+    # Before the model loads, so that loading does not use every core in every worker either
+    executor.apply_threads()
+    if not log_inferences:
+        inference_logger.enabled = False
+    if job == "medreco":
+        from pages import medreco  # noqa: F401 - registers the loader
+    else:
+        from pages import segmentation  # noqa: F401
+    registry.get(job)
+
+
+def recommend_task(row_ids, prompts):
+    from core.inference_log import inference_logger
+    from core.model_registry import registry
+    from pages import medreco
+
+    model, tokenizer = registry.get("medreco")
+    responses = [None] * len(prompts)
+    # No interactive user is waiting, so rows are not cut short by the page's deadline
+    for index, response in medreco.model_predict_batch(model, tokenizer, prompts, deadline=False):
+        responses[index] = response
+    # Pool workers exit without running atexit hooks, so queued log records are written here
+    inference_logger.flush()
+    return row_ids, responses
+
+
+def segment_task(names, paths):
+    from core.ingest import ImageRejected
+    from core.inference_log import inference_logger
+    from core.tracing import Trace
+    from pages import segmentation
+
+    trace = Trace()
+    slices, failed = [], {}
+    for name, path in zip(names, paths):
+        try:
+            with trace.stage("decode"):
+                slices.append(segmentation.load_slice(name, path))
+        except (OSError, ImageRejected) as e:
+            failed[name] = str(e)
+    results = []
+    if slices:
+        names, shapes_H_W, input_tensors = zip(*slices)
+        masks, inference_time = segmentation.predict_batch(input_tensors, shapes_H_W, trace)
+        trace = trace.scaled(1 / len(names))
+        for name, shape_H_W, mask in zip(names, shapes_H_W, masks):
+            segmentation.save_inference_details(segmentation.Configs.MODEL_NAME, None, mask, inference_time / len(names),
+                                                trace=trace)
+            results.append((name, shape_H_W, segmentation.encode_mask_png(mask), segmentation.class_fractions(mask),
+                            inference_time / len(names)))
+    inference_logger.flush()
+    return results, failed
+
+
+# Driver side
+
+def run_pool(tasks, submit, on_result, job, workers, threads, log_inferences):
+    """Runs `submit(pool, task)` for each task with at most 2 tasks in flight per worker, calling
+    `on_result(task, future)` as each one finishes. workers=0 runs everything in this process."""
+    initargs = (job, threads, log_inferences)
+    if workers == 0:
+        pool = ThreadPoolExecutor(max_workers=1, initializer=_init_worker, initargs=initargs)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=initargs)
+    max_in_flight = 2 * max(workers, 1)
+    in_flight = {}
+
+    def drain(return_when):
+        done, _ = wait(in_flight, return_when=return_when)
+        for future in done:
+            on_result(in_flight.pop(future), future)
+
+    try:
+        for task in tasks:
+            in_flight[submit(pool, task)] = task
+            if len(in_flight) >= max_in_flight:
+                drain(FIRST_COMPLETED)
+        while in_flight:
+            drain(FIRST_COMPLETED)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def prepare_output(output, checkpoint, restart):
+    if restart:
+        output.remove()
+        checkpoint.path.unlink(missing_ok=True)
+    elif output.exists() and not checkpoint.exists():
+        raise SystemExit(f"{output.path} exists and has no checkpoint; pass --restart to overwrite it")
+    entries = checkpoint.load()
+    output.restore(entries)
+    done = {item for entry in entries for item in entry["done"]}
+    if done:
+        logging.info(f"Resuming: {len(done)} items already done")
+    return done
+
+
+def run_medreco(args):
+    from pages.medreco import MAX_BATCH_SIZE, format_prompt_from_csv
+
+    output = open_output(args.output)
+    checkpoint = Checkpoint(f"{args.output}.checkpoint")
+    done = prepare_output(output, checkpoint, args.restart)
+    task_rows = args.task_rows or 2 * MAX_BATCH_SIZE
+    progress = Progress("patients")
+
+    def tasks():
+        # pandas numbers chunked rows continuously, so the index is the row's position in the CSV
+        for chunk in pd.read_csv(args.input, chunksize=args.chunk_rows):
+            chunk = chunk[~chunk.index.isin(done)]
+            for start in range(0, len(chunk), task_rows):
+                rows = chunk.iloc[start:start + task_rows]
+                yield rows, format_prompt_from_csv(rows)
+
+    def submit(pool, task):
+        rows, prompts = task
+        return pool.submit(recommend_task, rows.index.tolist(), prompts)
+
+    def on_result(task, future):
+        rows, _ = task
+        try:
+            row_ids, responses = future.result()
+        except Exception as e:
+            # Not checkpointed, so the next run retries these rows
+            logging.error(f"Rows {rows.index[0]}-{rows.index[-1]} failed: {e}")
+            progress.update(0, failed=len(rows))
+            return
+        frame = rows.copy()
+        frame.insert(0, "row", row_ids)
+        frame["recommendation"] = responses
+        checkpoint.record(row_ids, **output.write(frame))
+        progress.update(len(row_ids))
+
+    run_pool(tasks(), submit, on_result, "medreco", args.workers, args.threads, not args.no_log)
+    progress.report()
+
+
+def run_segmentation(args):
+    from pages.segmentation import Configs, iter_folder_slices
+
+    output_dir = Path(args.output)
+    mask_dir = output_dir / "masks"
+    if args.restart:
+        # Masks of the previous run would otherwise outlive its summary and checkpoint
+        shutil.rmtree(mask_dir, ignore_errors=True)
+    mask_dir.mkdir(parents=True, exist_ok=True)
+    summary = open_output(args.summary or output_dir / "summary.csv")
+    checkpoint = Checkpoint(output_dir / "checkpoint")
+    done = prepare_output(summary, checkpoint, args.restart)
+    task_slices = args.task_slices or Configs.BATCH_SIZE
+    progress = Progress("slices")
+
+    def tasks():
+        batch = []
+        for name, path in iter_folder_slices(args.input):
+            if name in done:
+                continue
+            batch.append((name, str(path)))
+            if len(batch) == task_slices:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def submit(pool, task):
+        names, paths = zip(*task)
+        return pool.submit(segment_task, list(names), list(paths))
+
+    def on_result(task, future):
+        try:
+            results, failed = future.result()
+        except Exception as e:
+            logging.error(f"Slices {task[0][0]}..{task[-1][0]} failed: {e}")
+            progress.update(0, failed=len(task))
+            return
+        for name, error in failed.items():
+            logging.error(f"Slice {name} failed: {error}")
+        if not results:
+            progress.update(0, failed=len(failed))
+            return
+
+        rows = []
+        for name, (height, width), mask_png, fractions, inference_time in results:
+            # The full name, extension included: 1.png and 1.jpg are different slices
+            mask_path = mask_dir / f"{name}.mask.png"
+            tmp_path = mask_path.with_name(f".{mask_path.name}.tmp")
+            tmp_path.write_bytes(mask_png)
+            os.replace(tmp_path, mask_path)
+            rows.append({"slice": name, "height": height, "width": width, "inference_time": inference_time,
+                         **fractions, "mask": str(mask_path.relative_to(output_dir))})
+        names = [row["slice"] for row in rows]
+        checkpoint.record(names, **summary.write(pd.DataFrame(rows)))
+        progress.update(len(names), failed=len(failed))
+
+    run_pool(tasks(), submit, on_result, "segmentation", args.workers, args.threads, not args.no_log)
+    progress.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--workers", type=int, default=2,
+                        help="worker processes, each with its own model copy (0 runs in this process)")
+    common.add_argument("--threads", type=int, default=None, help="torch threads per worker (default: cores / workers)")
+    common.add_argument("--restart", action="store_true", help="discard existing output and checkpoint")
+    common.add_argument("--no-log", action="store_true", help="do not record inferences in the inference log")
+    subparsers = parser.add_subparsers(dest="job", required=True)
+
+    medreco = subparsers.add_parser("medreco", parents=[common], help="recommendations for every row of a patient CSV")
+    medreco.add_argument("input", help="CSV with the columns of the Recommendation page template")
+    medreco.add_argument("output", help=".csv file or .parquet directory")
+    medreco.add_argument("--chunk-rows", type=int, default=1000, help="CSV rows read at a time")
+    medreco.add_argument("--task-rows", type=int, default=None, help="rows per worker task (default: 2 batches)")
+
+    segmentation = subparsers.add_parser("segmentation", parents=[common], help="class masks for a folder of slices")
+    segmentation.add_argument("input", help="folder of .jpg/.png slices")
+    segmentation.add_argument("output", help="directory for masks/, the summary and the checkpoint")
+    segmentation.add_argument("--summary", default=None, help=".csv file or .parquet directory (default: <output>/summary.csv)")
+    segmentation.add_argument("--task-slices", type=int, default=None, help="slices per worker task (default: one batch)")
+
+    args = parser.parse_args()
+    args.threads = args.threads or max(1, (os.cpu_count() or 1) // max(args.workers, 1))
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    try:
+        if args.job == "medreco":
+            run_medreco(args)
+        else:
+            run_segmentation(args)
+    except KeyboardInterrupt:
+        logging.warning("Interrupted; rerun the same command to resume")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,52 @@
 import streamlit as st
+import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM
+from core.model_registry import registry
+from core.model_store import from_pretrained
+from core.precision import apply_precision, load_kwargs, precision_for
+from core.generation import GenerationStats, PrefillTimer, batched_generate, stream_generate, truncate_to_last_sentence
+from core.conversation_cache import conversation_caches, supports_prefix_cache
+from core.response_cache import response_cache
+from core.inference_log import InferenceRecord, inference_logger
+from core.tracing import Trace
+from core.speculative import speculative_decoder, trace_speculative
+from core.executor import executor, queue_notices
+from core.stopping import Budget, deadline_for, stop_stats
+from core import adapters, inference_client
+import logging
+import time
+import uuid
+from contextlib import closing
+
+# The question and the answer have separate budgets, so a long question no longer shortens its answer. A reply
+# stops at the first sentence end after 40 new tokens, at the latest after 100 tokens or the deadline
+BUDGET = Budget(max_prompt_tokens=256, max_new_tokens=100, min_new_tokens=40,
+                deadline_seconds=deadline_for("chatbot", 30))
+# Oldest turns are dropped from the context beyond this many tokens
+MAX_CONTEXT_TOKENS = 1024
+# Padded tokens per batched generate() when replies for several conversations are generated together
+BATCH_TOKEN_BUDGET = 8192
 
-@st.cache_resource
 def load_model():
-    tokenizer = AutoTokenizer.from_pretrained("mockingmonkey/MedGemma2")
-    model = AutoModelForCausalLM.from_pretrained("mockingmonkey/MedGemma2")
+    if adapters.SHARED_BASE:
+        return adapters.load("chatbot")
+    tokenizer = from_pretrained(AutoTokenizer, "mockingmonkey/MedGemma2")
+    precision = precision_for("chatbot")
+    model = from_pretrained(AutoModelForCausalLM, "mockingmonkey/MedGemma2", **load_kwargs(precision))
+    model = apply_precision(model, precision)
     return tokenizer, model
 
-tokenizer, model = load_model()
+def warmup(loaded):
+    tokenizer, model = loaded
+    with torch.inference_mode():
+        model.generate(tokenizer.encode("Hello", return_tensors="pt"), max_new_tokens=2)
+
+registry.register("chatbot", load_model, warmup=warmup, parent=adapters.PARENT)
 
 def initialize_session_state():
+    if "conversation_id" not in st.session_state:
+        st.session_state["conversation_id"] = uuid.uuid4().hex
+
     if "history" not in st.session_state:
         st.session_state["history"] = []
 
@@ -19,22 +56,212 @@ def initialize_session_state():
     if "past" not in st.session_state:
         st.session_state["past"] = ["Hey! 👋"]
 
+    if "reply_stats" not in st.session_state:
+        st.session_state["reply_stats"] = [None] * len(st.session_state["generated"])
+
     if "initial_query" not in st.session_state:
         st.session_state["initial_query"] = ""
 
-def conversation_chat(query):
-    input_ids = tokenizer.encode(query, return_tensors="pt")
-    outputs = model.generate(input_ids, max_length=100)
-    response = tokenizer.decode(outputs[0], skip_special_tokens=True)
+def build_conversation_ids(tokenizer, history, query):
+    query_ids = BUDGET.fit_prompt(tokenizer.encode(query, add_special_tokens=False))
+    turns = [f"{past_query}{past_response}\n\n" for past_query, past_response in history]
+    input_ids = tokenizer.encode("".join(turns)) + query_ids
+    while turns and len(input_ids) > MAX_CONTEXT_TOKENS:
+        turns.pop(0)
+        input_ids = tokenizer.encode("".join(turns)) + query_ids
+    return input_ids, "".join(turns) + query
+
+def cache_params():
+    # In shared-base mode the adapters run at the base's precision
+    return BUDGET.cache_params(precision_for(adapters.PARENT or "chatbot"))
+
+def cached_response(model, prompt):
+    # Sampled replies are not reproducible, so only greedy generation goes through the cache
+    if model.generation_config.do_sample:
+        return None
+    return response_cache.get(model.name_or_path, prompt, cache_params())
+
+def log_inference(model, inference_time, trace):
+    inference_logger.log(InferenceRecord(model_name=model.name_or_path, model_type="CausalLM",
+                                         inference_time=inference_time, device=model.device.type,
+                                         **trace.record_fields()))
+
+def cache_response(model, prompt, response, stats):
+    # A reply cut short by the deadline depends on the load at the time, and a cancelled one is partial, so
+    # neither is reused
+    if not model.generation_config.do_sample and stats.reason not in ("deadline", "cancelled"):
+        response_cache.put(model.name_or_path, prompt, cache_params(), response)
+
+def checkout_cache(model, session_id, input_ids):
+    # Only the new turn is prefilled; the conversation prefix comes from this session's cache
+    if not supports_prefix_cache(model):
+        return None
+    cache, _ = conversation_caches.checkout(session_id, input_ids)
+    return cache
+
+def checkin_cache(cache, session_id, token_ids):
+    if cache is not None:
+        conversation_caches.checkin(session_id, cache, token_ids)
+
+def generate_reply(query, history, session_id):
+    # history is a list of (query, response) turns; it is read, never modified
+    tokenizer, model = registry.get("chatbot")
+    trace = Trace()
+    with trace.stage("tokenize"):
+        input_ids, prompt = build_conversation_ids(tokenizer, history, query)
+    response = cached_response(model, prompt)
+    if response is not None:
+        return response
+
+    with executor.slot("chatbot") as waited:
+        trace.add("queue", waited)
+        start_time = time.perf_counter()
+        with trace.stage("cache_checkout"):
+            cache = checkout_cache(model, session_id, input_ids)
+        decoder = speculative_decoder("chatbot", model)
+        generate_kwargs = BUDGET.generate_kwargs(tokenizer, len(input_ids))
+        if decoder is not None:
+            outputs = decoder.generate(torch.tensor([input_ids]), past_key_values=cache, **generate_kwargs)
+            trace_speculative(trace, decoder.stats)
+        else:
+            timer = PrefillTimer()
+            outputs = model.generate(torch.tensor([input_ids]), past_key_values=cache, streamer=timer,
+                                     **generate_kwargs)
+            trace.add_generation(timer.start_time, timer.first_token_time, time.perf_counter())
+        output_ids = outputs[0][len(input_ids):].tolist()
+        checkin_cache(cache, session_id, input_ids + output_ids)
+        inference_time = time.perf_counter() - start_time
+
+    with trace.stage("postprocess"):
+        response = tokenizer.decode(output_ids, skip_special_tokens=True)
+        response = truncate_to_last_sentence(response)
+        stats = stop_stats(tokenizer, output_ids, BUDGET)
+    trace.prompt_tokens, trace.output_tokens = len(input_ids), len(output_ids)
+    trace.stop_stats = stats.summary()
+    log_inference(model, inference_time, trace)
+    cache_response(model, prompt, response, stats)
+    return response
+
+def generate_replies(requests):
+    """Batched generate_reply for (query, history) pairs from independent conversations.
+
+    Conversations are batched together, so no per-session KV cache is reused.
+    """
+    tokenizer, model = registry.get("chatbot")
+    batch_trace = Trace()
+    with batch_trace.stage("tokenize"):
+        built = [build_conversation_ids(tokenizer, history, query) for query, history in requests]
+    batch_trace = batch_trace.scaled(1 / len(requests))
+    responses = [cached_response(model, prompt) for _, prompt in built]
+    misses = [i for i, response in enumerate(responses) if response is None]
+    if not misses:
+        return responses
+
+    # Greedy rows are independent and each stops at its own sentence end, as it would generated alone
+    for miss, output_ids, seconds in batched_generate(model, tokenizer, [built[i][0] for i in misses],
+                                                      max_new_tokens=BUDGET.max_new_tokens,
+                                                      token_budget=BATCH_TOKEN_BUDGET, max_batch_size=len(misses),
+                                                      slot=lambda: executor.slot("chatbot"),
+                                                      stopping=lambda width: BUDGET.criteria(tokenizer, width),
+                                                      deadline=BUDGET.deadline_seconds):
+        i = misses[miss]
+        input_ids, prompt = built[i]
+        trace = batch_trace.scaled(1)
+        trace.add("generate", seconds)
+        with trace.stage("postprocess"):
+            new_ids = output_ids[len(input_ids):]
+            response = tokenizer.decode(new_ids, skip_special_tokens=True)
+            response = truncate_to_last_sentence(response)
+            stats = stop_stats(tokenizer, new_ids.tolist(), BUDGET)
+        trace.prompt_tokens, trace.output_tokens = len(input_ids), stats.new_tokens
+        trace.stop_stats = stats.summary()
+        log_inference(model, seconds, trace)
+        cache_response(model, prompt, response, stats)
+        responses[i] = response
+    return responses
+
+def stream_reply(query, history, session_id, stats):
+    """Yields the reply as it grows; the last value yielded is the final, truncated reply."""
+    tokenizer, model = registry.get("chatbot")
+    trace = Trace()
+    with trace.stage("tokenize"):
+        input_ids, prompt = build_conversation_ids(tokenizer, history, query)
 
-    if '.' in response:
-        last_period_index = response.rfind('.')
-        response = response[:last_period_index + 1]
+    response = cached_response(model, prompt)
+    if response is not None:
+        stats.cached = True
+        yield response
+        return
 
+    # The slot is held while the reply streams
+    with executor.slot("chatbot") as waited:
+        trace.add("queue", waited)
+        with trace.stage("cache_checkout"):
+            cache = checkout_cache(model, session_id, input_ids)
+        decoder = speculative_decoder("chatbot", model)
+        output_ids = []
+        response = ""
+        # Closed explicitly when this generator is, so generation has stopped before the slot is released
+        with closing(stream_generate(model, tokenizer, torch.tensor([input_ids]), stats, output_ids=output_ids,
+                                     generate=decoder.generate if decoder is not None else None,
+                                     past_key_values=cache,
+                                     **BUDGET.generate_kwargs(tokenizer, len(input_ids)))) as chunks:
+            for text in chunks:
+                response += text
+                yield response
+        checkin_cache(cache, session_id, input_ids + output_ids)
+    if decoder is not None:
+        trace_speculative(trace, decoder.stats)
+        stats.acceptance_rate = decoder.stats.acceptance_rate
+    else:
+        trace.add_generation(0.0, stats.time_to_first_token, stats.total_time)
+    trace.prompt_tokens, trace.output_tokens = stats.prompt_tokens, stats.new_tokens
+
+    with trace.stage("postprocess"):
+        response = truncate_to_last_sentence(response)
+        stopped = stop_stats(tokenizer, output_ids, BUDGET, cancelled=stats.cancelled)
+    trace.stop_stats = stopped.summary()
+    log_inference(model, stats.total_time, trace)
+    cache_response(model, prompt, response, stopped)
+    logging.info(
+        f"Chat reply: {stats.new_tokens} tokens, first token after {stats.time_to_first_token or 0:.2f}s, "
+        f"{stats.tokens_per_second:.1f} tokens/s, stopped at {stopped.reason}"
+    )
+    yield response
+
+def conversation_chat(query):
+    if inference_client.enabled():
+        response = inference_client.chat(query, st.session_state["history"])
+    else:
+        response = generate_reply(query, st.session_state["history"], st.session_state["conversation_id"])
     st.session_state["history"].append((query, response))
     return response
 
-def display_chat_history():
+def stream_conversation_chat(query, placeholder):
+    stats = GenerationStats()
+    response = ""
+    # A rerun interrupts placeholder.write(); closing the stream then stops the generation
+    with closing(stream_reply(query, st.session_state["history"], st.session_state["conversation_id"], stats)) as replies:
+        for response in replies:
+            placeholder.write(f"**Assistant:** {response}▌")
+    placeholder.write(f"**Assistant:** {response}")
+
+    st.session_state["history"].append((query, response))
+    return response, None if stats.cached else stats
+
+def clear_conversation():
+    conversation_caches.drop(st.session_state["conversation_id"])
+    for key in ["conversation_id", "history", "generated", "past", "reply_stats"]:
+        del st.session_state[key]
+    initialize_session_state()
+
+def format_reply_stats(stats):
+    text = f"First token after {stats.time_to_first_token or 0:.2f}s · {stats.tokens_per_second:.1f} tokens/s · {stats.new_tokens} tokens"
+    if stats.acceptance_rate is not None:
+        text += f" · {stats.acceptance_rate:.0%} of drafted tokens accepted"
+    return text
+
+def display_chat_history(stream):
     reply_container = st.container()
     container = st.container()
 
@@ -43,29 +270,52 @@ def display_chat_history():
             user_input = st.text_input("Ask the Medical Assistant:", placeholder="Ask your medical question here", key="input")
             submit_button = st.form_submit_button(label="Send")
 
-            if submit_button and user_input:
-                with st.spinner("Generating response..."):
-                    output = conversation_chat(query=user_input)
-
-                    if st.session_state["initial_query"] == "":
-                        st.session_state["initial_query"] = user_input
-
-                st.session_state["past"].append(user_input)
-                st.session_state["generated"].append(output)
-
     if st.session_state["generated"]:
         with reply_container:
             for i in range(len(st.session_state["generated"])):
                 st.write(f"**You:** {st.session_state['past'][i]}")
                 st.write(f"**Assistant:** {st.session_state['generated'][i]}")
+                if st.session_state["reply_stats"][i] is not None:
+                    st.caption(format_reply_stats(st.session_state["reply_stats"][i]))
+
+    if submit_button and user_input:
+        if not inference_client.enabled() and not registry.is_loaded("chatbot"):
+            with container:
+                with st.spinner("Loading the medical assistant model..."):
+                    registry.get("chatbot")
+
+        with reply_container:
+            st.write(f"**You:** {user_input}")
+            if stream:
+                with queue_notices(st.empty()):
+                    output, stats = stream_conversation_chat(query=user_input, placeholder=st.empty())
+                if stats is not None:
+                    st.caption(format_reply_stats(stats))
+            else:
+                with st.spinner("Generating response..."), queue_notices(st.empty()):
+                    output = conversation_chat(query=user_input)
+                stats = None
+                st.write(f"**Assistant:** {output}")
+
+        if st.session_state["initial_query"] == "":
+            st.session_state["initial_query"] = user_input
+
+        st.session_state["past"].append(user_input)
+        st.session_state["generated"].append(output)
+        st.session_state["reply_stats"].append(stats)
 
 def show():
     initialize_session_state()
     st.title("👩‍⚕️ Medical ChatBot")
     st.sidebar.title("📂 Information")
     st.sidebar.info("This chatbot provides medical advice for simple queries. Please consult a professional for serious conditions.")
+    # The inference service answers whole replies only
+    stream = st.sidebar.checkbox("Stream responses", value=not inference_client.enabled(),
+                                 disabled=inference_client.enabled())
+    if st.sidebar.button("Start a new conversation"):
+        clear_conversation()
 
-    display_chat_history()
+    display_chat_history(stream)
 
     st.header("🔍 Compare with Google Search")
     google_query = st.text_input("Enter your query:", placeholder="Enter a query to search on Google", value=st.session_state["initial_query"])
@@ -1,12 +1,19 @@
-import sqlite3
 import streamlit as st
 import psutil
 import time
+import json
 
 from streamlit_autorefresh import st_autorefresh
 import pandas as pd
 import plotly.express as px
 
+from core.model_registry import registry, current_rss_mb
+from core.response_cache import response_cache
+from core.mask_cache import mask_cache
+from core.inference_log import connect, inference_logger
+from core.executor import executor
+from core import startup
+
 
 # Helper function
 def get_system_health():
@@ -16,33 +23,151 @@ def get_system_health():
     return cpu_usage, memory_usage, uptime
 
 
-# Function to get data from the database
-@st.cache_data(ttl=60)  # Cache the data for 60 seconds
-def refresh_data():
-    conn = sqlite3.connect('databases/inference_data.db')
-    
-    query = "SELECT * FROM model_inference"
-    data = pd.read_sql_query(query, conn)
-    
-    conn.close()
-    return data
+# Recent rows are kept per session and only rows newer than the last seen id are fetched on refresh
+WINDOW_HOURS = 24
+MAX_WINDOW_ROWS = 20000
+MAX_PLOT_POINTS = 500
+RECENT_COLUMNS = ("id, timestamp, model_name, inference_time, device, system_load, rss_mb, prompt_tokens, output_tokens, "
+                  "stage_timings, speculative_stats, stop_stats")
+
+
+def refresh_window():
+    window = st.session_state.get("dashboard_window")
+    conn = connect()
+    try:
+        if window is None or window.empty:
+            query = f"SELECT {RECENT_COLUMNS} FROM model_inference WHERE timestamp >= datetime('now', ?) ORDER BY id"
+            new_rows = pd.read_sql_query(query, conn, params=(f"-{WINDOW_HOURS} hours",))
+        else:
+            query = f"SELECT {RECENT_COLUMNS} FROM model_inference WHERE id > ? ORDER BY id"
+            new_rows = pd.read_sql_query(query, conn, params=(int(window['id'].iloc[-1]),))
+    finally:
+        conn.close()
+
+    new_rows['timestamp'] = pd.to_datetime(new_rows['timestamp'])
+    window = new_rows if window is None or window.empty else pd.concat([window, new_rows], ignore_index=True)
+    cutoff = pd.Timestamp.now(tz='UTC').tz_localize(None) - pd.Timedelta(hours=WINDOW_HOURS)
+    window = window[window['timestamp'] >= cutoff].tail(MAX_WINDOW_ROWS).reset_index(drop=True)
+    st.session_state["dashboard_window"] = window
+    return window
+
+
+# Totals come from the hourly rollup, which grows with hours of activity rather than with inferences
+@st.cache_data(ttl=10)
+def load_rollup():
+    conn = connect()
+    try:
+        return pd.read_sql_query("SELECT * FROM inference_rollup ORDER BY bucket", conn)
+    finally:
+        conn.close()
+
+
+def downsample(data, value_column, max_points=MAX_PLOT_POINTS):
+    # Per-model means over time buckets, wide enough to leave at most max_points buckets
+    if len(data) <= max_points:
+        return data
+    span = data['timestamp'].max() - data['timestamp'].min()
+    rule = max(span / max_points, pd.Timedelta(seconds=1))
+    return (data.set_index('timestamp')
+                .groupby('model_name')[value_column]
+                .resample(rule).mean()
+                .dropna()
+                .reset_index())
+
+
+def stage_breakdown(window):
+    # Mean seconds per request spent in each traced stage, per model; a stage a request skipped counts as 0
+    if 'stage_timings' not in window:
+        return pd.DataFrame()
+    traced = window.dropna(subset=['stage_timings'])
+    if traced.empty:
+        return pd.DataFrame()
+    stages = pd.DataFrame(traced['stage_timings'].map(json.loads).tolist(), index=traced.index).fillna(0.0)
+    stages['model_name'] = traced['model_name']
+    return (stages.groupby('model_name').mean()
+                  .reset_index()
+                  .melt(id_vars='model_name', var_name='stage', value_name='seconds'))
+
+
+def token_summary(window):
+    if 'output_tokens' not in window:
+        return pd.DataFrame()
+    generated = window.dropna(subset=['output_tokens'])
+    if generated.empty:
+        return pd.DataFrame()
+    summary = generated.groupby('model_name').agg(
+        requests=('output_tokens', 'size'),
+        mean_prompt_tokens=('prompt_tokens', 'mean'),
+        mean_output_tokens=('output_tokens', 'mean'),
+        output_tokens=('output_tokens', 'sum'),
+        inference_time=('inference_time', 'sum'),
+    )
+    summary['output_tokens_per_s'] = summary['output_tokens'] / summary['inference_time']
+    return summary.drop(columns=['output_tokens', 'inference_time'])
+
+
+def speculative_summary(window):
+    # Acceptance over all drafted tokens, and the mean of each request's estimated speedup
+    if 'speculative_stats' not in window:
+        return pd.DataFrame()
+    decoded = window.dropna(subset=['speculative_stats'])
+    if decoded.empty:
+        return pd.DataFrame()
+    stats = pd.DataFrame(decoded['speculative_stats'].map(json.loads).tolist(), index=decoded.index)
+    stats['model_name'] = decoded['model_name']
+    summary = stats.groupby('model_name').agg(
+        requests=('drafted', 'size'),
+        drafted=('drafted', 'sum'),
+        accepted=('accepted', 'sum'),
+        mean_estimated_speedup=('estimated_speedup', 'mean'),
+    )
+    summary['acceptance_rate'] = summary['accepted'] / summary['drafted']
+    return summary
+
+
+def stopping_summary(window):
+    # Share of requests per stop reason, and the tokens a fixed budget would have generated on top
+    if 'stop_stats' not in window:
+        return pd.DataFrame()
+    stopped = window.dropna(subset=['stop_stats'])
+    if stopped.empty:
+        return pd.DataFrame()
+    stats = pd.DataFrame(stopped['stop_stats'].map(json.loads).tolist(), index=stopped.index)
+    stats['model_name'] = stopped['model_name']
+    summary = stats.groupby('model_name').agg(
+        requests=('reason', 'size'),
+        mean_new_tokens=('new_tokens', 'mean'),
+        mean_saved_tokens=('saved_tokens', 'mean'),
+        mean_discarded_tokens=('discarded_tokens', 'mean'),
+    )
+    reasons = pd.crosstab(stats['model_name'], stats['reason'], normalize='index')
+    return summary.join(reasons.add_prefix('stopped_at_'))
+
 
 def show():
-    # Fetch the data
-    data = refresh_data()
+    # Make sure the tables and indexes exist, even before the first inference
+    inference_logger.start()
+    window = refresh_window()
+    rollup = load_rollup()
 
     # User Overview
     st.title("📊 Dashboard")
 
     # Model Performance Metrics
     st.markdown("## 📈 Model Performance Metrics")
+    total_inferences = int(rollup['count'].sum())
     col1, col2 = st.columns(2)
-    col1.metric("Total Inferences", len(data))
-    col2.metric("Average Inference Time (s)", data['inference_time'].mean())
+    col1.metric("Total Inferences", total_inferences)
+    col2.metric("Average Inference Time (s)", rollup['total_time'].sum() / total_inferences if total_inferences else None)
+
+    st.markdown(f"### Last {WINDOW_HOURS} hours")
+    if not window.empty:
+        latency = window.groupby('model_name')['inference_time'].describe(percentiles=[0.5, 0.95, 0.99])
+        st.dataframe(latency[['count', 'mean', '50%', '95%', '99%', 'max']])
 
     # Recent Interactions
     st.markdown("## 🕒 Recent Inferences")
-    recent_data = data.sort_values(by='timestamp', ascending=False).head(10)
+    recent_data = window.tail(10).iloc[::-1]
     st.dataframe(recent_data[['timestamp', 'model_name', 'inference_time', 'device']])
 
     # System Health Monitoring
@@ -53,11 +178,114 @@ def show():
     col4.metric("Memory Usage (%)", memory_usage)
     col5.metric("Uptime (s)", uptime)
 
+    # Per-stage tracing
+    st.markdown("## ⏱️ Where Time Goes")
+    breakdown = stage_breakdown(window)
+    if not breakdown.empty:
+        fig = px.bar(breakdown, x='model_name', y='seconds', color='stage', title='Mean time per request by stage')
+        st.plotly_chart(fig)
+    tokens = token_summary(window)
+    if not tokens.empty:
+        st.dataframe(tokens)
+    speculative = speculative_summary(window)
+    if not speculative.empty:
+        st.markdown("### Speculative Decoding")
+        st.dataframe(speculative)
+    stopping = stopping_summary(window)
+    if not stopping.empty:
+        st.markdown("### Early Stopping")
+        st.dataframe(stopping)
+    col_load, col_write, col_dropped = st.columns(3)
+    if 'system_load' in window and window['system_load'].notna().any():
+        col_load.metric("Mean CPU Load at Inference (%)", round(100 * window['system_load'].mean(), 1))
+    col_write.metric("Log Write (ms/record)", round(inference_logger.mean_write_ms, 2))
+    col_dropped.metric("Log Records Dropped", inference_logger.dropped)
+    if 'rss_mb' in window and window['rss_mb'].notna().any():
+        rss = downsample(window[['timestamp', 'model_name', 'rss_mb']].dropna(), 'rss_mb')
+        st.plotly_chart(px.line(rss, x='timestamp', y='rss_mb', color='model_name', title='Process RSS at Inference (MB)'))
+
+    # Model Registry
+    st.markdown("## 🧠 Loaded Models")
+    registry_data = pd.DataFrame(registry.snapshot())
+    col6, col7, col8 = st.columns(3)
+    col6.metric("Process RSS (MB)", round(current_rss_mb()))
+    col7.metric("Model Loads", int(registry_data['loads'].sum()) if not registry_data.empty else 0)
+    col8.metric("Model Evictions", int(registry_data['evictions'].sum()) if not registry_data.empty else 0)
+    if not registry_data.empty:
+        st.dataframe(registry_data)
+    if registry.memory_budget_mb > 0:
+        st.caption(f"Models are evicted least-recently-used above {registry.memory_budget_mb:.0f} MB RSS.")
+
+    # Inference slots shared by all sessions of this process
+    st.markdown("## 🚦 Inference Slots")
+    slot_data = pd.DataFrame(executor.snapshot())
+    col_threads, col_queued, col_throughput = st.columns(3)
+    col_threads.metric("Threads per Inference", executor.threads)
+    col_queued.metric("Requests Waiting", int(slot_data['queued'].sum()) if not slot_data.empty else 0)
+    col_throughput.metric("Throughput (inferences/min)",
+                          round(slot_data['throughput_per_min'].sum(), 1) if not slot_data.empty else 0)
+    if not slot_data.empty:
+        st.dataframe(slot_data)
+
+    # Cold start of this process
+    st.markdown("## 🚀 Cold Start")
+    startup_report = startup.report()
+    col_ready, col_warmup = st.columns(2)
+    if startup_report["ready_seconds"] is not None:
+        col_ready.metric("Preloaded Models Ready After (s)", round(startup_report["ready_seconds"], 1))
+    col_warmup.metric("Warmup", "on" if startup_report["warmup"] else "off")
+    for name, error in startup_report["failed"].items():
+        st.warning(f"Preloading {name} failed: {error}")
+    startup_data = pd.DataFrame(startup_report["models"])
+    if not startup_data.empty:
+        st.dataframe(startup_data)
+    if startup_report["first_request_seconds"]:
+        first_requests = pd.Series(startup_report["first_request_seconds"], name="first_request_seconds")
+        st.dataframe(first_requests.to_frame().assign(loaded_from=first_requests.index.map(startup_report["loaded_from"])))
+
+    # Response Cache
+    st.markdown("## ⚡ Response Cache")
+    cache_stats = response_cache.stats()
+    col9, col10, col11, col12 = st.columns(4)
+    col9.metric("Hit Rate (%)", round(100 * cache_stats["hit_rate"], 1))
+    col10.metric("Mean Lookup (ms)", round(cache_stats["mean_lookup_ms"], 2))
+    col11.metric("Cached Responses", cache_stats["entries"])
+    col12.metric("Cache Size (MB)", round(cache_stats["size_mb"], 2))
+
+    # Segmentation Result Cache
+    st.markdown("## 🩻 Segmentation Result Cache")
+    mask_stats = mask_cache.stats()
+    col13, col14, col15, col16 = st.columns(4)
+    col13.metric("Hit Rate (%)", round(100 * mask_stats["hit_rate"], 1))
+    col14.metric("Served from Database", mask_stats["database_hits"])
+    col15.metric("Mean Lookup (ms)", round(mask_stats["mean_lookup_ms"], 2))
+    col16.metric("Memory (MB)", round(mask_stats["size_mb"], 1))
+
+    # Shared Base Adapters, once a page has loaded the shared base; read from the registry, so that the
+    # Dashboard does not import transformers and peft through core.adapters
+    shared_base = registry.peek("shared_base")
+    if shared_base is not None:
+        adapter_stats = shared_base.stats()
+        st.markdown("## 🧬 Shared Base Adapters")
+        st.caption(f"Base model: {adapter_stats['base_model']} · active adapter: {adapter_stats['active']}"
+                   f"{' (merged)' if adapter_stats['merged'] else ''}")
+        col17, col18, col19, col20 = st.columns(4)
+        col17.metric("Memory Saved (MB)", round(adapter_stats["saved_mb"]))
+        col18.metric("Adapters (MB)", round(adapter_stats["adapter_mb"], 1))
+        col19.metric("Adapter Switches", adapter_stats["switches"])
+        col20.metric("Mean Switch (ms)", round(adapter_stats["mean_switch_ms"], 1))
+        st.dataframe(pd.DataFrame(adapter_stats["adapters"]))
+
     # Visualize Inference Time Over Time
     st.markdown("## 📊 Inference Time Over Time")
-    if not data.empty:
-        data['timestamp'] = pd.to_datetime(data['timestamp'])
-        fig = px.line(data, x='timestamp', y='inference_time', title='Inference Time Over Time')
+    history_range = st.radio("Range", [f"Last {WINDOW_HOURS} hours", "All time (hourly)"], horizontal=True)
+    if history_range == "All time (hourly)":
+        series = rollup.assign(timestamp=pd.to_datetime(rollup['bucket']), inference_time=rollup['total_time'] / rollup['count'])
+    else:
+        series = window
+    if not series.empty:
+        series = downsample(series[['timestamp', 'model_name', 'inference_time']], 'inference_time')
+        fig = px.line(series, x='timestamp', y='inference_time', color='model_name', title='Inference Time Over Time')
         st.plotly_chart(fig)
 
     # Auto-refresh control
@@ -2,33 +2,99 @@ import streamlit as st
 from PIL import Image
 from transformers import PaliGemmaForConditionalGeneration, AutoProcessor
 import torch
+import os
+import time
+from core.model_registry import registry
+from core.model_store import from_pretrained
+from core.precision import apply_precision, load_kwargs, precision_for
+from core.inference_log import InferenceRecord, inference_logger
+from core.generation import PrefillTimer
+from core.tracing import Trace
+from core import inference_client
+from core.vision_cache import CachedVisionTower
+from core import ingest
+from core.executor import executor, queue_notices
+
+# Number of encoded images kept for follow-up questions, shared by all sessions
+FEATURE_CACHE_SIZE = int(os.environ.get("ANIMA_MEDPALI_FEATURE_CACHE_SIZE", "32"))
 
-@st.cache_resource
 def load_model():
     model_id = "mockingmonkey/MedPali"
-    model = PaliGemmaForConditionalGeneration.from_pretrained(model_id)
-    processor = AutoProcessor.from_pretrained(model_id)
+    precision = precision_for("medpali")
+    model = from_pretrained(PaliGemmaForConditionalGeneration, model_id, **load_kwargs(precision))
+    model = apply_precision(model, precision)
+    model.vision_tower = CachedVisionTower(model.vision_tower, max_entries=FEATURE_CACHE_SIZE)
+    processor = from_pretrained(AutoProcessor, model_id)
     return model, processor
 
-model, processor = load_model()
+def warmup(loaded):
+    model, processor = loaded
+    model_inputs = processor(text=["caption en"], images=[Image.new("RGB", (64, 64))], return_tensors="pt")
+    model_inputs["pixel_values"] = model_inputs["pixel_values"].to(model.dtype)
+    with torch.inference_mode():
+        model.generate(**model_inputs, max_new_tokens=2, do_sample=False)
 
-def model_predict(image, prompt):
-    try:
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-
-        model_inputs = processor(text=prompt, images=image, return_tensors="pt")
-        input_len = model_inputs["input_ids"].shape[-1]
+registry.register("medpali", load_model, warmup=warmup)
 
-        with torch.inference_mode():
-            generation = model.generate(**model_inputs, max_new_tokens=100, do_sample=False)
-            generation = generation[0][input_len:]
-            decoded = processor.decode(generation, skip_special_tokens=True)
+def model_predict(image, prompt):
+    # `image` is the encoded upload, or a PIL image
+    return model_predict_batch(image, [prompt])[0]
 
-        return decoded
+def model_predict_batch(image, prompts):
+    # All prompts about one image share a single generate(); the image is encoded once
+    try:
+        if inference_client.enabled():
+            return inference_client.medpali(image, prompts)
+        return generate_answers([image] * len(prompts), prompts)
     except Exception as e:
         st.error(f"Error during model prediction: {e}")
-        return ""
+        return [""] * len(prompts)
+
+def ingest_images(images, image_processor):
+    # Each distinct upload is decoded once, straight to the processor's input size, and cached by content;
+    # the processor's own resize is then a no-op
+    size = (image_processor.size["width"], image_processor.size["height"])
+    ingested = {}
+    for image in images:
+        if id(image) not in ingested:
+            ingested[id(image)] = ingest.ingest(image, size, image_processor.resample)
+    return [ingested[id(image)] for image in images]
+
+def generate_answers(images, prompts):
+    # One answer per (image, prompt) pair, all in a single left-padded generate(); images are encoded
+    # uploads or PIL images
+    model, processor = registry.get("medpali")
+    trace = Trace()
+    with trace.stage("preprocess"):
+        ingested = ingest_images(images, processor.image_processor)
+        model_inputs = processor(text=prompts, images=[item.pixels for item in ingested], padding="longest",
+                                 return_tensors="pt")
+        model_inputs["pixel_values"] = model_inputs["pixel_values"].to(model.dtype)
+    input_len = model_inputs["input_ids"].shape[-1]
+
+    with executor.slot("medpali") as waited, torch.inference_mode():
+        trace.add("queue", waited)
+        start_time = time.perf_counter()
+        timer = PrefillTimer()
+        generation = model.generate(**model_inputs, max_new_tokens=100, do_sample=False, streamer=timer)
+        trace.add_generation(timer.start_time, timer.first_token_time, time.perf_counter())
+    generation = generation[:, input_len:]
+    with trace.stage("postprocess"):
+        decoded = processor.batch_decode(generation, skip_special_tokens=True)
+    inference_time = (time.perf_counter() - start_time) / len(prompts)
+
+    # Every answer is logged with its share of the batch
+    trace = trace.scaled(1 / len(prompts))
+    pad_token_id = processor.tokenizer.pad_token_id
+    prompt_tokens = model_inputs["attention_mask"].sum(dim=-1).tolist()
+    output_tokens = (generation != pad_token_id).sum(dim=-1).tolist()
+    for image, item, prompt_length, output_length in zip(images, ingested, prompt_tokens, output_tokens):
+        trace.prompt_tokens, trace.output_tokens = prompt_length, output_length
+        inference_logger.log(InferenceRecord(model_name=model.name_or_path, model_type="PaliGemma",
+                                             inference_time=inference_time, device=model.device.type,
+                                             image=item.preview, image_bytes=image if isinstance(image, bytes) else None,
+                                             **trace.record_fields()))
+    return decoded
 
 def show():
     st.title("MedPali - Medical Image Analysis")
@@ -66,8 +132,13 @@ def show():
     uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "jpeg", "png"])
 
     if uploaded_file is not None:
-        st.session_state.image = Image.open(uploaded_file)
-        st.image(st.session_state.image, caption='Uploaded Image.', use_column_width=True)
+        # The encoded upload is kept; it is decoded at reduced scale, once, for display and for the model
+        st.session_state.image = uploaded_file.getvalue()
+        try:
+            st.image(ingest.preview(st.session_state.image), caption='Uploaded Image.', use_column_width=True)
+        except ingest.ImageRejected as e:
+            st.error(f"This image cannot be analyzed: {e}")
+            st.session_state.image = None
     
     if st.session_state.image is not None:
         prompt = st.text_input("Enter your prompt", "")
@@ -76,7 +147,7 @@ def show():
             if not prompt:
                 st.warning("Please enter a prompt before analyzing.")
             else:
-                with st.spinner('MedPali is analyzing the image for you...'):
+                with st.spinner('MedPali is analyzing the image for you...'), queue_notices(st.empty()):
                     prediction = model_predict(st.session_state.image, prompt)
                     st.session_state.conversation.append((prompt, prediction))
                     st.experimental_rerun()
@@ -93,10 +164,22 @@ def show():
             if not prompt:
                 st.warning("Please enter a prompt before asking.")
             else:
-                with st.spinner('MedPali is analyzing the image for you...'):
+                with st.spinner('MedPali is analyzing the image for you...'), queue_notices(st.empty()):
                     prediction = model_predict(st.session_state.image, prompt)
                     st.session_state.conversation.append((prompt, prediction))
                     st.experimental_rerun()
 
+        prompts = st.text_area("Or ask several questions at once, one per line (e.g. \"caption en\")", "")
+
+        if st.button("Ask all"):
+            prompts = [line.strip() for line in prompts.splitlines() if line.strip()]
+            if not prompts:
+                st.warning("Please enter at least one prompt before asking.")
+            else:
+                with st.spinner('MedPali is analyzing the image for you...'), queue_notices(st.empty()):
+                    predictions = model_predict_batch(st.session_state.image, prompts)
+                    st.session_state.conversation.extend(zip(prompts, predictions))
+                    st.experimental_rerun()
+
 if __name__ == "__main__":
     show()
@@ -3,47 +3,156 @@ import pandas as pd
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM
 import io
+import os
+import time
+from core.model_registry import registry
+from core.model_store import from_pretrained
+from core.precision import apply_precision, load_kwargs, precision_for
+from core.generation import PrefillTimer, batched_generate, truncate_to_last_sentence
+from core.response_cache import response_cache
+from core.inference_log import InferenceRecord, inference_logger
+from core.tracing import Trace
+from core.speculative import speculative_decoder, trace_speculative
+from core.executor import executor, queue_notices
+from core.stopping import Budget, deadline_for, stop_stats
+from core import adapters, inference_client
+
+# A recommendation stops at the first sentence end after 120 new tokens, at the latest after 300 tokens or the
+# deadline. Over-long prompts keep their end, which holds the instruction
+BUDGET = Budget(max_prompt_tokens=1024, max_new_tokens=300, min_new_tokens=120,
+                deadline_seconds=deadline_for("medreco", 120))
+# Upper bounds for one batched generate() over uploaded CSV rows: rows per batch, and padded tokens
+# (prompt + new tokens, summed over rows) per batch
+MAX_BATCH_SIZE = int(os.environ.get("ANIMA_MEDRECO_MAX_BATCH_SIZE", "16"))
+BATCH_TOKEN_BUDGET = int(os.environ.get("ANIMA_MEDRECO_BATCH_TOKEN_BUDGET", "8192"))
 
-@st.cache_resource
 def load_gemma_model():
+    if adapters.SHARED_BASE:
+        tokenizer, model = adapters.load("medreco")
+        return model, tokenizer
     model_id = "mockingmonkey/MedGemma"
-    tokenizer = AutoTokenizer.from_pretrained(model_id)
-    model = AutoModelForCausalLM.from_pretrained(model_id)
+    tokenizer = from_pretrained(AutoTokenizer, model_id)
+    precision = precision_for("medreco")
+    model = from_pretrained(AutoModelForCausalLM, model_id, **load_kwargs(precision))
+    model = apply_precision(model, precision)
     return model, tokenizer
 
+def warmup(loaded):
+    model, tokenizer = loaded
+    with torch.inference_mode():
+        model.generate(tokenizer.encode("Hello", return_tensors="pt"), max_new_tokens=2)
+
+registry.register("medreco", load_gemma_model, warmup=warmup, parent=adapters.PARENT)
+
 def model_predict(model, tokenizer, input_text):
     try:
-        input_ids = tokenizer.encode(input_text, return_tensors="pt")
-        outputs = model.generate(input_ids, max_new_tokens=300)
-        response = tokenizer.decode(outputs[0], skip_special_tokens=True)
+        response = cached_response(model, input_text)
+        if response is not None:
+            return response
 
-        if '.' in response:
-            last_period_index = response.rfind('.')
-            response = response[:last_period_index + 1]
-        
+        trace = Trace()
+        with executor.slot("medreco") as waited:
+            trace.add("queue", waited)
+            start_time = time.perf_counter()
+            with trace.stage("tokenize"):
+                input_ids = torch.tensor([BUDGET.fit_prompt(tokenizer.encode(input_text), tokenizer.bos_token_id)])
+            decoder = speculative_decoder("medreco", model)
+            generate_kwargs = BUDGET.generate_kwargs(tokenizer, input_ids.shape[-1])
+            if decoder is not None:
+                outputs = decoder.generate(input_ids, **generate_kwargs)
+                trace_speculative(trace, decoder.stats)
+            else:
+                timer = PrefillTimer()
+                outputs = model.generate(input_ids, streamer=timer, **generate_kwargs)
+                trace.add_generation(timer.start_time, timer.first_token_time, time.perf_counter())
+        with trace.stage("postprocess"):
+            response = tokenizer.decode(outputs[0], skip_special_tokens=True)
+            response = truncate_to_last_sentence(response)
+            stats = stop_stats(tokenizer, outputs[0][input_ids.shape[-1]:].tolist(), BUDGET)
+        trace.prompt_tokens, trace.output_tokens = input_ids.shape[-1], stats.new_tokens
+        trace.stop_stats = stats.summary()
+        log_inference(model, time.perf_counter() - start_time, trace)
+        cache_response(model, input_text, response, stats)
         return response
     
     except Exception as e:
         st.error(f"Error during model prediction: {e}")
         return ""
 
+def log_inference(model, inference_time, trace):
+    inference_logger.log(InferenceRecord(model_name=model.name_or_path, model_type="CausalLM",
+                                         inference_time=inference_time, device=model.device.type,
+                                         **trace.record_fields()))
+
+def cache_params():
+    # In shared-base mode the adapters run at the base's precision
+    return BUDGET.cache_params(precision_for(adapters.PARENT or "medreco"))
+
+def cached_response(model, input_text):
+    # Sampled recommendations are not reproducible, so only greedy generation goes through the cache
+    if model.generation_config.do_sample:
+        return None
+    return response_cache.get(model.name_or_path, input_text, cache_params())
+
+def cache_response(model, input_text, response, stats):
+    # A recommendation cut short by the deadline depends on the load at the time, so it is not reused
+    if not model.generation_config.do_sample and stats.reason != "deadline":
+        response_cache.put(model.name_or_path, input_text, cache_params(), response)
+
+def model_predict_batch(model, tokenizer, input_texts, deadline=True):
+    # Yields (row index, recommendation): cached rows first, then the rest as each length-bucketed batch
+    # finishes, so not in row order. With `deadline`, each row gets BUDGET.deadline_seconds of its batch's
+    # generation time; offline jobs pass False and let every row run to its sentence end
+    uncached = []
+    for index, input_text in enumerate(input_texts):
+        response = cached_response(model, input_text)
+        if response is None:
+            uncached.append(index)
+        else:
+            yield index, response
+
+    if not uncached:
+        return
+    prompts = [input_texts[index] for index in uncached]
+    tokenize_trace = Trace()
+    with tokenize_trace.stage("tokenize"):
+        encoded = [BUDGET.fit_prompt(tokenizer.encode(prompt), tokenizer.bos_token_id) for prompt in prompts]
+    tokenize_trace = tokenize_trace.scaled(1 / len(prompts))
+    # A slot is taken per batch, so a long CSV does not lock other sessions out of the model
+    # Each row stops at its own sentence end; rows that finish early are padded until the batch is done
+    for batch_index, output_ids, seconds in batched_generate(model, tokenizer, encoded,
+                                                             max_new_tokens=BUDGET.max_new_tokens,
+                                                             token_budget=BATCH_TOKEN_BUDGET, max_batch_size=MAX_BATCH_SIZE,
+                                                             slot=lambda: executor.slot("medreco"),
+                                                             stopping=lambda width: BUDGET.criteria(tokenizer, width),
+                                                             deadline=BUDGET.deadline_seconds if deadline else None):
+        trace = tokenize_trace.scaled(1)
+        trace.add("generate", seconds)
+        with trace.stage("postprocess"):
+            response = tokenizer.decode(output_ids, skip_special_tokens=True)
+            response = truncate_to_last_sentence(response)
+            stats = stop_stats(tokenizer, output_ids[len(encoded[batch_index]):].tolist(), BUDGET)
+        trace.prompt_tokens = len(encoded[batch_index])
+        trace.output_tokens = stats.new_tokens
+        trace.stop_stats = stats.summary()
+        log_inference(model, seconds, trace)
+        cache_response(model, prompts[batch_index], response, stats)
+        yield uncached[batch_index], response
+
 def format_prompt_from_csv(df):
     # Assuming the CSV columns match the form fields
-    prompts = []
-    for _, row in df.iterrows():
-        prompt = (
-            f"Age: {row['Age']}\n"
-            f"Gender: {row['Gender']}\n"
-            f"Primary Symptom: {row['Symptom']}\n"
-            f"Symptom Duration: {row['Duration']}\n"
-            f"Symptom Severity: {row['Severity']}\n"
-            f"Past Surgeries: {row['Past Surgeries']}\n"
-            f"Current Medications: {row['Current Medications']}\n"
-            f"Allergies: {row['Allergies']}\n"
-            "Based on this information, provide medical recommendations and suggest next steps for the patient's care."
-        )
-        prompts.append(prompt)
-    return prompts
+    prompts = (
+        "Age: " + df['Age'].astype(str) + "\n"
+        + "Gender: " + df['Gender'].astype(str) + "\n"
+        + "Primary Symptom: " + df['Symptom'].astype(str) + "\n"
+        + "Symptom Duration: " + df['Duration'].astype(str) + "\n"
+        + "Symptom Severity: " + df['Severity'].astype(str) + "\n"
+        + "Past Surgeries: " + df['Past Surgeries'].astype(str) + "\n"
+        + "Current Medications: " + df['Current Medications'].astype(str) + "\n"
+        + "Allergies: " + df['Allergies'].astype(str) + "\n"
+        + "Based on this information, provide medical recommendations and suggest next steps for the patient's care."
+    )
+    return prompts.tolist()
 
 def show():
     st.markdown("""
@@ -106,14 +215,29 @@ def show():
         
         input_texts = format_prompt_from_csv(df)
 
-        with st.spinner("Loading GEMMA model... This may take a few minutes."):
-            model, tokenizer = load_gemma_model()
+        if inference_client.enabled():
+            results = inference_client.recommend(input_texts)
+        else:
+            with st.spinner("Loading GEMMA model... This may take a few minutes."):
+                model, tokenizer = registry.get("medreco")
+            results = model_predict_batch(model, tokenizer, input_texts)
 
-        for input_text in input_texts:
-            with st.spinner('Generating recommendations...'):
-                first_output = model_predict(model, tokenizer, input_text)
-                st.subheader("GEMMA Model Recommendations")
-                st.write(first_output)
+        st.subheader("GEMMA Model Recommendations")
+        progress = st.progress(0.0, text="Generating recommendations...")
+        # One slot per patient so batches that finish out of order still render in CSV order
+        row_containers = [st.container() for _ in input_texts]
+        start_time = time.perf_counter()
+        try:
+            with queue_notices(st.empty()):
+                for done, (index, output) in enumerate(results, 1):
+                    with row_containers[index]:
+                        st.markdown(f"**Patient {index + 1}**")
+                        st.write(output)
+                    elapsed = time.perf_counter() - start_time
+                    progress.progress(done / len(input_texts),
+                                      text=f"{done}/{len(input_texts)} patients · {done / elapsed:.2f} patients/s")
+        except Exception as e:
+            st.error(f"Error during model prediction: {e}")
 
         st.subheader("Disclaimer")
         st.write("These recommendations are generated by an AI model based on the provided patient information. They should be reviewed by a qualified healthcare professional before making any medical decisions.")
@@ -134,13 +258,21 @@ def show():
                 "Based on this information, provide medical recommendations and suggest next steps for the patient's care."
             )
 
-            with st.spinner("Loading GEMMA model... This may take a few minutes."):
-                model, tokenizer = load_gemma_model()
+            if inference_client.enabled():
+                with st.spinner('Generating recommendations...'):
+                    try:
+                        _, first_output = next(inference_client.recommend([input_text]))
+                    except inference_client.InferenceServiceError as e:
+                        st.error(f"Error during model prediction: {e}")
+                        first_output = ""
+            else:
+                with st.spinner("Loading GEMMA model... This may take a few minutes."):
+                    model, tokenizer = registry.get("medreco")
+                with st.spinner('Generating recommendations...'), queue_notices(st.empty()):
+                    first_output = model_predict(model, tokenizer, input_text)
 
-            with st.spinner('Generating recommendations...'):
-                first_output = model_predict(model, tokenizer, input_text)
-                st.subheader("GEMMA Model Recommendations")
-                st.write(first_output)
+            st.subheader("GEMMA Model Recommendations")
+            st.write(first_output)
 
             st.subheader("Disclaimer")
             st.write("These recommendations are generated by an AI model based on the provided patient information. They should be reviewed by a qualified healthcare professional before making any medical decisions.")
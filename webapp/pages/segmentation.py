@@ -2,15 +2,27 @@ import streamlit as st
 from PIL import Image
 import time
 import torch
-import torchvision.transforms as TF
 from transformers import SegformerForSemanticSegmentation
-from dataclasses import dataclass
-import sqlite3
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from pathlib import Path
 import io
-import matplotlib.pyplot as plt
+import zipfile
 import numpy as np
 import os
 import logging
+from core.model_registry import registry
+from core.model_store import from_pretrained, read_manifest
+import core.ingest
+from core.ingest import IngestedImage, ingest
+from core.mask_cache import mask_cache
+from core.executor import executor, queue_notices
+from core.precision import apply_precision, load_kwargs, precision_for
+from core.segformer_backend import load_backend
+from core.inference_log import InferenceRecord, inference_logger
+from core.tracing import Trace
+from core import inference_client
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -23,6 +35,18 @@ class Configs:
     MEAN: tuple = (0.485, 0.456, 0.406)
     STD: tuple = (0.229, 0.224, 0.225)
     MODEL_NAME: str = "davidle7/segformer"
+    BATCH_SIZE: int = 8
+    PREFETCH_WORKERS: int = 2
+    PREFETCH_BATCHES: int = 2  # decoded batches kept ready ahead of the model
+    IMAGE_EXTENSIONS: tuple = (".jpg", ".jpeg", ".png")
+    # "chunked": exact bilinear upsampling, a band of rows at a time; "lowres": argmax at model resolution
+    # then nearest upsampling; "full": upsample the whole logits tensor (original behaviour)
+    POSTPROCESS_MODES: tuple = ("chunked", "lowres", "full")
+    POSTPROCESS: str = "chunked"
+    CHUNK_ROWS: int = 64
+    OVERLAY_ALPHA: float = 0.45
+    # "eager", "compile", "torchscript" or "onnx"; see core/segformer_backend.py
+    BACKEND: str = os.environ.get("ANIMA_SEGMENTATION_BACKEND", "eager")
 
 class2hexcolor = {
     "Stomach": "#FFA07A",
@@ -40,128 +64,402 @@ def initialize_device():
 
 DEVICE = initialize_device()
 
-def get_model(model_name, num_classes):
-    model = SegformerForSemanticSegmentation.from_pretrained(
+def get_model(model_name, num_classes, precision="fp32"):
+    model = from_pretrained(
+        SegformerForSemanticSegmentation,
         model_name,
         num_labels=num_classes,
-        ignore_mismatched_sizes=True
+        ignore_mismatched_sizes=True,
+        **load_kwargs(precision)
     )
-    return model
+    return apply_precision(model, precision)
 
-preprocess = TF.Compose([
-    TF.Resize(size=Configs.IMAGE_SIZE[::-1]),
-    TF.Lambda(lambda img: img.convert("RGB")),
-    TF.ToTensor(),
-    TF.Normalize(Configs.MEAN, Configs.STD, inplace=True),
-])
+def ingest_image(source, use_cache=True):
+    """Model input for an upload (encoded bytes, a path or a PIL image), cached by content; see core/ingest.py."""
+    if isinstance(source, IngestedImage):
+        return source
+    return ingest(source, Configs.IMAGE_SIZE, Image.BILINEAR, Configs.MEAN, Configs.STD, use_cache=use_cache)
 
-try:
-    model = get_model(model_name=Configs.MODEL_NAME, num_classes=Configs.NUM_CLASSES)
+def load_segmentation_model():
+    precision = precision_for("segmentation")
+    model = get_model(model_name=Configs.MODEL_NAME, num_classes=Configs.NUM_CLASSES, precision=precision)
     model.to(DEVICE)
     model.eval()
-except Exception as e:
-    logging.error(f"An error occurred: {e}")
-    exit(1)
+    return load_backend(model, Configs.BACKEND, Configs.IMAGE_SIZE, precision, batch_sizes=(1, Configs.BATCH_SIZE))
+
+def warmup(model):
+    # One slice through the forward pass; compiled backends also settle their kernels here
+    batch = torch.zeros(1, 3, *Configs.IMAGE_SIZE[::-1], device=DEVICE, dtype=model.dtype)
+    with torch.inference_mode():
+        model(pixel_values=batch, return_dict=True)
+
+registry.register("segmentation", load_segmentation_model, warmup=warmup)
+
+def result_version(postprocess=Configs.POSTPROCESS):
+    # Logged as model_version: everything besides the upload that changes a mask, so that cached masks are
+    # only reused for the same weights, precision, backend, decoding of the upload and post-processing.
+    # Draft-decoded JPEGs are resampled from reduced pixels, so their masks differ from full decodes
+    revision = (read_manifest(Configs.MODEL_NAME) or {}).get("revision") or "hub"
+    width, height = Configs.IMAGE_SIZE
+    decode = f"{'draft' if core.ingest.JPEG_DRAFT else 'full'}-{width}x{height}"
+    return f"{revision[:12]}/{precision_for('segmentation')}/{Configs.BACKEND}/{decode}/{postprocess}"
 
 def setup_database():
-    database_dir = 'databases'
-    database_path = os.path.join(database_dir, 'inference_data.db')
-    
-    if not os.path.exists(database_dir):
-        os.makedirs(database_dir)
-    
-    conn = sqlite3.connect(database_path, timeout=10)
-    try:
-        with conn:
-            conn.execute('''CREATE TABLE IF NOT EXISTS model_inference (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                model_name TEXT,
-                model_version TEXT,
-                model_type TEXT,
-                input_image BLOB,
-                input_size TEXT,
-                output_segmentation BLOB,
-                inference_time REAL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                device TEXT,
-                system_load REAL,
-                accuracy REAL,
-                loss REAL
-            )''')
-    finally:
-        conn.close()
-
-def predict(input_image):
-    shape_H_W = input_image.size[::-1]
-    input_tensor = preprocess(input_image)
-    input_tensor = input_tensor.unsqueeze(0).to(DEVICE)
+    inference_logger.start()
 
-    start_time = time.time()
-    with torch.inference_mode():
+def predict(input_image, trace=None):
+    trace = trace if trace is not None else Trace()
+    model = registry.get("segmentation")
+    with trace.stage("preprocess"):
+        ingested = ingest_image(input_image)
+        input_tensor = ingested.tensor.unsqueeze(0).to(DEVICE, dtype=model.dtype)
+    shape_H_W = ingested.original_size[::-1]
+
+    with executor.slot("segmentation") as waited, torch.inference_mode():
+        trace.add("queue", waited)
+        start_time = time.time()
         outputs = model(pixel_values=input_tensor, return_dict=True)
     inference_time = time.time() - start_time
+    trace.add("forward", inference_time)
+
+    with trace.stage("postprocess"):
+        predictions = torch.nn.functional.interpolate(outputs.logits.float(), size=shape_H_W, mode="bilinear", align_corners=False)
+        preds_argmax = predictions.argmax(dim=1).cpu().squeeze().numpy()
+        seg_info = [(preds_argmax == idx, class_name) for idx, class_name in enumerate(Configs.CLASSES, 1)]
+
+    return ingested.preview, seg_info, preds_argmax, inference_time
+
+@dataclass
+class SeriesStats:
+    slices: int = 0
+    inference_time: float = 0.0
+    start_time: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    @property
+    def slices_per_second(self):
+        return self.slices / self.elapsed if self.slices else 0.0
+
+def load_slice(name, data):
+    # Series slices are seen once, so they bypass the ingestion cache
+    ingested = ingest_image(data, use_cache=False)
+    return name, ingested.original_size[::-1], ingested.tensor
+
+def prefetch(sources, depth, workers=Configs.PREFETCH_WORKERS):
+    # Decodes and preprocesses up to `depth` slices ahead on worker threads, yielding them in source order
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for name, data in sources:
+            pending.append(pool.submit(load_slice, name, data))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def predict_batch(input_tensors, shapes_H_W, trace=None, postprocess=None):
+    # `trace` receives the whole batch's stage timings; `postprocess` lists each tensor's post-processing mode,
+    # Configs.POSTPROCESS for all by default
+    trace = trace if trace is not None else Trace()
+    model = registry.get("segmentation")
+    with trace.stage("preprocess"):
+        batch = torch.stack(input_tensors).to(DEVICE, dtype=model.dtype)
+
+    with executor.slot("segmentation") as waited, torch.inference_mode():
+        trace.add("queue", waited)
+        start_time = time.time()
+        outputs = model(pixel_values=batch, return_dict=True)
+    inference_time = time.time() - start_time
+    trace.add("forward", inference_time)
+
+    with trace.stage("postprocess"):
+        modes = postprocess or [Configs.POSTPROCESS] * len(shapes_H_W)
+        masks = [logits_to_mask(logits, shape_H_W, mode)
+                 for logits, shape_H_W, mode in zip(outputs.logits, shapes_H_W, modes)]
+    return masks, inference_time
+
+def segment_series(sources, batch_size=Configs.BATCH_SIZE, stats=None):
+    """Yields (slice name, uint8 class mask) for an iterable of (name, bytes or path) slices.
+
+    Slices are streamed: at most `batch_size * Configs.PREFETCH_BATCHES` decoded slices are held at a time,
+    whatever the series length.
+    """
+    stats = stats if stats is not None else SeriesStats()
+    batch = []
+    for item in prefetch(sources, depth=batch_size * Configs.PREFETCH_BATCHES):
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield from _segment_batch(batch, stats)
+            batch = []
+    if batch:
+        yield from _segment_batch(batch, stats)
+
+def _segment_batch(batch, stats):
+    names, shapes_H_W, input_tensors = zip(*batch)
+    trace = Trace()
+    masks, inference_time = predict_batch(input_tensors, shapes_H_W, trace)
+    stats.inference_time += inference_time
+    trace = trace.scaled(1 / len(names))
+    for name, mask in zip(names, masks):
+        stats.slices += 1
+        save_inference_details(Configs.MODEL_NAME, None, mask, inference_time / len(names), trace=trace)
+        yield name, mask
+
+def iter_folder_slices(folder):
+    for path in sorted(Path(folder).iterdir()):
+        if path.suffix.lower() in Configs.IMAGE_EXTENSIONS:
+            yield path.name, path
+
+def segment_folder(folder, batch_size=Configs.BATCH_SIZE, stats=None):
+    return segment_series(iter_folder_slices(folder), batch_size, stats)
+
+def iter_uploaded_slices(uploaded_files):
+    # Zip members are read one at a time, in name order, as the prefetch stage asks for them
+    for uploaded_file in uploaded_files:
+        if uploaded_file.name.lower().endswith(".zip"):
+            with zipfile.ZipFile(uploaded_file) as archive:
+                for member in sorted(archive.namelist()):
+                    if member.lower().endswith(Configs.IMAGE_EXTENSIONS) and not member.startswith("__MACOSX/"):
+                        yield member, archive.read(member)
+        else:
+            yield uploaded_file.name, uploaded_file.getvalue()
 
-    predictions = torch.nn.functional.interpolate(outputs.logits, size=shape_H_W, mode="bilinear", align_corners=False)
-    preds_argmax = predictions.argmax(dim=1).cpu().squeeze().numpy()
-    seg_info = [(preds_argmax == idx, class_name) for idx, class_name in enumerate(Configs.CLASSES, 1)]
+def class_fractions(mask):
+    counts = np.bincount(mask.ravel(), minlength=Configs.NUM_CLASSES)
+    return {class_name: counts[idx] / mask.size for idx, class_name in enumerate(Configs.CLASSES, 1)}
 
-    return input_image, seg_info, preds_argmax, inference_time
+def encode_mask_png(mask):
+    buffer = io.BytesIO()
+    Image.fromarray(mask, mode="L").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def logits_to_mask(logits, shape_H_W, mode=Configs.POSTPROCESS):
+    """Turns (num_classes, h, w) logits into a uint8 class mask of size shape_H_W."""
+    logits = logits.float().cpu()
+    if mode == "full":
+        predictions = torch.nn.functional.interpolate(logits.unsqueeze(0), size=shape_H_W, mode="bilinear", align_corners=False)
+        return predictions.argmax(dim=1).squeeze(0).to(torch.uint8).numpy()
+    if mode == "lowres":
+        mask = logits.argmax(dim=0).to(torch.uint8).numpy()
+        return np.asarray(Image.fromarray(mask).resize(shape_H_W[::-1], Image.NEAREST))
+    if mode == "chunked":
+        return _chunked_bilinear_argmax(logits, shape_H_W)
+    raise ValueError(f"Unknown post-processing mode '{mode}'")
+
+def _chunked_bilinear_argmax(logits, shape_H_W, chunk_rows=Configs.CHUNK_ROWS):
+    # Same sampling as interpolate(mode="bilinear", align_corners=False), but only `chunk_rows` output rows
+    # of float logits exist at a time
+    num_classes, h, w = logits.shape
+    H, W = shape_H_W
+    source_rows = ((torch.arange(H, dtype=torch.float32) + 0.5) * (h / H) - 0.5).clamp(min=0)
+    top_rows = source_rows.floor().long().clamp(max=h - 1)
+    bottom_rows = (top_rows + 1).clamp(max=h - 1)
+    row_weights = (source_rows - top_rows).unsqueeze(-1)
+
+    mask = torch.empty((H, W), dtype=torch.uint8)
+    for start in range(0, H, chunk_rows):
+        rows = slice(start, min(start + chunk_rows, H))
+        top = logits[:, top_rows[rows]]
+        band = top + (logits[:, bottom_rows[rows]] - top) * row_weights[rows]
+        # Height is unchanged here, so this only interpolates along the columns
+        band = torch.nn.functional.interpolate(band.unsqueeze(0), size=(band.shape[1], W), mode="bilinear", align_corners=False)
+        mask[rows] = band.argmax(dim=1).squeeze(0).to(torch.uint8)
+    return mask.numpy()
+
+def predict_mask(input_image, postprocess=Configs.POSTPROCESS, trace=None):
+    trace = trace if trace is not None else Trace()
+    model = registry.get("segmentation")
+    with trace.stage("preprocess"):
+        ingested = ingest_image(input_image)
+        input_tensor = ingested.tensor.unsqueeze(0).to(DEVICE, dtype=model.dtype)
+
+    with executor.slot("segmentation") as waited, torch.inference_mode():
+        trace.add("queue", waited)
+        start_time = time.time()
+        outputs = model(pixel_values=input_tensor, return_dict=True)
+    inference_time = time.time() - start_time
+    trace.add("forward", inference_time)
+
+    start_time = time.time()
+    mask = logits_to_mask(outputs.logits[0], ingested.original_size[::-1], postprocess)
+    postprocess_time = time.time() - start_time
+    trace.add("postprocess", postprocess_time)
+    return mask, inference_time, postprocess_time
 
 def plot_segmentation(input_image, seg_info, preds_argmax):
+    # Only the contour renderer needs matplotlib, which takes a noticeable share of the page's import time
+    import matplotlib.pyplot as plt
+
     input_image = input_image.convert("L")
     plt.figure(figsize=(10, 10))
-    plt.imshow(input_image, cmap='gray')
+    # The image may be a reduced preview; stretch it over the full-resolution mask's coordinates
+    height, width = preds_argmax.shape
+    plt.imshow(input_image, cmap='gray', extent=(-0.5, width - 0.5, height - 0.5, -0.5))
     for mask, class_name in seg_info:
         plt.contour(mask, colors=[class2hexcolor[class_name]], alpha=0.5)
     plt.axis('off')
     return plt
 
-def save_inference_details(model_name, input_image, output_segmentation, inference_time):
-    database_path = 'databases/inference_data.db'
-    
-    input_image_bytes = io.BytesIO()
-    input_image.save(input_image_bytes, format='PNG')
-    input_image_blob = input_image_bytes.getvalue()
-
-    output_segmentation_bytes = io.BytesIO()
-    np.save(output_segmentation_bytes, output_segmentation)
-    output_segmentation_blob = output_segmentation_bytes.getvalue()
-
-    conn = sqlite3.connect(database_path, timeout=10)
-    try:
-        with conn:
-            conn.execute('''INSERT INTO model_inference (model_name, model_version, model_type, input_image, input_size, output_segmentation, inference_time, device, system_load)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                          (model_name, "1.0", "Segformer", input_image_blob, str(Configs.IMAGE_SIZE), output_segmentation_blob, inference_time, DEVICE.type, 0.5))
-    finally:
-        conn.close()
+def render_contours(input_image, seg_info, preds_argmax):
+    # plot_segmentation as PNG bytes, which can be cached and shown again without matplotlib
+    plot = plot_segmentation(input_image, seg_info, preds_argmax)
+    buffer = io.BytesIO()
+    plot.savefig(buffer, format="png", bbox_inches="tight")
+    plot.close()
+    return buffer.getvalue()
+
+def _hex_to_rgb(color):
+    return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+
+# Row i is the overlay colour of class index i; index 0 is background and never drawn
+PALETTE = np.array([(0, 0, 0)] + [_hex_to_rgb(class2hexcolor[class_name]) for class_name in Configs.CLASSES], dtype=np.uint16)
+
+def render_overlay(input_image, mask, alpha=Configs.OVERLAY_ALPHA):
+    """Blends class colours over the grayscale image and outlines each region, returning a PIL image."""
+    gray = np.asarray(input_image.convert("L"))
+    if mask.shape != gray.shape:
+        # A reduced preview of the upload: draw at its size
+        mask = np.asarray(Image.fromarray(mask).resize(input_image.size, Image.NEAREST))
+    overlay = np.repeat(gray[..., None], 3, axis=2)
+
+    labelled = mask > 0
+    weight = int(alpha * 256)
+    blended = (overlay[labelled].astype(np.uint16) * (256 - weight) + PALETTE[mask[labelled]] * weight) >> 8
+    overlay[labelled] = blended.astype(np.uint8)
+
+    edges = np.zeros_like(labelled)
+    edges[:-1] |= mask[:-1] != mask[1:]
+    edges[1:] |= mask[1:] != mask[:-1]
+    edges[:, :-1] |= mask[:, :-1] != mask[:, 1:]
+    edges[:, 1:] |= mask[:, 1:] != mask[:, :-1]
+    edges &= labelled
+    overlay[edges] = PALETTE[mask[edges]].astype(np.uint8)
+    return Image.fromarray(overlay)
+
+def save_inference_details(model_name, input_image, output_segmentation, inference_time, image_bytes=None, trace=None,
+                           content_hash=None, model_version=None):
+    # `input_image` may be a reduced preview; `image_bytes`, when given, is the original upload
+    # Queued for the background writer; the image is stored once per content hash and the mask compressed.
+    # `content_hash` and `model_version` are what mask_cache looks logged masks up by
+    trace = trace if trace is not None else Trace()
+    inference_logger.log(InferenceRecord(
+        model_name=model_name,
+        model_type="Segformer",
+        inference_time=inference_time,
+        device=DEVICE.type,
+        model_version=model_version or result_version(),
+        input_size=str(Configs.IMAGE_SIZE),
+        image=input_image,
+        image_bytes=image_bytes,
+        content_hash=content_hash,
+        mask=output_segmentation,
+        **trace.record_fields(),
+    ))
+
+def show_series():
+    uploaded_files = st.file_uploader("Choose slices or zip archives of slices...", type=["jpg", "png", "jpeg", "zip"], accept_multiple_files=True)
+    batch_size = st.number_input("Batch size", min_value=1, max_value=64, value=Configs.BATCH_SIZE)
+
+    if uploaded_files and st.button("Segment series"):
+        stats = SeriesStats()
+        progress = st.empty()
+        rows = []
+        masks_zip = io.BytesIO()
+        try:
+            with zipfile.ZipFile(masks_zip, "w") as archive, queue_notices(st.empty()):
+                for name, mask in segment_series(iter_uploaded_slices(uploaded_files), int(batch_size), stats):
+                    archive.writestr(f"{os.path.splitext(name)[0]}_mask.png", encode_mask_png(mask))
+                    rows.append({"slice": name, **class_fractions(mask)})
+                    progress.write(f"Segmented {stats.slices} slices · {stats.slices_per_second:.1f} slices/s")
+        except Exception as e:
+            st.error(f"An error occurred during segmentation: {e}")
+            logging.error(f"An error occurred during segmentation: {e}")
+            return
+        st.session_state["series_results"] = (rows, masks_zip.getvalue(), stats.slices, stats.elapsed, stats.inference_time)
+
+    if "series_results" in st.session_state:
+        rows, masks_zip, slices, elapsed, inference_time = st.session_state["series_results"]
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Slices", slices)
+        col2.metric("Throughput (slices/s)", round(slices / elapsed, 2) if elapsed else 0)
+        col3.metric("Model Time (s)", round(inference_time, 2))
+        st.markdown("### Class Coverage per Slice")
+        st.dataframe(rows)
+        st.download_button("Download masks", masks_zip, file_name="segmentation_masks.zip", mime="application/zip")
 
 def show():
     setup_database()
     
     st.title("Image Segmentation Page")
 
+    mode = st.radio("Mode", ["Single image", "Image series"], horizontal=True)
+    if mode == "Image series":
+        show_series()
+        return
+
+    renderer = st.radio("Renderer", ["Fast overlay", "Matplotlib contours"], horizontal=True)
     uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "png", "jpeg"])
 
     if uploaded_file is not None:
         try:
-            image = Image.open(uploaded_file)
-            st.image(image, caption='Uploaded Image', use_column_width=True)
+            trace = Trace()
+            image_bytes = uploaded_file.getvalue()
+            with trace.stage("decode"):
+                ingested = ingest_image(image_bytes)
+            st.image(ingested.preview, caption='Uploaded Image', use_column_width=True)
             st.write("")
             st.write("Segmenting...")
 
-            input_image, seg_info, preds_argmax, inference_time = predict(image)
-            st.write(f"Inference Time: {inference_time:.4f} seconds")
+            # Contours are drawn over the exact full-resolution mask, overlays over the configured post-processing
+            contours = renderer == "Matplotlib contours"
+            version = result_version("full" if contours else Configs.POSTPROCESS)
+            with trace.stage("cache_lookup"):
+                preds_argmax = mask_cache.get(ingested.digest, Configs.MODEL_NAME, version)
+            cached = preds_argmax is not None
+            inference_time = postprocess_time = 0.0
+
+            wait_notice = st.empty()
+            if cached:
+                st.write("Segmentation served from the result cache.")
+            elif inference_client.enabled():
+                # The service post-processes, caches and logs the inference itself
+                preds_argmax, inference_time = inference_client.segment(image_bytes,
+                                                                         postprocess="full" if contours else None)
+            elif contours:
+                with queue_notices(wait_notice):
+                    _, _, preds_argmax, inference_time = predict(ingested, trace=trace)
+                postprocess_time = trace.stages["postprocess"]
+            else:
+                with queue_notices(wait_notice):
+                    preds_argmax, inference_time, postprocess_time = predict_mask(ingested, trace=trace)
+            if not cached:
+                st.write(f"Inference Time: {inference_time:.4f} seconds")
 
-            plot = plot_segmentation(input_image, seg_info, preds_argmax)
-            st.pyplot(plot)
+            with trace.stage("render"):
+                if contours:
+                    def render():
+                        seg_info = [(preds_argmax == idx, class_name) for idx, class_name in enumerate(Configs.CLASSES, 1)]
+                        return render_contours(ingested.preview, seg_info, preds_argmax)
+                    st.image(mask_cache.overlay(ingested.digest, Configs.MODEL_NAME, version, "contours", render),
+                             use_column_width=True)
+                else:
+                    overlay = mask_cache.overlay(ingested.digest, Configs.MODEL_NAME, version, "overlay",
+                                                 lambda: render_overlay(ingested.preview, preds_argmax))
+                    st.image(overlay, use_column_width=True)
+            st.caption(f"Post-processing: {postprocess_time:.4f} s · Rendering: {trace.stages['render']:.4f} s")
 
             st.markdown("### Class Labels")
             for class_name, color in class2hexcolor.items():
                 st.markdown(f"<span style='color:{color};'>⬤</span> {class_name}", unsafe_allow_html=True)
 
-            save_inference_details(Configs.MODEL_NAME, image, preds_argmax, inference_time)
-            st.write("Inference details saved to database.")
+            if not cached and not inference_client.enabled():
+                mask_cache.put(ingested.digest, Configs.MODEL_NAME, version, preds_argmax)
+                save_inference_details(Configs.MODEL_NAME, ingested.preview, preds_argmax, inference_time,
+                                       image_bytes=image_bytes, trace=trace, content_hash=ingested.digest,
+                                       model_version=version)
+                st.write("Inference details saved to database.")
 
         except Exception as e:
             st.error(f"An error occurred during segmentation: {e}")
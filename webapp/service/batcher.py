@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    """Raised by MicroBatcher.submit when the queue is at capacity; the server answers 503."""
+
+
+class MicroBatcher:
+    """Coalesces concurrent requests for one model into batches.
+
+    A batch is dispatched when it reaches `max_batch_size` items or `max_wait_ms` after its first item
+    arrived, whichever comes first. `handler` receives the list of items and returns one result per item
+    (an Exception instance fails only that item). Batches run one at a time on a dedicated thread, so
+    different models run in parallel while each model sees a single caller.
+    """
+
+    def __init__(self, name, handler, max_batch_size=8, max_wait_ms=10, max_queue=64):
+        self.name = name
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"batch-{name}")
+        self._task = None
+        self.batches = 0
+        self.items = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run(), name=f"batcher-{self.name}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFull(f"{self.name} queue is full ({self._queue.maxsize} pending)") from None
+        return await future
+
+    async def submit_many(self, items):
+        """Submits each item on its own and returns their results in order. When one fails, a full queue
+        included, the others are cancelled, so a failed request does not keep batch slots for results nobody
+        reads."""
+        tasks = [asyncio.ensure_future(self.submit(item)) for item in items]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in tasks:
+                if task in done and task.exception() is not None:
+                    raise task.exception()
+            return [task.result() for task in tasks]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "max_queue": self._queue.maxsize,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "rejected": self.rejected,
+            "busy_seconds": self.busy_seconds,
+        }
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Clients that disconnected while queued do not take a slot in the batch
+        return [(item, future) for item, future in batch if not future.cancelled()]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            start_time = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self._executor, self.handler, items)
+            except Exception as e:
+                logging.exception("%s batch of %d failed", self.name, len(items))
+                results = [e] * len(items)
+            self.busy_seconds += time.perf_counter() - start_time
+            self.batches += 1
+            self.items += len(items)
+
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
@@ -0,0 +1,290 @@
+"""Headless inference service: the chat, recommendation, MedPali and segmentation models behind a small
+asyncio HTTP/1.1 JSON API, with concurrent requests coalesced into micro-batches per model.
+
+Run from the webapp directory:
+
+    python -m service.server --port 8600
+
+and point the Streamlit app at it with ANIMA_INFERENCE_URL=http://localhost:8600.
+
+Endpoints (JSON bodies, images base64-encoded file bytes):
+
+    POST /v1/chat       {"query": str, "history": [[query, reply], ...]}  -> {"response": str}
+    POST /v1/recommend  {"prompts": [str, ...]}                           -> {"recommendations": [str, ...]}
+    POST /v1/medpali    {"image": b64, "prompts": [str, ...]}             -> {"answers": [str, ...]}
+    POST /v1/segment    {"image": b64, "postprocess": str (optional)}     -> {"mask_png": b64, "inference_time": float,
+                                                                              "class_fractions": {class: float},
+                                                                              "cached": bool}
+    GET  /health                                                          -> queue depths and batch statistics
+
+A full queue answers 503 with Retry-After rather than letting latency grow without bound.
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import urllib.parse
+
+from core import adapters, inference_client, startup
+from core.ingest import ImageRejected, check_image
+from core.inference_log import inference_logger
+from core.mask_cache import mask_cache
+from core.model_registry import current_rss_mb, registry
+from core.tracing import Trace
+from pages import chatbot, medpali, medreco, segmentation
+from service.batcher import MicroBatcher, QueueFull
+
+MAX_BODY_BYTES = 32 * 2**20
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _decode_image(data):
+    # Only the header is read here, on the event loop; pixels are decoded on the model's batch thread
+    try:
+        raw = base64.b64decode(data, validate=True)
+        check_image(raw)
+    except (binascii.Error, TypeError, ImageRejected) as e:
+        raise BadRequest(f"invalid image: {e}") from e
+    return raw
+
+
+def _field(payload, name, kind):
+    value = payload.get(name)
+    if not isinstance(value, kind):
+        raise BadRequest(f"'{name}' is required and must be a {kind.__name__}")
+    return value
+
+
+# Batch handlers: run on the model's batch thread, one result per item
+
+def run_chat(items):
+    return chatbot.generate_replies(items)
+
+def run_recommend(prompts):
+    model, tokenizer = registry.get("medreco")
+    results = [None] * len(prompts)
+    for index, response in medreco.model_predict_batch(model, tokenizer, prompts):
+        results[index] = response
+    return results
+
+def run_medpali(items):
+    images, prompts = zip(*items)
+    return medpali.generate_answers(list(images), list(prompts))
+
+def segment_result(mask, inference_time, cached):
+    return {
+        "mask_png": base64.b64encode(segmentation.encode_mask_png(mask)).decode("ascii"),
+        "inference_time": inference_time,
+        "class_fractions": {name: float(value) for name, value in segmentation.class_fractions(mask).items()},
+        "cached": cached,
+    }
+
+def run_segment(items):
+    # Items are (image bytes, post-processing mode); masks are cached and logged under their mode's version
+    trace = Trace()
+    results, ingested = [None] * len(items), {}
+    model_name = segmentation.Configs.MODEL_NAME
+    versions = [segmentation.result_version(postprocess) for _, postprocess in items]
+    with trace.stage("preprocess"):
+        for index, (raw, _) in enumerate(items):
+            try:
+                ingested[index] = segmentation.ingest_image(raw)
+            except ImageRejected as e:
+                results[index] = BadRequest(f"invalid image: {e}")
+    # Uploads segmented before, by this process or any other writing the inference database, skip the model
+    for index, item in list(ingested.items()):
+        mask = mask_cache.get(item.digest, model_name, versions[index])
+        if mask is not None:
+            results[index] = segment_result(mask, 0.0, cached=True)
+            del ingested[index]
+    if not ingested:
+        return results
+    tensors = [item.tensor for item in ingested.values()]
+    shapes = [item.original_size[::-1] for item in ingested.values()]
+    masks, inference_time = segmentation.predict_batch(tensors, shapes, trace,
+                                                       postprocess=[items[index][1] for index in ingested])
+    inference_time /= len(ingested)
+    trace = trace.scaled(1 / len(ingested))
+
+    for (index, item), mask in zip(ingested.items(), masks):
+        mask_cache.put(item.digest, model_name, versions[index], mask)
+        segmentation.save_inference_details(model_name, item.preview, mask, inference_time, image_bytes=items[index][0],
+                                            trace=trace, content_hash=item.digest, model_version=versions[index])
+        results[index] = segment_result(mask, inference_time, cached=False)
+    return results
+
+
+class InferenceService:
+    def __init__(self, max_batch_size=None, max_wait_ms=10, max_queue=64):
+        def batcher(name, handler, default_batch_size):
+            return MicroBatcher(name, handler, max_batch_size=max_batch_size or default_batch_size,
+                                max_wait_ms=max_wait_ms, max_queue=max_queue)
+
+        self.batchers = {
+            "chat": batcher("chat", run_chat, 8),
+            "recommend": batcher("recommend", run_recommend, medreco.MAX_BATCH_SIZE),
+            "medpali": batcher("medpali", run_medpali, 8),
+            "segment": batcher("segment", run_segment, segmentation.Configs.BATCH_SIZE),
+        }
+        self.routes = {
+            ("POST", "/v1/chat"): self.chat,
+            ("POST", "/v1/recommend"): self.recommend,
+            ("POST", "/v1/medpali"): self.medpali,
+            ("POST", "/v1/segment"): self.segment,
+            ("GET", "/health"): self.health,
+        }
+
+    async def chat(self, payload):
+        query = _field(payload, "query", str)
+        history = [tuple(turn) for turn in payload.get("history", [])]
+        if any(len(turn) != 2 for turn in history):
+            raise BadRequest("'history' must be a list of [query, reply] pairs")
+        return {"response": await self.batchers["chat"].submit((query, history))}
+
+    async def recommend(self, payload):
+        prompts = _field(payload, "prompts", list)
+        # Each prompt is queued on its own, so one request's prompts can share batches with other clients'
+        results = await self.batchers["recommend"].submit_many([str(prompt) for prompt in prompts])
+        return {"recommendations": results}
+
+    async def medpali(self, payload):
+        image = _decode_image(_field(payload, "image", str))
+        prompts = _field(payload, "prompts", list)
+        answers = await self.batchers["medpali"].submit_many([(image, str(prompt)) for prompt in prompts])
+        return {"answers": answers}
+
+    async def segment(self, payload):
+        postprocess = payload.get("postprocess", segmentation.Configs.POSTPROCESS)
+        if postprocess not in segmentation.Configs.POSTPROCESS_MODES:
+            raise BadRequest(f"'postprocess' must be one of {', '.join(segmentation.Configs.POSTPROCESS_MODES)}")
+        return await self.batchers["segment"].submit((_decode_image(_field(payload, "image", str)), postprocess))
+
+    async def health(self, payload):
+        return {
+            "status": "ok",
+            "rss_mb": current_rss_mb(),
+            "models": registry.snapshot(),
+            "queues": {name: batcher.stats() for name, batcher in self.batchers.items()},
+            "startup": startup.report(),
+            "mask_cache": mask_cache.stats(),
+            "adapters": adapters.stats(),
+        }
+
+    async def dispatch(self, method, path, body):
+        path = urllib.parse.urlsplit(path).path
+        handler = self.routes.get((method, path))
+        if handler is None:
+            known_path = any(route_path == path for _, route_path in self.routes)
+            return (405, {"error": "method not allowed"}) if known_path else (404, {"error": "not found"})
+        try:
+            payload = json.loads(body) if body else {}
+            if not isinstance(payload, dict):
+                raise BadRequest("request body must be a JSON object")
+            return 200, await handler(payload)
+        except (BadRequest, json.JSONDecodeError, UnicodeDecodeError) as e:
+            return 400, {"error": str(e)}
+        except QueueFull as e:
+            return 503, {"error": str(e)}
+        except Exception as e:
+            logging.exception("%s %s failed", method, path)
+            return 500, {"error": str(e)}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "malformed request line"}, keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": f"body exceeds {MAX_BODY_BYTES} bytes"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, payload = await self.dispatch(method, path, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        data = json.dumps(payload).encode("utf-8")
+        head = [
+            f"HTTP/1.1 {status} {REASONS[status]}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(data)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if status == 503:
+            head.append("Retry-After: 1")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+        await writer.drain()
+
+    async def serve(self, host, port, preload=()):
+        await asyncio.get_running_loop().run_in_executor(None, startup.preload, preload)
+        for batcher in self.batchers.values():
+            batcher.start()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logging.info("Serving on %s", ", ".join(str(sock.getsockname()) for sock in server.sockets))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for batcher in self.batchers.values():
+                await batcher.stop()
+            inference_logger.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--max-batch-size", type=int, default=None,
+                        help="items per batch for every model (default: per-model)")
+    parser.add_argument("--max-wait-ms", type=float, default=10,
+                        help="how long a batch waits for more requests after its first one")
+    parser.add_argument("--max-queue", type=int, default=64,
+                        help="queued items per model before requests are rejected with 503")
+    parser.add_argument("--preload", nargs="*", default=list(startup.PRELOAD), choices=startup.MODELS,
+                        help="models to load before accepting requests (default: ANIMA_PRELOAD)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # The service runs the models itself; never forward to another service
+    inference_client.INFERENCE_SERVICE_URL = ""
+    inference_logger.start()
+
+    service = InferenceService(max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms, max_queue=args.max_queue)
+    try:
+        asyncio.run(service.serve(args.host, args.port, preload=args.preload))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()